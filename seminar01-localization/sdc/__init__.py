@@ -0,0 +1,61 @@
+# Публичные имена пакета и модули, в которых они определены. Модули импортируются лениво,
+# при первом обращении к имени (PEP 562), поэтому `import sdc` не загружает numpy и matplotlib.
+_EXPORTS = {
+    'Timestamp': 'timestamp',
+    'Car': 'car',
+    'CarState': 'car',
+    'CarSensorBase': 'car_sensor_base',
+    'MovementModelBase': 'movement_model_base',
+    'LinearMovementModel': 'linear_movement_model',
+    'CircleMovementModel': 'circle_movement_model',
+    'CycloidMovementModel': 'cycloid_movement_model',
+    'GpsSensor': 'gps_sensor',
+    'CanSensor': 'can_sensor',
+    'ImuSensor': 'imu_sensor',
+    'LandmarkSensor': 'sensor_landmark',
+    'LandmarksSensor': 'sensor_landmark',
+    'KalmanCar': 'kalman_car',
+    'StateLayout': 'state_layout',
+    'KalmanMovementModel': 'kalman_movement_model',
+    'KalmanSensorBase': 'kalman_sensor_base',
+    'KalmanGpsSensor': 'kalman_gps_sensor',
+    'KalmanCanSensor': 'kalman_can_sensor',
+    'KalmanImuSensor': 'kalman_imu_sensor',
+    'kalman_transit_covariance': 'kalman_filter',
+    'kalman_process_observation': 'kalman_filter',
+    'filter_arrays': 'kalman_batch',
+    'ImmFilter': 'imm_filter',
+    'EkfSlamCar': 'ekf_slam',
+    'associate': 'data_association',
+    'LandmarkGrid': 'data_association',
+    'FastSlam': 'fast_slam',
+    'GridLocalization': 'grid_localization',
+    'ParticleFilter': 'particle_filter',
+    'KldParticleFilter': 'particle_filter',
+    'StreamingMetrics': 'metrics',
+    'FleetFilter': 'fleet_service',
+    'LocalizationService': 'fleet_service',
+    'LogReplayer': 'replay',
+    'DriftProcess': 'sensor_drift',
+    'ScenarioCache': 'scenario_cache',
+    'TrajectoryLod': 'trajectory_lod',
+    'CarPlotter': 'car_plotter',
+    'CarAnimator': 'car_plotter',
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    import importlib
+    value = getattr(importlib.import_module(f'.{module_name}', __name__), name)
+    # Следующие обращения не проходят через __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
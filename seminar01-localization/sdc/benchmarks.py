@@ -0,0 +1,341 @@
+import os
+import re
+import sys
+import subprocess
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from .timestamp import Timestamp
+
+
+# Зарегистрированные бенчмарки: имя -> (функция подготовки, список параметров)
+BENCHMARKS = {}
+
+
+def register(params=(None,)):
+    """Регистрирует бенчмарк. Декорируемая функция получает параметр и возвращает функцию без аргументов,
+    время выполнения которой измеряется (вся подготовка выполняется до ее возврата)."""
+    def decorator(setup):
+        BENCHMARKS[setup.__name__] = (setup, list(params))
+        return setup
+    return decorator
+
+
+def _make_car(movement_model_name, with_sensors=False):
+    from .scenario import make_car, make_scenario, MOVEMENT_MODELS
+    assert movement_model_name in MOVEMENT_MODELS
+    scenario = make_scenario(movement_model=movement_model_name)
+    if movement_model_name == 'cycloid':
+        scenario['movement_model_params'] = {'x_vel': 2., 'y_vel': 0.5, 'omega': 0.4}
+    if not with_sensors:
+        scenario['sensors'] = {}
+    return make_car(scenario, random_state=0)
+
+
+@register()
+def timestamp_arithmetic(_):
+    a = Timestamp(1, 500)
+    b = Timestamp.milliseconds(100)
+
+    def run():
+        c = a + b
+        c = c - b
+        c += b
+        return c < a
+    return run
+
+
+@register(params=['linear', 'circle', 'cycloid'])
+def car_move(movement_model_name):
+    car = _make_car(movement_model_name)
+    dt = Timestamp.milliseconds(10)
+
+    def run():
+        car.move(dt)
+        # История не должна расти все время замера, иначе память и время шага зависят от --min-time
+        if len(car._positions_x) > 10000:
+            car.clear_history()
+    return run
+
+
+@register(params=['gps', 'can', 'imu'])
+def sensor_observe(sensor_name):
+    car = _make_car('circle', with_sensors=True)
+    sensor = {str(sensor).lower(): sensor for sensor in car.sensors}[sensor_name]
+    calls_number = 0
+
+    def run():
+        nonlocal calls_number
+        # Сброс кеша наблюдения, чтобы каждый вызов генерировал новое показание
+        sensor._last_time = None
+        sensor.observe()
+        calls_number += 1
+        if calls_number % 10000 == 0:
+            sensor.clear_history()
+    return run
+
+
+@register(params=[5, 20, 100])
+def kalman_transit_covariance(state_size):
+    from .kalman_filter import kalman_transit_covariance
+    gen = np.random.RandomState(0)
+    A = gen.normal(size=(state_size, state_size))
+    S = np.dot(A, A.T)
+    J = np.eye(state_size) + 0.01 * gen.normal(size=(state_size, state_size))
+    R = 0.01 * np.eye(state_size)
+    return lambda: kalman_transit_covariance(S, J, R)
+
+
+@register(params=[5, 20, 100])
+def kalman_process_observation(state_size):
+    from .kalman_filter import kalman_process_observation
+    gen = np.random.RandomState(0)
+    A = gen.normal(size=(state_size, state_size))
+    S = np.dot(A, A.T) + np.eye(state_size)
+    mu = gen.normal(size=state_size)
+    observation_size = max(1, state_size // 2)
+    C = gen.normal(size=(observation_size, state_size))
+    Q = np.eye(observation_size)
+    z = gen.normal(size=observation_size)
+    return lambda: kalman_process_observation(mu, S, z, C, Q)
+
+
+@register(params=['default', 'acc_bias'])
+def kalman_car_move(layout_name):
+    from .kalman_car import KalmanCar
+    from .kalman_movement_model import KalmanMovementModel
+    from .state_layout import StateLayout, DEFAULT_STATE_LAYOUT
+    layouts = {
+        'default': DEFAULT_STATE_LAYOUT,
+        'acc_bias': StateLayout(['pos_x', 'pos_y', 'yaw', 'vel', 'omega', 'acc', 'vel_bias', 'omega_bias']),
+    }
+    layout = layouts[layout_name]
+    kalman_car = KalmanCar(
+        initial_position=[0., 0.], initial_velocity=5., initial_yaw=0., initial_omega=0.1, state_layout=layout,
+        movement_model=KalmanMovementModel(0.01 * np.eye(layout.size)))
+    dt = Timestamp.milliseconds(10)
+
+    def run():
+        kalman_car.move(dt)
+        if len(kalman_car._positions_x) > 10000:
+            kalman_car.clear_history()
+    return run
+
+
+@register(params=[10, 100, 1000])
+def landmarks_local_frame(landmarks_number):
+    from .sensor_landmark import get_landmarks_position_in_local_frame
+    landmarks_xy = np.random.RandomState(0).uniform(-50, 50, size=(landmarks_number, 2))
+    return lambda: get_landmarks_position_in_local_frame(1., 2., 0.3, landmarks_xy)
+
+
+@register(params=[1000, 10000, 100000])
+def landmark_association(landmarks_number):
+    from .ekf_slam import EkfSlamCar, get_landmark_observation_jacobians
+    gen = np.random.RandomState(0)
+    # Плотность маяков не зависит от размера карты
+    half_size = 3. * np.sqrt(landmarks_number)
+    landmarks_xy = gen.uniform(-half_size, half_size, size=(landmarks_number, 2))
+    car = EkfSlamCar(
+        initial_landmarks_capacity=landmarks_number, initial_position=[0., 0.], initial_velocity=1.,
+        initial_covariance_matrix=1e-4 * np.eye(5))
+    noise_covariance = np.diag([0.05, 0.05])
+    observations, _, _ = get_landmark_observation_jacobians(car.state, landmarks_xy)
+    for i, observation in enumerate(observations):
+        car.process_landmark_observation(i, observation, noise_covariance)
+    visible = np.hypot(observations[:, 0], observations[:, 1]) < 15
+    detections = observations[visible][:20] + gen.normal(scale=0.1, size=(min(20, np.sum(visible)), 2))
+    return lambda: car.associate_landmarks_observations(detections, noise_covariance)
+
+
+@register(params=['moments', 'fused'])
+def landmarks_log_likelihood(method):
+    from .grid_localization import get_landmarks_log_likelihood
+    from .likelihood import get_landmarks_log_likelihood_fused
+    kernels = {'moments': get_landmarks_log_likelihood, 'fused': get_landmarks_log_likelihood_fused}
+    gen = np.random.RandomState(0)
+    # 100000 частиц x 100 маяков
+    x, y, yaw = gen.uniform(-50, 50, size=(3, 100000))
+    landmarks_xy = gen.uniform(-50, 50, size=(100, 2))
+    observations = gen.normal(size=(100, 2))
+    return lambda: kernels[method](x, y, yaw, observations, landmarks_xy, np.eye(2))
+
+
+def _make_particle_filter_step(particles_number, dtype=None):
+    from .particle_filter import ParticleFilter, get_uniform_particles
+    gen = np.random.RandomState(0)
+    landmarks_xy = gen.uniform(-50, 50, size=(10, 2))
+    observations = gen.normal(size=(10, 2))
+    noise_covariance = np.eye(2)
+    particles = get_uniform_particles(particles_number, 100., (1., 3.), random_state=0)
+    particle_filter = ParticleFilter(
+        particles, noise_covariance_density=0.01 * np.eye(5), resample_threshold=1.1, random_state=0, dtype=dtype)
+    dt = Timestamp.milliseconds(100)
+
+    def run():
+        particle_filter.move(dt)
+        particle_filter.process_landmarks_observations(observations, landmarks_xy, noise_covariance)
+    return run
+
+
+@register(params=[1000, 10000, 100000])
+def particle_filter_step(particles_number):
+    return _make_particle_filter_step(particles_number)
+
+
+@register(params=[10000, 100000])
+def particle_filter_step_float32(particles_number):
+    return _make_particle_filter_step(particles_number, dtype=np.float32)
+
+
+# Цели по времени холодного импорта модулей (в секундах, без учета импорта numpy)
+COLD_IMPORT_TARGETS = {
+    'sdc': 0.005,
+    'sdc.car': 0.02,
+    'sdc.kalman_car': 0.03,
+    'sdc.particle_filter': 0.03,
+}
+
+
+def measure_cold_import(module_name, repeats=5):
+    """Время импорта модуля в новом процессе (минимум по repeats запускам). numpy импортируется заранее
+    и в замер не входит."""
+    code = (
+        'import time, numpy\n'
+        't = time.perf_counter()\n'
+        f'import {module_name}\n'
+        'print(time.perf_counter() - t)\n')
+    package_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, '-c', code], cwd=package_directory, check=True, capture_output=True, text=True)
+        timings.append(float(output.stdout))
+    return min(timings)
+
+
+def measure(function, min_time=0.05, repeats=5):
+    """Время одного вызова: минимум по repeats замерам, каждый не короче min_time секунд"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(np.ceil(min_time / elapsed)))
+    timings = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return min(timings)
+
+
+def run_benchmarks(pattern=None, min_time=0.05, repeats=5, verbose=True):
+    """Запускает бенчмарки, имена которых (name[param]) подходят под регулярное выражение pattern.
+    :returns: dict {имя: секунды на вызов}
+    """
+    results = {}
+    for name, (setup, params) in BENCHMARKS.items():
+        for param in params:
+            full_name = name if param is None else f'{name}[{param}]'
+            if pattern is not None and not re.search(pattern, full_name):
+                continue
+            results[full_name] = measure(setup(param), min_time=min_time, repeats=repeats)
+            if verbose:
+                print(f'{full_name:<40} {results[full_name] * 1e6:12.2f} us', flush=True)
+    for module_name, target in COLD_IMPORT_TARGETS.items():
+        full_name = f'cold_import[{module_name}]'
+        if pattern is not None and not re.search(pattern, full_name):
+            continue
+        results[full_name] = measure_cold_import(module_name, repeats=repeats)
+        if verbose:
+            status = 'ok' if results[full_name] <= target else f'above target {target * 1e6:.0f} us'
+            print(f'{full_name:<40} {results[full_name] * 1e6:12.2f} us  {status}', flush=True)
+    return results
+
+
+def save_results(path, results):
+    with open(path, 'w') as output:
+        json.dump({
+            'machine': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results,
+        }, output, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    with open(path) as input_file:
+        return json.load(input_file)['results']
+
+
+def compare(baseline, current, threshold=1.25):
+    """Сравнивает результаты с базовыми.
+    :returns: (строки отчета, список имен бенчмарков, замедлившихся больше чем в threshold раз)
+    """
+    lines = ['{:<40} {:>14} {:>14} {:>8}'.format('benchmark', 'baseline[us]', 'current[us]', 'ratio')]
+    regressions = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            lines.append('{:<40} {:>14} {:>14}'.format(
+                name, '-' if name not in baseline else f'{baseline[name] * 1e6:.2f}',
+                '-' if name not in current else f'{current[name] * 1e6:.2f}'))
+            continue
+        ratio = current[name] / baseline[name]
+        mark = ''
+        if ratio > threshold:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        elif ratio < 1. / threshold:
+            mark = '  improved'
+        lines.append('{:<40} {:>14.2f} {:>14.2f} {:>8.2f}{}'.format(
+            name, baseline[name] * 1e6, current[name] * 1e6, ratio, mark))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бенчмарки горячих участков пакета sdc')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='запустить бенчмарки')
+    run_parser.add_argument('--filter', default=None, help='регулярное выражение для имен бенчмарков')
+    run_parser.add_argument('--output', default=None, help='файл для сохранения результатов (json)')
+    run_parser.add_argument('--min-time', type=float, default=0.05)
+    compare_parser = subparsers.add_parser('compare', help='сравнить с базовыми результатами')
+    compare_parser.add_argument('baseline', help='файл с базовыми результатами')
+    compare_parser.add_argument('current', nargs='?', default=None,
+                                help='файл с текущими результатами; если не указан, бенчмарки запускаются')
+    compare_parser.add_argument('--filter', default=None)
+    compare_parser.add_argument('--threshold', type=float, default=1.25,
+                                help='допустимое отношение текущего времени к базовому')
+    compare_parser.add_argument('--min-time', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.filter, min_time=args.min_time)
+        if args.output is not None:
+            save_results(args.output, results)
+        return 0
+
+    baseline = load_results(args.baseline)
+    if args.current is not None:
+        current = load_results(args.current)
+    else:
+        pattern = args.filter if args.filter is not None else '|'.join(re.escape(name) for name in baseline)
+        current = run_benchmarks(pattern, min_time=args.min_time, verbose=False)
+        baseline = {name: value for name, value in baseline.items() if name in current}
+    lines, regressions = compare(baseline, current, threshold=args.threshold)
+    print('\n'.join(lines))
+    if regressions:
+        print(f'{len(regressions)} regression(s) above x{args.threshold}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
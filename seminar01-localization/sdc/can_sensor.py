@@ -3,7 +3,8 @@ from .car_sensor_base import CarSensorBase
 
 
 class CanSensor(CarSensorBase):
-    """Датчик одометрии. Измеряет линейную скорость автомобиля."""
+    """Датчик одометрии. Измеряет линейную скорость автомобиля.
+    Смещение и ошибка масштаба задаются параметрами bias и scale_drift (см. CarSensorBase, sensor_drift.py)"""
     def __init__(self, *args, **kwargs):
         super(CanSensor, self).__init__(*args, **kwargs)
 
@@ -16,9 +17,3 @@ class CanSensor(CarSensorBase):
 
     def _observe_clear(self):
         return np.array([self._car._velocity])
-
-
-if __name__ != '__main__':
-    sensor = CanSensor(noise_variances=[15])
-    assert sensor.observation_size == 1
-    assert np.all(sensor.get_noise_covariance() == np.diag([15]))
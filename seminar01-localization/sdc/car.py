@@ -1,12 +1,25 @@
+import math
 import typing as T
 import numpy as np
 from .timestamp import Timestamp
+from .instrumentation import stage
+from .state_layout import DEFAULT_STATE_LAYOUT
 from .movement_model_base import MovementModelBase
 from .car_sensor_base import CarSensorBase
-from .can_sensor import CanSensor
-from .gps_sensor import GpsSensor
-from .imu_sensor import ImuSensor
-from .sensor_landmark import LandmarkSensor
+
+
+class CarState(T.NamedTuple):
+    """Снимок состояния автомобиля в виде обычных чисел float вместе с производными величинами.
+    Вычисляется одним проходом по вектору состояния и кешируется до его изменения."""
+    position_x: float
+    position_y: float
+    yaw: float
+    velocity: float
+    omega: float
+    cos_yaw: float
+    sin_yaw: float
+    velocity_x: float
+    velocity_y: float
 
 
 class Car:
@@ -20,11 +33,12 @@ class Car:
     с некоторым шумом.
     """
 
-    POS_X_INDEX = 0
-    POS_Y_INDEX = 1
-    YAW_INDEX = 2
-    VEL_INDEX = 3
-    OMEGA_INDEX = 4
+    STATE_LAYOUT = DEFAULT_STATE_LAYOUT
+    POS_X_INDEX = DEFAULT_STATE_LAYOUT.index('pos_x')
+    POS_Y_INDEX = DEFAULT_STATE_LAYOUT.index('pos_y')
+    YAW_INDEX = DEFAULT_STATE_LAYOUT.index('yaw')
+    VEL_INDEX = DEFAULT_STATE_LAYOUT.index('vel')
+    OMEGA_INDEX = DEFAULT_STATE_LAYOUT.index('omega')
 
     def __init__(
             self,
@@ -62,12 +76,9 @@ class Car:
             self.initial_omega = float(initial_omega)
 
         # Инициализация состояния автомобиля
-        self._state = np.zeros(5)
-        self._position_x = self.initial_position[0]
-        self._position_y = self.initial_position[1]
-        self._yaw = self.initial_yaw
-        self._velocity = self.initial_velocity
-        self._omega = self.initial_omega
+        self._set_state_values(
+            self.initial_position[0], self.initial_position[1], self.initial_yaw,
+            self.initial_velocity, self.initial_omega)
 
         self._time = Timestamp()
         assert self._time.nsec == 0 and self._time.sec == 0
@@ -89,13 +100,16 @@ class Car:
         self._velocities = []
         self._yaws = []
         self._omegas = []
+        # Номер истории: растет при каждой очистке, чтобы кеши по истории (CarPlotter) могли заметить очистку
+        self._history_generation = 0
 
     def __str__(self):
+        state = self._state_view
         return '{}(x={:.2f}[m], y={:.2f}[m], yaw={:.2f}[rad], v={:.2f}[m/s], '\
             'omega={:.2f}[rad/s], t={})'.format(
                 type(self).__name__,
-                self._position_x, self._position_y, self._yaw, self._velocity,
-                self._omega, self.time)
+                state.position_x, state.position_y, state.yaw, state.velocity,
+                state.omega, self.time)
 
     def set_movement_model(
             self, movement_model: T.Optional[MovementModelBase]):
@@ -109,6 +123,11 @@ class Car:
             self._movement_model = None
 
     def add_sensor(self, sensor):
+        # Модули сенсоров импортируются только при добавлении сенсора
+        from .can_sensor import CanSensor
+        from .gps_sensor import GpsSensor
+        from .imu_sensor import ImuSensor
+        from .sensor_landmark import LandmarkSensor
         assert isinstance(sensor, CarSensorBase)
         if isinstance(sensor, CanSensor):
             self._can_sensor = sensor
@@ -125,15 +144,33 @@ class Car:
 
     def move(self, dt):
         assert isinstance(dt, Timestamp)
-        self._movement_model._move(dt)
+        with stage('Car.move.movement_model'):
+            self._movement_model._move(dt)
         # Храним историю состояний
-        self._positions_x.append(self._position_x)
-        self._positions_y.append(self._position_y)
-        self._yaws.append(self._yaw)
-        self._velocities.append(self._velocity)
-        self._velocities_x.append(self._velocity_x)
-        self._velocities_y.append(self._velocity_y)
-        self._omegas.append(self._omega)
+        with stage('Car.move.history_append'):
+            self._append_history()
+
+    def _append_history(self):
+        state = self._state_view
+        self._positions_x.append(state.position_x)
+        self._positions_y.append(state.position_y)
+        self._yaws.append(state.yaw)
+        self._velocities.append(state.velocity)
+        self._velocities_x.append(state.velocity_x)
+        self._velocities_y.append(state.velocity_y)
+        self._omegas.append(state.omega)
+
+    def clear_history(self):
+        """Очищает историю состояний, например при долгом воспроизведении журнала, где она не нужна"""
+        for history in (self._positions_x, self._positions_y, self._yaws, self._velocities,
+                        self._velocities_x, self._velocities_y, self._omegas):
+            history.clear()
+        self._history_generation += 1
+
+    @property
+    def history_generation(self):
+        """Число очисток истории (clear_history)"""
+        return self._history_generation
 
     ######################################################################
     #  Доступ к компонентам автомобиля - модели движения и сенсорам      #
@@ -165,73 +202,128 @@ class Car:
     ######################################################################
     # Доступ к переменным состояния модели (на самом деле скрыты от нас) #
     ######################################################################
+    # Вектор состояния хранится в self._state_vector. Все записи в него проходят через методы ниже
+    # и сбрасывают кешированный снимок self._cached_state_view; чтение отдельных компонент
+    # и производных величин (скорости по осям) берется из снимка и не требует операций numpy.
+    @property
+    def _state(self):
+        return self._state_vector
+
+    @_state.setter
+    def _state(self, state):
+        self._state_vector = state
+        self._cached_state_view = None
+
+    @property
+    def _state_view(self):
+        """Снимок состояния CarState, пересчитывается только после изменения состояния"""
+        state_view = self._cached_state_view
+        if state_view is None:
+            values = self._state_vector.tolist()
+            position_x = values[self.POS_X_INDEX]
+            position_y = values[self.POS_Y_INDEX]
+            yaw = values[self.YAW_INDEX]
+            velocity = values[self.VEL_INDEX]
+            omega = values[self.OMEGA_INDEX]
+            cos_yaw = math.cos(yaw)
+            sin_yaw = math.sin(yaw)
+            state_view = CarState(
+                position_x, position_y, yaw, velocity, omega,
+                cos_yaw, sin_yaw, velocity * cos_yaw, velocity * sin_yaw)
+            self._cached_state_view = state_view
+        return state_view
+
+    def _set_state_layout(self, state_layout):
+        """Задает раскладку вектора состояния. Вызывается до инициализации состояния."""
+        self.STATE_LAYOUT = state_layout
+        self.POS_X_INDEX = state_layout.index('pos_x')
+        self.POS_Y_INDEX = state_layout.index('pos_y')
+        self.YAW_INDEX = state_layout.index('yaw')
+        self.VEL_INDEX = state_layout.index('vel')
+        self.OMEGA_INDEX = state_layout.index('omega')
+
+    def _set_state_values(self, position_x, position_y, yaw, velocity, omega):
+        """Записывает все основные компоненты состояния за одну операцию. Дополнительные поля раскладки
+        (ускорение, смещения датчиков) обнуляются."""
+        state = np.zeros(self.STATE_LAYOUT.size, dtype=np.float64)
+        state[self.POS_X_INDEX] = position_x
+        state[self.POS_Y_INDEX] = position_y
+        state[self.YAW_INDEX] = yaw
+        state[self.VEL_INDEX] = velocity
+        state[self.OMEGA_INDEX] = omega
+        self._state = state
+
+    def _set_state_element(self, index, value):
+        self._state_vector[index] = value
+        self._cached_state_view = None
+
     @property
     def _state_size(self):
-        return len(self._state)
+        return len(self._state_vector)
 
     @property
     def _position_x(self):
-        return self._state[self.POS_X_INDEX]
+        return self._state_view.position_x
 
     @_position_x.setter
     def _position_x(self, position_x):
-        self._state[self.POS_X_INDEX] = position_x
+        self._set_state_element(self.POS_X_INDEX, position_x)
 
     @property
     def _position_y(self):
-        return self._state[self.POS_Y_INDEX]
+        return self._state_view.position_y
 
     @_position_y.setter
     def _position_y(self, position_y):
-        self._state[self.POS_Y_INDEX] = position_y
+        self._set_state_element(self.POS_Y_INDEX, position_y)
 
     @property
     def _yaw(self):
-        return self._state[self.YAW_INDEX]
+        return self._state_view.yaw
 
     @_yaw.setter
     def _yaw(self, yaw):
-        self._state[self.YAW_INDEX] = yaw
+        self._set_state_element(self.YAW_INDEX, yaw)
 
     @property
     def _velocity(self):
-        return self._state[self.VEL_INDEX]
+        return self._state_view.velocity
 
     @_velocity.setter
     def _velocity(self, velocity):
-        self._state[self.VEL_INDEX] = velocity
+        self._set_state_element(self.VEL_INDEX, velocity)
 
     @property
     def _linear_velocity(self):
-        return self._state[self.VEL_INDEX]
+        return self._state_view.velocity
 
     @_linear_velocity.setter
     def _linear_velocity(self, linear_velocity):
-        self._state[self.VEL_INDEX] = linear_velocity
+        self._set_state_element(self.VEL_INDEX, linear_velocity)
 
     @property
     def _velocity_x(self):
-        return self._velocity * np.cos(self._yaw)
+        return self._state_view.velocity_x
 
     @property
     def _velocity_y(self):
-        return self._velocity * np.sin(self._yaw)
+        return self._state_view.velocity_y
 
     @property
     def _omega(self):
-        return self._state[self.OMEGA_INDEX]
+        return self._state_view.omega
 
     @_omega.setter
     def _omega(self, omega):
-        self._state[self.OMEGA_INDEX] = omega
+        self._set_state_element(self.OMEGA_INDEX, omega)
 
     @property
     def _angular_velocity(self):
-        return self._state[self.OMEGA_INDEX]
+        return self._state_view.omega
 
     @_angular_velocity.setter
     def _angular_velocity(self, angular_velocity):
-        self._state[self.OMEGA_INDEX] = angular_velocity
+        self._set_state_element(self.OMEGA_INDEX, angular_velocity)
 
     @property
     def time(self):
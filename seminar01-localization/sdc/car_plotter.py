@@ -1,13 +1,16 @@
+import weakref
 import numpy as np
-from matplotlib.patches import Ellipse, Rectangle
 
 from .car import Car
+from .trajectory_lod import TrajectoryLod
 
 
 class CarPlotter:
+    # matplotlib импортируется внутри методов отрисовки: им все равно передается уже созданное полотно,
+    # а импорт модуля без отрисовки не должен загружать matplotlib
     def __init__(self, car_width=1, car_height=0.5,
                  real_color='g', obs_color='b', pred_color='r',
-                 head_width=1):
+                 head_width=1, trajectory_tolerance=0.05, max_trajectory_points=4096):
         """
         :param car_width: Ширина автомобиля
         :param car_height: Длина автомобиля
@@ -15,6 +18,8 @@ class CarPlotter:
         :param obs_color: Цвет для отрисовки наблюдений
         :param pred_color: Цвет для отрисовки калмановского предсказания
         :param head_width: Ширина стрелки при отрисовке скорости автомобиля
+        :param trajectory_tolerance: Допустимое отклонение прореженной траектории от исходной
+        :param max_trajectory_points: Максимальное число отрисовываемых точек траектории
         """
         self.car_width = car_width
         self.car_height = car_height
@@ -27,11 +32,17 @@ class CarPlotter:
         self.obs_vel_ = None
         self.head_width = head_width
 
+        self.trajectory_tolerance = trajectory_tolerance
+        self.max_trajectory_points = max_trajectory_points
+        # Прореженные траектории и максимальные модули скоростей, обновляемые по мере движения автомобилей
+        self._trajectories = weakref.WeakKeyDictionary()
+
     def plot_car(self, ax, car, marker_size=6):
         """Отрисовывает положение автомобиля и покзания GPS и одометрии.
         :param marker_size: Линейный размер точки положения и GPS-показания
         :param color: Цвет
         """
+        from matplotlib.patches import Rectangle
         assert isinstance(car, Car)
         real_position_x = car._position_x
         real_position_y = car._position_y
@@ -80,9 +91,49 @@ class CarPlotter:
         ax.arrow(position_x, position_y, velocity_x, velocity_y, color=self.pred_color,
                  head_width=self.head_width)
 
+    def _get_trajectory(self, car):
+        """Прореженная траектория автомобиля, дополненная точками, добавленными с прошлого вызова.
+        После очистки истории (Car.clear_history) траектория строится заново"""
+        trajectory, max_velocities, generation = self._trajectories.get(car, (None, None, None))
+        if trajectory is None or generation != car.history_generation or len(trajectory) > len(car._positions_x):
+            trajectory = TrajectoryLod(self.trajectory_tolerance, self.max_trajectory_points)
+            max_velocities = np.zeros(2, dtype=np.float64)
+            self._trajectories[car] = trajectory, max_velocities, car.history_generation
+        new_points_number = len(car._positions_x) - len(trajectory)
+        if new_points_number > 0:
+            begin = len(trajectory)
+            trajectory.extend(car._positions_x[begin:], car._positions_y[begin:])
+            max_velocities[0] = max(max_velocities[0], np.max(np.abs(car._velocities_x[begin:])))
+            max_velocities[1] = max(max_velocities[1], np.max(np.abs(car._velocities_y[begin:])))
+        return trajectory, max_velocities
+
     def plot_trajectory(self, ax, car, traj_color='g'):
-        """Отрисовывает весь уже проделанный автомобилем путь"""
-        ax.plot(car._positions_x, car._positions_y, linestyle='-', color=traj_color)
+        """Отрисовывает весь уже проделанный автомобилем путь.
+        Траектория прореживается с точностью trajectory_tolerance, поэтому время отрисовки не зависит
+        от длины пути."""
+        trajectory, _ = self._get_trajectory(car)
+        ax.plot(*trajectory.get_data(), linestyle='-', color=traj_color)
+
+    def plot_ellipses(self, ax, mus, sigmas, color='b', stride=1, alpha=0.3):
+        """Отрисовывает эллипсы ковариации вдоль траектории одним объектом EllipseCollection
+        :param ax: полотно
+        :param mus: центры, np.ndarray размера (T, 2)
+        :param sigmas: ковариации, np.ndarray размера (T, 2, 2); например, covariances[:, :2, :2]
+            из истории калмановского фильтра
+        :param stride: рисуется каждый stride-й эллипс
+        :returns: EllipseCollection
+        """
+        from matplotlib.collections import EllipseCollection
+        mus = np.asarray(mus, dtype=np.float64)[::stride]
+        sigmas = np.asarray(sigmas, dtype=np.float64)[::stride]
+        assert mus.ndim == 2 and mus.shape[1] == 2
+        assert sigmas.shape == (mus.shape[0], 2, 2)
+        half_widths, half_heights, angles = get_ellipses_parameters(sigmas)
+        ellipses = EllipseCollection(
+            2 * half_widths, 2 * half_heights, angles, units='xy', offsets=mus,
+            offset_transform=ax.transData, facecolors=color, edgecolors='k', alpha=alpha, zorder=5)
+        ax.add_collection(ellipses)
+        return ellipses
 
     def plot_observations(self, ax, x, y, color='b'):
         ax.plot(x, y, linestyle='-', color=color)
@@ -91,12 +142,8 @@ class CarPlotter:
         """Иногда требуется подогнать размер полотна, чтобы оно вмещало в себя всю траектория.
         Данный метод возвращает диапазоны значений вдоль каждой из осей.
         """
-        min_pos_x = np.min(car._positions_x)
-        max_pos_x = np.max(car._positions_x)
-        min_pos_y = np.min(car._positions_y)
-        max_pos_y = np.max(car._positions_y)
-        max_vel_x = np.max(np.abs(car._velocities_x))
-        max_vel_y = np.max(np.abs(car._velocities_y))
+        trajectory, (max_vel_x, max_vel_y) = self._get_trajectory(car)
+        min_pos_x, max_pos_x, min_pos_y, max_pos_y = trajectory.bounding_box
         # Дополнительная граница в полкорпуса
         max_length = max(self.car_width, self.car_height)
         x_limits = (min_pos_x - max_vel_x - 0.5 * max_length, max_pos_x + max_vel_x + 0.5 * max_length)
@@ -116,6 +163,7 @@ class CarPlotter:
         :parma marker_size: линейный размер маркера для отображения центра
         :param color: цвет маркера и эллипса
         """
+        from matplotlib.patches import Ellipse
         assert mu.shape == (2,)
         assert sigma.shape == (2, 2)
         lambda_, v = np.linalg.eig(sigma)
@@ -126,3 +174,178 @@ class CarPlotter:
         ell.set_facecolor(color)
         ax.add_artist(ell)
         return ell
+
+
+def get_ellipses_parameters(sigmas):
+    """Полуоси и углы эллипсов ковариации для стопки матриц одним вызовом np.linalg.eigh.
+    :param sigmas: np.ndarray размера (..., 2, 2)
+    :returns: (большие полуоси (...), малые полуоси (...), углы большой оси к оси oX в градусах (...))
+    """
+    lambda_, v = np.linalg.eigh(sigmas)
+    lambda_ = np.sqrt(np.maximum(lambda_, 0))
+    angles = np.rad2deg(np.arctan2(v[..., 1, 1], v[..., 0, 1]))
+    return lambda_[..., 1], lambda_[..., 0], angles
+
+
+class CarAnimator:
+    """Анимация движения автомобиля (и калмановской оценки) без пересоздания объектов на каждом кадре.
+    Все объекты отрисовки создаются один раз, а затем у них меняются только данные. Статический фон
+    (оси, сетка, легенда) запоминается, и на каждом кадре перерисовываются только движущиеся объекты
+    (blitting). Траектории прореживаются (TrajectoryLod), поэтому время кадра не растет с длиной проезда.
+
+    Пример:
+
+        animator = CarAnimator(ax, car, kalman_car, plotter=car_plotter)
+        animator.set_limits((-5, 100), (-5, 100))
+        while car.time < final_time:
+            ...
+            animator.update()
+
+    Если бэкенд не поддерживает blitting (например, inline в ноутбуке), кадр рисуется целиком, но объекты
+    по-прежнему не пересоздаются. update() возвращает список изменяемых объектов, поэтому animator
+    можно использовать и с matplotlib.animation.FuncAnimation(..., blit=True).
+    """
+    def __init__(self, ax, car, kalman_car=None, plotter=None, max_trajectory_points=2000, marker_size=6):
+        """
+        :param ax: полотно
+        :param car: Car с реальным состоянием
+        :param kalman_car: KalmanCar или None
+        :param plotter: CarPlotter, из которого берутся размеры и цвета, или None
+        :param max_trajectory_points: максимальное число отрисовываемых точек каждой траектории
+        """
+        self._ax = ax
+        self._car = car
+        self._kalman_car = kalman_car
+        self._plotter = plotter if plotter is not None else CarPlotter()
+        self._background = None
+        self._trajectories = {}
+        self._artists = []
+        self._create_artists(max_trajectory_points, marker_size)
+        self._canvas = ax.figure.canvas
+        self._canvas.mpl_connect('draw_event', self._on_draw)
+
+    def _add(self, artist):
+        artist.set_animated(True)
+        self._artists.append(artist)
+        return artist
+
+    def _create_artists(self, max_trajectory_points, marker_size):
+        from matplotlib.patches import Ellipse, Polygon
+        ax = self._ax
+        plotter = self._plotter
+        arrow_options = dict(angles='xy', scale_units='xy', scale=1, width=0.003, zorder=4)
+
+        self._real_trajectory = self._add(ax.plot([], [], linestyle='-', color=plotter.real_color)[0])
+        self._trajectories[self._real_trajectory] = self._create_trajectory(max_trajectory_points)
+        self._real_position = self._add(ax.plot(
+            [], [], marker='o', linestyle='', color=plotter.real_color, markeredgecolor='k',
+            markersize=marker_size, zorder=6)[0])
+        self._real_velocity = self._add(ax.quiver([0], [0], [0], [0], color=plotter.real_color, **arrow_options))
+        self._car_body = self._add(ax.add_patch(Polygon(
+            np.zeros((4, 2)), closed=True, facecolor='none', edgecolor='k')))
+
+        self._gps_point = None
+        self._gps_trajectory = None
+        if self._car.gps_sensor is not None:
+            self._gps_ellipse = self._add(ax.add_patch(Ellipse(
+                (0, 0), 0, 0, alpha=0.3, zorder=5, facecolor=plotter.obs_color, edgecolor='k')))
+            self._gps_point = self._add(ax.plot(
+                [], [], marker='*', linestyle='', color=plotter.obs_color, markeredgecolor='k',
+                markersize=marker_size, zorder=6)[0])
+            self._gps_trajectory = self._add(ax.plot([], [], linestyle='-', color=plotter.obs_color)[0])
+            self._trajectories[self._gps_trajectory] = self._create_trajectory(max_trajectory_points)
+
+        if self._kalman_car is not None:
+            self._kalman_trajectory = self._add(ax.plot([], [], linestyle='-', color=plotter.pred_color)[0])
+            self._trajectories[self._kalman_trajectory] = self._create_trajectory(max_trajectory_points)
+            self._kalman_ellipse = self._add(ax.add_patch(Ellipse(
+                (0, 0), 0, 0, alpha=0.3, zorder=5, facecolor=plotter.pred_color, edgecolor='k')))
+            self._kalman_position = self._add(ax.plot(
+                [], [], marker='o', linestyle='', color=plotter.pred_color, markeredgecolor='k',
+                markersize=marker_size, zorder=6)[0])
+            self._kalman_velocity = self._add(ax.quiver(
+                [0], [0], [0], [0], color=plotter.pred_color, **arrow_options))
+
+    def _create_trajectory(self, max_points):
+        return TrajectoryLod(self._plotter.trajectory_tolerance, max_points, chunk_size=256)
+
+    @property
+    def artists(self):
+        return list(self._artists)
+
+    def _on_draw(self, event):
+        """После полной перерисовки запоминаем фон без движущихся объектов"""
+        if self._canvas.supports_blit:
+            self._background = self._canvas.copy_from_bbox(self._ax.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        for artist in self._artists:
+            self._ax.draw_artist(artist)
+
+    def set_limits(self, x_limits, y_limits):
+        """Меняет границы полотна; фон будет запомнен заново при следующей полной перерисовке"""
+        self._ax.set_xlim(*x_limits)
+        self._ax.set_ylim(*y_limits)
+        self._background = None
+
+    @staticmethod
+    def _set_ellipse(ellipse, mu, sigma):
+        half_width, half_height, angle = get_ellipses_parameters(sigma)
+        ellipse.set_center(mu)
+        ellipse.set_width(2 * half_width)
+        ellipse.set_height(2 * half_height)
+        ellipse.set_angle(angle)
+
+    def _update_trajectory(self, line, x, y):
+        trajectory = self._trajectories[line]
+        trajectory.append(x, y)
+        line.set_data(*trajectory.get_data())
+
+    def update_artists(self):
+        """Обновляет данные объектов по текущему состоянию автомобилей без отрисовки.
+        :returns: список изменяемых объектов
+        """
+        car = self._car
+        plotter = self._plotter
+        x, y = car._position_x, car._position_y
+        velocity_x, velocity_y = car._velocity_x, car._velocity_y
+        self._update_trajectory(self._real_trajectory, x, y)
+        self._real_position.set_data([x], [y])
+        self._real_velocity.set_offsets([[x, y]])
+        self._real_velocity.set_UVC([velocity_x], [velocity_y])
+        angle = np.arctan2(velocity_y, velocity_x)
+        rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+        corners = 0.5 * np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) * [plotter.car_width, plotter.car_height]
+        self._car_body.set_xy(np.dot(corners, rotation.T) + [x, y])
+
+        if self._gps_point is not None:
+            observation = car.gps_sensor.observe()
+            self._set_ellipse(self._gps_ellipse, observation, car.gps_sensor.get_noise_covariance())
+            self._gps_point.set_data([observation[0]], [observation[1]])
+            self._update_trajectory(self._gps_trajectory, observation[0], observation[1])
+
+        kalman_car = self._kalman_car
+        if kalman_car is not None:
+            x, y = kalman_car._position_x, kalman_car._position_y
+            self._update_trajectory(self._kalman_trajectory, x, y)
+            self._set_ellipse(self._kalman_ellipse, (x, y), kalman_car.covariance_matrix[:2, :2])
+            self._kalman_position.set_data([x], [y])
+            self._kalman_velocity.set_offsets([[x, y]])
+            self._kalman_velocity.set_UVC([kalman_car._velocity_x], [kalman_car._velocity_y])
+        return self.artists
+
+    def update(self):
+        """Обновляет объекты и рисует кадр
+        :returns: список изменяемых объектов
+        """
+        artists = self.update_artists()
+        if self._background is None or not self._canvas.supports_blit:
+            # Полная перерисовка; фон запоминается в _on_draw
+            self._canvas.draw()
+        else:
+            self._canvas.restore_region(self._background)
+            self._draw_artists()
+            self._canvas.blit(self._ax.bbox)
+        self._canvas.flush_events()
+        return artists
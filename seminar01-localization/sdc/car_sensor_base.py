@@ -1,6 +1,7 @@
 import abc
 import numpy as np
 from .timestamp import Timestamp
+from .instrumentation import stage, count
 
 
 class CarSensorBase(abc.ABC):
@@ -24,7 +25,13 @@ class CarSensorBase(abc.ABC):
         def _observe_clear(self):
             return np.array(...)
     """
-    def __init__(self, noise_variances=None, random_state=None):
+    def __init__(self, noise_variances=None, random_state=None, bias=None, scale_drift=None):
+        """
+        :param bias: sensor_drift.DriftProcess размера observation_size или None. Смещение показаний,
+            меняющееся со временем (например, дрейф нуля гироскопа)
+        :param scale_drift: sensor_drift.DriftProcess размера observation_size или None. Ошибка масштаба:
+            показание равно (1 + s) * истинное значение
+        """
         # Даешь каждому сенсору свой генератор!
         self._gen = np.random.RandomState(random_state)
         # Устанавливем реальный уровень шума
@@ -33,6 +40,14 @@ class CarSensorBase(abc.ABC):
         else:
             self._noise_variances = np.array(noise_variances)
             assert self._noise_variances.shape == (self.observation_size,)
+        # Пары (номер компоненты, стандартное отклонение) для компонент с ненулевым шумом
+        self._noise_stds = [
+            (i, float(np.sqrt(variance))) for i, variance in enumerate(self._noise_variances) if variance > 0]
+        # Процессы дрейфа имеют свои генераторы, поток белого шума сенсора от них не зависит
+        for process in (bias, scale_drift):
+            assert process is None or process.size == self.observation_size
+        self._bias = bias
+        self._scale_drift = scale_drift
         self._car = None
         self._last_time = None
         self._last_observation = None
@@ -47,6 +62,14 @@ class CarSensorBase(abc.ABC):
     def state_size(self):
         return self._car._state_size
 
+    @property
+    def bias(self):
+        return self._bias
+
+    @property
+    def scale_drift(self):
+        return self._scale_drift
+
     def get_noise_covariance(self):
         """Диагональная матрица ковариации с истинными значениями шума"""
         return np.diag(self._noise_variances)
@@ -61,22 +84,37 @@ class CarSensorBase(abc.ABC):
         elif self._last_time == self._car.time:
             # Запрошено наблюдение в тот же момент времени
             return self._last_observation
-        observation = self._observe_clear()
+        count('CarSensorBase.observe.new_observations')
+        with stage('CarSensorBase.observe.observe_clear'):
+            observation = self._observe_clear()
         assert observation.shape == (self.observation_size,)
 
-        for i, variance in enumerate(self._noise_variances):
-            if variance > 0:
-                observation[i] += self._gen.normal(scale=np.sqrt(variance))
-        self._last_observation = observation
-        self._last_time = Timestamp.nanoseconds(self._car.time.to_nanoseconds())
-        observation = np.array(self._last_observation)
-        self._history.append(observation)
+        if self._scale_drift is not None or self._bias is not None:
+            with stage('CarSensorBase.observe.drift'):
+                # Процессы продвигаются сразу к текущему моменту, промежуточные такты не моделируются
+                if self._scale_drift is not None:
+                    observation = observation * (1. + self._scale_drift.advance(self._car.time))
+                if self._bias is not None:
+                    observation = observation + self._bias.advance(self._car.time)
+
+        with stage('CarSensorBase.observe.noise_draw'):
+            for i, std in self._noise_stds:
+                observation[i] += self._gen.normal(scale=std)
+        with stage('CarSensorBase.observe.history_append'):
+            self._last_observation = observation
+            self._last_time = Timestamp.nanoseconds(self._car.time.to_nanoseconds())
+            observation = np.array(self._last_observation)
+            self._history.append(observation)
         return observation
 
     @property
     def history(self):
         return np.array(self._history)
 
+    def clear_history(self):
+        """Очищает историю наблюдений, как Car.clear_history"""
+        self._history.clear()
+
     #########################################
     #      Методы для переопределения       #
     #########################################
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from .timestamp import Timestamp
 from .movement_model_base import MovementModelBase
@@ -39,20 +40,19 @@ class CircleMovementModel(MovementModelBase):
 
     def _move(self, dt):
         assert isinstance(dt, Timestamp)
-        assert self._car._linear_velocity == self._linear_velocity, 'Linear velocity must be constant'
-        assert self._car._angular_velocity == self._angular_velocity, 'Angular velocity must be constant'
-
         car = self._car
+        state = car._state_view
+        assert state.velocity == self._linear_velocity, 'Linear velocity must be constant'
+        assert state.omega == self._angular_velocity, 'Angular velocity must be constant'
+
         curr_t = car._time
         next_t = curr_t + dt
 
         phase = self._angular_velocity * (next_t.to_seconds() - self._t_0)
-        next_yaw = phase + np.pi / 2.
-        next_x = self._center_x + self._radius * np.cos(phase)
-        next_y = self._center_y + self._radius * np.sin(phase)
+        next_yaw = phase + math.pi / 2.
+        next_x = self._center_x + self._radius * math.cos(phase)
+        next_y = self._center_y + self._radius * math.sin(phase)
 
         # Продвигаем время, выставляем новое состояние
         car.time = next_t
-        car._position_x = next_x
-        car._position_y = next_y
-        car._yaw = next_yaw
+        car._set_state_values(next_x, next_y, next_yaw, state.velocity, state.omega)
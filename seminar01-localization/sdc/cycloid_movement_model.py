@@ -1,4 +1,4 @@
-import numpy as np
+import math
 from .timestamp import Timestamp
 from .movement_model_base import MovementModelBase
 
@@ -21,22 +21,16 @@ class CycloidMovementModel(MovementModelBase):
         car = self._car
         dt_sec = dt.to_seconds()
 
-        x = car._position_x
-        y = car._position_y
-        vel = car._velocity
-        yaw = car._yaw
+        state = car._state_view
+        vel_x = state.velocity_x
+        vel_y = state.velocity_y
 
-        vel_x = vel * np.cos(yaw)
-        vel_y = vel * np.sin(yaw)
-
-        new_x = x + vel_x * dt_sec
-        new_y = y + vel_y * dt_sec
+        new_x = state.position_x + vel_x * dt_sec
+        new_y = state.position_y + vel_y * dt_sec
         new_vel_x = vel_x - self.omega * (vel_y - self.y_vel) * dt_sec
         new_vel_y = vel_y + self.omega * (vel_x - self.x_vel) * dt_sec
 
         # Продвигаем время, выставляем новое состояние
         car.time += dt
-        car._position_x = new_x
-        car._position_y = new_y
-        car._velocity = np.sqrt(new_vel_x**2 + new_vel_y**2)
-        car._yaw = np.arctan2(new_vel_y, new_vel_x)
+        car._set_state_values(
+            new_x, new_y, math.atan2(new_vel_y, new_vel_x), math.sqrt(new_vel_x**2 + new_vel_y**2), state.omega)
@@ -0,0 +1,266 @@
+import math
+import numpy as np
+from .metrics import get_mahalanobis_squared
+
+
+def get_chi2_gate(probability, dimension):
+    """Квантиль распределения хи-квадрат: порог для квадрата расстояния Махаланобиса.
+    Для двух степеней свободы вычисляется точно, для остальных - приближением Уилсона-Хилферти.
+    :param probability: доля истинных соответствий, которые должны проходить порог
+    :param dimension: число степеней свободы (размер невязки)
+    """
+    assert 0 < probability < 1
+    if dimension == 2:
+        return -2. * math.log(1. - probability)
+    import statistics
+    z = statistics.NormalDist().inv_cdf(probability)
+    a = 2. / (9. * dimension)
+    return dimension * (1. - a + z * math.sqrt(a))**3
+
+
+class LandmarkGrid:
+    """Равномерная сетка по положениям маяков для отбора кандидатов в соответствия.
+    Маяки сортируются по номеру ячейки, запрос окрестности точек выполняется бинарным поиском
+    по ячейкам, покрывающим окрестность, поэтому стоимость запроса зависит от числа маяков рядом,
+    а не от размера карты.
+    """
+    def __init__(self, landmarks_xy, cell_size):
+        """
+        :param landmarks_xy: положения маяков (M, 2)
+        :param cell_size: размер ячейки; разумно брать порядка радиуса запроса
+        """
+        assert cell_size > 0
+        self._landmarks_xy = np.asarray(landmarks_xy, dtype=np.float64).reshape(-1, 2)
+        self._cell_size = float(cell_size)
+        keys = self._get_keys(np.floor(self._landmarks_xy / self._cell_size).astype(np.int64))
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+    @staticmethod
+    def _get_keys(cells):
+        """Упаковка номеров ячеек (..., 2) в одно число int64, по 32 бита на координату"""
+        return (cells[..., 0] << 32) + (cells[..., 1] & 0xffffffff)
+
+    def __len__(self):
+        return self._landmarks_xy.shape[0]
+
+    def query(self, points, radii):
+        """Все пары (точка, маяк) на расстоянии не больше радиуса точки.
+        :param points: np.ndarray размера (P, 2)
+        :param radii: радиус запроса, число или np.ndarray размера (P,)
+        :returns: (номера точек, номера маяков) - массивы одинаковой длины
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        points_number = points.shape[0]
+        radii = np.broadcast_to(np.asarray(radii, dtype=np.float64), (points_number,))
+        empty = np.zeros(0, dtype=np.int64)
+        if points_number == 0 or len(self) == 0:
+            return empty, empty
+        low = np.floor((points - radii[:, None]) / self._cell_size).astype(np.int64)
+        high = np.floor((points + radii[:, None]) / self._cell_size).astype(np.int64)
+        spans = high - low + 1
+        max_spans = spans.max(axis=0)
+        if max_spans[0] * max_spans[1] >= len(self):
+            # Окрестность больше карты: проще проверить все маяки
+            point_indices = np.repeat(np.arange(points_number), len(self))
+            landmark_indices = np.tile(np.arange(len(self)), points_number)
+        else:
+            offsets = np.stack(np.meshgrid(
+                np.arange(max_spans[0]), np.arange(max_spans[1]), indexing='ij'), axis=-1).reshape(-1, 2)
+            valid = np.all(offsets[None, :, :] < spans[:, None, :], axis=-1)
+            keys = self._get_keys(low[:, None, :] + offsets[None, :, :])
+            begins = np.searchsorted(self._keys, keys, side='left')
+            counts = np.where(valid, np.searchsorted(self._keys, keys, side='right') - begins, 0).ravel()
+            begins = begins.ravel()
+            total = int(counts.sum())
+            if total == 0:
+                return empty, empty
+            # Разворачиваем отрезки [begin, begin + count) в один массив позиций
+            ends = np.cumsum(counts)
+            positions = np.arange(total) - np.repeat(ends - counts - begins, counts)
+            point_indices = np.repeat(np.repeat(np.arange(points_number), offsets.shape[0]), counts)
+            landmark_indices = self._order[positions]
+        deltas = self._landmarks_xy[landmark_indices] - points[point_indices]
+        inside = np.sum(deltas**2, axis=-1) <= radii[point_indices]**2
+        return point_indices[inside], landmark_indices[inside]
+
+
+def get_gated_costs(detections, predicted_observations, innovation_covariances, gate, candidates=None):
+    """Квадраты расстояний Махаланобиса между обнаружениями и ожидаемыми наблюдениями маяков,
+    вычисленные одним векторным проходом по парам-кандидатам. Пары за порогом gate отбрасываются.
+    :param detections: наблюдения (D, m)
+    :param predicted_observations: ожидаемые наблюдения маяков (L, m)
+    :param innovation_covariances: ковариации невязок (L, m, m) или общая (m, m)
+    :param gate: порог квадрата расстояния, см. get_chi2_gate
+    :param candidates: (номера обнаружений, номера маяков) или None - все пары
+    :returns: (номера обнаружений, номера маяков, квадраты расстояний) для прошедших порог пар
+    """
+    detections = np.asarray(detections, dtype=np.float64)
+    predicted_observations = np.asarray(predicted_observations, dtype=np.float64)
+    innovation_covariances = np.asarray(innovation_covariances, dtype=np.float64)
+    if candidates is None:
+        detection_indices, landmark_indices = [index.ravel() for index in np.meshgrid(
+            np.arange(detections.shape[0]), np.arange(predicted_observations.shape[0]), indexing='ij')]
+    else:
+        detection_indices, landmark_indices = [np.asarray(index, dtype=np.int64) for index in candidates]
+    if detection_indices.shape[0] == 0:
+        return detection_indices, landmark_indices, np.zeros(0, dtype=np.float64)
+    innovations = detections[detection_indices] - predicted_observations[landmark_indices]
+    if innovation_covariances.ndim == 3:
+        innovation_covariances = innovation_covariances[landmark_indices]
+    costs = get_mahalanobis_squared(innovations, innovation_covariances)
+    passed = costs <= gate
+    return detection_indices[passed], landmark_indices[passed], costs[passed]
+
+
+def associate_nearest_neighbour(detections_number, detection_indices, landmark_indices, costs):
+    """Жадное глобальное соответствие: пары берутся в порядке возрастания расстояния,
+    если ни обнаружение, ни маяк еще не заняты.
+    :returns: номера маяков для обнаружений (D,), -1 - нет соответствия
+    """
+    assignment = -np.ones(detections_number, dtype=np.int64)
+    used_landmarks = set()
+    for index in np.argsort(costs, kind='stable'):
+        detection_index = detection_indices[index]
+        landmark_index = landmark_indices[index]
+        if assignment[detection_index] < 0 and landmark_index not in used_landmarks:
+            assignment[detection_index] = landmark_index
+            used_landmarks.add(landmark_index)
+    return assignment
+
+
+def associate_hungarian(detections_number, detection_indices, landmark_indices, costs, gate):
+    """Оптимальное соответствие с минимальной суммой расстояний (венгерский алгоритм, scipy).
+    Каждому обнаружению добавляется фиктивный маяк со стоимостью gate, поэтому обнаружение остается
+    без соответствия, если все его кандидаты дальше порога.
+    :returns: номера маяков для обнаружений (D,), -1 - нет соответствия
+    """
+    from scipy.optimize import linear_sum_assignment
+    assignment = -np.ones(detections_number, dtype=np.int64)
+    if costs.shape[0] == 0:
+        return assignment
+    # Матрица строится только по маякам-кандидатам
+    candidate_landmarks, columns = np.unique(landmark_indices, return_inverse=True)
+    candidates_number = candidate_landmarks.shape[0]
+    forbidden = 2. * gate + 1.
+    matrix = np.full((detections_number, candidates_number + detections_number), forbidden)
+    matrix[:, candidates_number:][np.diag_indices(detections_number)] = gate
+    matrix[detection_indices, columns] = costs
+    rows, assigned_columns = linear_sum_assignment(matrix)
+    matched = (assigned_columns < candidates_number) & (matrix[rows, assigned_columns] < forbidden)
+    assignment[rows[matched]] = candidate_landmarks[assigned_columns[matched]]
+    return assignment
+
+
+def associate_jcbb(
+        detections,
+        predicted_observations,
+        innovation_covariances,
+        detection_indices,
+        landmark_indices,
+        gate_probability,
+        robot_jacobians=None,
+        robot_covariance=None):
+    """Joint compatibility branch and bound (Neira, Tardos): ищет наибольшее множество соответствий,
+    совместных в целом - суммарная невязка проходит порог хи-квадрат с m * k степенями свободы.
+    Ошибки ожидаемых наблюдений разных маяков коррелированы через положение робота: если заданы
+    robot_jacobians (L, m, n) и robot_covariance (n, n), взаимные ковариации равны H_i * P * H_j^T,
+    иначе считаются нулевыми. Перебор экспоненциален в худшем случае, но идет только по парам,
+    прошедшим индивидуальный порог.
+    :returns: номера маяков для обнаружений (D,), -1 - нет соответствия
+    """
+    detections = np.asarray(detections, dtype=np.float64)
+    detections_number, observation_size = detections.shape
+    innovation_covariances = np.broadcast_to(
+        innovation_covariances, (predicted_observations.shape[0], observation_size, observation_size))
+    candidates = [[] for _ in range(detections_number)]
+    for detection_index, landmark_index in zip(detection_indices.tolist(), landmark_indices.tolist()):
+        candidates[detection_index].append(landmark_index)
+    # Сначала перебираются обнаружения с меньшим числом кандидатов
+    order = sorted(range(detections_number), key=lambda index: len(candidates[index]))
+    with_candidates = np.cumsum([len(candidates[index]) > 0 for index in order[::-1]])[::-1].tolist() + [0]
+    gates = [0.] + [get_chi2_gate(gate_probability, observation_size * k) for k in range(1, detections_number + 1)]
+
+    def get_joint_nis(pairs):
+        detection_list = [pair[0] for pair in pairs]
+        landmark_list = [pair[1] for pair in pairs]
+        innovation = (detections[detection_list] - predicted_observations[landmark_list]).ravel()
+        size = observation_size * len(pairs)
+        covariance = np.zeros((size, size), dtype=np.float64)
+        if robot_jacobians is not None:
+            H = robot_jacobians[landmark_list].reshape(size, -1)
+            covariance += np.dot(np.dot(H, robot_covariance), H.T)
+        for k, landmark_index in enumerate(landmark_list):
+            block = slice(observation_size * k, observation_size * (k + 1))
+            covariance[block, block] = innovation_covariances[landmark_index]
+        return float(np.dot(innovation, np.linalg.solve(covariance, innovation)))
+
+    best = {'pairs': [], 'nis': math.inf}
+
+    def search(position, pairs, used_landmarks, nis):
+        if position == detections_number:
+            if len(pairs) > len(best['pairs']) or (len(pairs) == len(best['pairs']) and nis < best['nis']):
+                best['pairs'], best['nis'] = list(pairs), nis
+            return
+        if len(pairs) + with_candidates[position] < len(best['pairs']):
+            return
+        detection_index = order[position]
+        for landmark_index in candidates[detection_index]:
+            if landmark_index in used_landmarks:
+                continue
+            pairs.append((detection_index, landmark_index))
+            joint_nis = get_joint_nis(pairs)
+            if joint_nis <= gates[len(pairs)]:
+                used_landmarks.add(landmark_index)
+                search(position + 1, pairs, used_landmarks, joint_nis)
+                used_landmarks.discard(landmark_index)
+            pairs.pop()
+        # Обнаружение без соответствия (новый маяк или ложное срабатывание)
+        if len(pairs) + with_candidates[position + 1] >= len(best['pairs']):
+            search(position + 1, pairs, used_landmarks, nis)
+
+    search(0, [], set(), 0.)
+    assignment = -np.ones(detections_number, dtype=np.int64)
+    for detection_index, landmark_index in best['pairs']:
+        assignment[detection_index] = landmark_index
+    return assignment
+
+
+ASSOCIATION_METHODS = ('nn', 'hungarian', 'jcbb')
+
+
+def associate(
+        detections,
+        predicted_observations,
+        innovation_covariances,
+        method='nn',
+        gate_probability=0.99,
+        candidates=None,
+        robot_jacobians=None,
+        robot_covariance=None):
+    """Сопоставляет анонимные обнаружения маякам.
+    :param detections: наблюдения (D, m)
+    :param predicted_observations: ожидаемые наблюдения маяков (L, m)
+    :param innovation_covariances: ковариации невязок (L, m, m) или общая (m, m)
+    :param method: 'nn' - жадный ближайший сосед, 'hungarian' - оптимальное назначение,
+        'jcbb' - совместная совместимость
+    :param gate_probability: вероятность, задающая порог хи-квадрат для расстояния Махаланобиса
+    :param candidates: пары-кандидаты (номера обнаружений, номера маяков), например из LandmarkGrid.query;
+        None - все пары
+    :param robot_jacobians: матрицы Якоби наблюдений по состоянию робота (L, m, n), только для 'jcbb'
+    :param robot_covariance: ковариация состояния робота (n, n), только для 'jcbb'
+    :returns: номера маяков для обнаружений (D,), -1 - нет соответствия
+    """
+    assert method in ASSOCIATION_METHODS, f'Unknown association method {method}'
+    detections = np.asarray(detections, dtype=np.float64)
+    detections_number, observation_size = detections.shape
+    gate = get_chi2_gate(gate_probability, observation_size)
+    detection_indices, landmark_indices, costs = get_gated_costs(
+        detections, predicted_observations, innovation_covariances, gate, candidates)
+    if method == 'nn':
+        return associate_nearest_neighbour(detections_number, detection_indices, landmark_indices, costs)
+    if method == 'hungarian':
+        return associate_hungarian(detections_number, detection_indices, landmark_indices, costs, gate)
+    return associate_jcbb(
+        detections, np.asarray(predicted_observations, dtype=np.float64), innovation_covariances,
+        detection_indices, landmark_indices, gate_probability, robot_jacobians, robot_covariance)
@@ -0,0 +1,423 @@
+import time
+import numpy as np
+from .kalman_car import KalmanCar
+from .timestamp import Timestamp
+from .data_association import LandmarkGrid, associate, get_chi2_gate
+
+
+def get_landmark_observation_jacobians(state, landmark_xy, car_model=KalmanCar):
+    """Наблюдение маяка, как у LandmarkSensor: положение маяка в локальной системе координат робота.
+    Допускаются стопки состояний и маяков по первым осям.
+    :param state: состояние робота (..., n)
+    :param landmark_xy: положение маяка в глобальной системе координат (..., 2)
+    :returns: (z, H_robot, H_landmark) - ожидаемое наблюдение (..., 2) и матрицы Якоби
+        по состоянию робота (..., 2, n) и по положению маяка (..., 2, 2)
+    """
+    yaw = state[..., car_model.YAW_INDEX]
+    cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+    dx = landmark_xy[..., 0] - state[..., car_model.POS_X_INDEX]
+    dy = landmark_xy[..., 1] - state[..., car_model.POS_Y_INDEX]
+    z = np.stack([cos_yaw * dx + sin_yaw * dy, -sin_yaw * dx + cos_yaw * dy], axis=-1)
+
+    H_landmark = np.stack([
+        np.stack([cos_yaw, sin_yaw], axis=-1),
+        np.stack([-sin_yaw, cos_yaw], axis=-1)], axis=-2)
+    H_robot = np.zeros(z.shape[:-1] + (2, state.shape[-1]), dtype=np.float64)
+    H_robot[..., car_model.POS_X_INDEX] = -H_landmark[..., 0]
+    H_robot[..., car_model.POS_Y_INDEX] = -H_landmark[..., 1]
+    H_robot[..., 0, car_model.YAW_INDEX] = z[..., 1]
+    H_robot[..., 1, car_model.YAW_INDEX] = -z[..., 0]
+    return z, H_robot, H_landmark
+
+
+class EkfSlamCar(KalmanCar):
+    """EKF-SLAM: состояние KalmanCar дополняется положениями маяков, которые оцениваются по ходу движения.
+
+    Матрица ковариации расширенного состояния (n + 2M, n + 2M) хранится блоками:
+        - ковариация робота (n, n) - это covariance_matrix из KalmanCar;
+        - "активное окно" из K последних наблюдавшихся маяков: взаимные ковариации робот-маяк (n, 2K)
+          и маяк-маяк (2K, 2K) хранятся полностью;
+        - для остальных маяков хранятся только диагональные блоки (M, 2, 2).
+    Когда маяк вытесняется из окна, его взаимные ковариации отбрасываются (матрица при этом остается
+    положительно полуопределенной). Предсказание и обработка наблюдения трогают только блок робота
+    и активное окно, поэтому стоят O(K^2) независимо от общего числа маяков M (для плотной матрицы -
+    O(M^2)), а память растет линейно по M. При K >= M фильтр совпадает с обычным EKF-SLAM.
+    """
+    LANDMARK_SIZE = 2
+
+    def __init__(self, active_landmarks_number=16, initial_landmarks_capacity=16, *args, **kwargs):
+        """
+        :param active_landmarks_number: размер активного окна K
+        :param initial_landmarks_capacity: под сколько маяков изначально выделяется память
+        """
+        super(EkfSlamCar, self).__init__(*args, **kwargs)
+        self._landmarks_indices = {}
+        self._landmarks_number = 0
+        self._allocate_landmarks(max(int(initial_landmarks_capacity), 1))
+
+        active_size = self.LANDMARK_SIZE * active_landmarks_number
+        self._active_landmarks = -np.ones(active_landmarks_number, dtype=np.int64)
+        self._active_last_used = np.zeros(active_landmarks_number, dtype=np.int64)
+        self._active_robot_covariance = np.zeros((self.state_size, active_size), dtype=np.float64)
+        self._active_covariance = np.zeros((active_size, active_size), dtype=np.float64)
+        self._observations_counter = 0
+
+        # Состояние отбора кандидатов для сопоставления анонимных наблюдений (associate_landmarks_observations):
+        # идентификаторы маяков по номерам, верхняя граница дисперсии положения маяка (ковариации маяков
+        # при обновлениях только уменьшаются), сетка по положениям маяков на момент ее построения и
+        # суммарное смещение маяков с тех пор
+        self._landmarks_ids_list = []
+        self._max_landmark_variance = 0.
+        self._grid = None
+        self._grid_landmarks_number = 0
+        self._grid_drift = 0.
+
+    def _allocate_landmarks(self, capacity):
+        """Выделяет (или расширяет) хранилище маяков с запасом, чтобы не переаллоцировать на каждом маяке"""
+        number = self._landmarks_number
+        landmarks_xy = np.zeros((capacity, self.LANDMARK_SIZE), dtype=np.float64)
+        landmark_covariances = np.zeros((capacity, self.LANDMARK_SIZE, self.LANDMARK_SIZE), dtype=np.float64)
+        slots = -np.ones(capacity, dtype=np.int64)
+        if number > 0:
+            landmarks_xy[:number] = self._landmarks_xy[:number]
+            landmark_covariances[:number] = self._landmark_covariances[:number]
+            slots[:number] = self._landmarks_slots[:number]
+        self._landmarks_xy = landmarks_xy
+        self._landmark_covariances = landmark_covariances
+        self._landmarks_slots = slots
+
+    @property
+    def landmarks_number(self):
+        return self._landmarks_number
+
+    @property
+    def landmarks_ids(self):
+        return list(self._landmarks_indices.keys())
+
+    @property
+    def landmarks_positions(self):
+        """Оценки положений маяков в глобальной системе координат (M, 2), в порядке landmarks_ids"""
+        return np.array(self._landmarks_xy[:self._landmarks_number])
+
+    @property
+    def landmarks_covariances(self):
+        """Ковариации положений маяков (M, 2, 2)"""
+        covariances = np.array(self._landmark_covariances[:self._landmarks_number])
+        for slot, index in enumerate(self._active_landmarks):
+            if index >= 0:
+                covariances[index] = self._get_active_block(slot, slot)
+        return covariances
+
+    def get_landmark_position(self, landmark_id):
+        return np.array(self._landmarks_xy[self._landmarks_indices[landmark_id]])
+
+    def get_landmark_covariance(self, landmark_id):
+        index = self._landmarks_indices[landmark_id]
+        slot = self._landmarks_slots[index]
+        if slot >= 0:
+            return np.array(self._get_active_block(slot, slot))
+        return np.array(self._landmark_covariances[index])
+
+    def get_augmented_covariance(self):
+        """Собирает плотную матрицу ковариации расширенного состояния (n + 2M, n + 2M) в порядке landmarks_ids.
+        Нужна только для отладки и визуализации: стоит O(M^2) памяти."""
+        n = self.state_size
+        m = self._landmarks_number
+        size = n + self.LANDMARK_SIZE * m
+        S = np.zeros((size, size), dtype=np.float64)
+        S[:n, :n] = self.covariance_matrix
+        covariances = self.landmarks_covariances
+        for i in range(m):
+            begin = n + self.LANDMARK_SIZE * i
+            S[begin:begin + self.LANDMARK_SIZE, begin:begin + self.LANDMARK_SIZE] = covariances[i]
+        for slot, index in enumerate(self._active_landmarks):
+            if index < 0:
+                continue
+            begin = n + self.LANDMARK_SIZE * index
+            S[:n, begin:begin + self.LANDMARK_SIZE] = self._get_active_robot_block(slot)
+            S[begin:begin + self.LANDMARK_SIZE, :n] = self._get_active_robot_block(slot).T
+            for other_slot, other_index in enumerate(self._active_landmarks):
+                if other_index < 0 or other_index == index:
+                    continue
+                other_begin = n + self.LANDMARK_SIZE * other_index
+                S[begin:begin + self.LANDMARK_SIZE, other_begin:other_begin + self.LANDMARK_SIZE] = \
+                    self._get_active_block(slot, other_slot)
+        return S
+
+    def _get_active_block(self, slot, other_slot):
+        size = self.LANDMARK_SIZE
+        return self._active_covariance[size * slot:size * (slot + 1), size * other_slot:size * (other_slot + 1)]
+
+    def _get_active_robot_block(self, slot):
+        size = self.LANDMARK_SIZE
+        return self._active_robot_covariance[:, size * slot:size * (slot + 1)]
+
+    def _activate(self, index):
+        """Помещает маяк в активное окно, вытесняя давно не наблюдавшийся маяк. Возвращает номер слота."""
+        slot = self._landmarks_slots[index]
+        if slot < 0:
+            slot = int(np.argmin(self._active_last_used))
+            size = self.LANDMARK_SIZE
+            block = slice(size * slot, size * (slot + 1))
+            evicted = self._active_landmarks[slot]
+            if evicted >= 0:
+                self._landmark_covariances[evicted] = self._get_active_block(slot, slot)
+                self._landmarks_slots[evicted] = -1
+            self._active_robot_covariance[:, block] = 0
+            self._active_covariance[block, :] = 0
+            self._active_covariance[:, block] = 0
+            self._active_covariance[block, block] = self._landmark_covariances[index]
+            self._active_landmarks[slot] = index
+            self._landmarks_slots[index] = slot
+        self._observations_counter += 1
+        self._active_last_used[slot] = self._observations_counter
+        return slot
+
+    def move(self, dt):
+        assert isinstance(dt, Timestamp)
+        super(EkfSlamCar, self).move(dt)
+        # Маяки неподвижны, поэтому меняются только взаимные ковариации робот-маяк: P_rl = J * P_rl.
+        # J вычислена в KalmanCar.move в состоянии до шага и переиспользуется
+        self._active_robot_covariance = np.dot(self._state_jacobian, self._active_robot_covariance)
+
+    def process_landmark_observation(self, landmark_id, observation, noise_covariance):
+        """Обрабатывает наблюдение маяка в локальной системе координат робота (как у LandmarkSensor).
+        Ранее не наблюдавшийся маяк добавляется в состояние.
+        :param landmark_id: хешируемый идентификатор маяка
+        :param observation: np.ndarray размера (2,)
+        :param noise_covariance: матрица ковариации шума наблюдения (2, 2)
+        """
+        observation = np.asarray(observation, dtype=np.float64)
+        Q = np.asarray(noise_covariance, dtype=np.float64)
+        assert observation.shape == (self.LANDMARK_SIZE,)
+        assert Q.shape == (self.LANDMARK_SIZE, self.LANDMARK_SIZE)
+        if landmark_id not in self._landmarks_indices:
+            self._add_landmark(landmark_id, observation, Q)
+            return
+
+        index = self._landmarks_indices[landmark_id]
+        slot = self._activate(index)
+        block = slice(self.LANDMARK_SIZE * slot, self.LANDMARK_SIZE * (slot + 1))
+        mu = self.state
+        S_rr = self.covariance_matrix
+        S_ra = self._active_robot_covariance
+        S_aa = self._active_covariance
+
+        z, H_r, H_l = get_landmark_observation_jacobians(mu, self._landmarks_xy[index], type(self))
+        # Матрица наблюдений ненулевая только в блоке робота и в блоке наблюдаемого маяка
+        PHt_r = np.dot(S_rr, H_r.T) + np.dot(S_ra[:, block], H_l.T)
+        PHt_a = np.dot(S_ra.T, H_r.T) + np.dot(S_aa[:, block], H_l.T)
+        H = np.dot(H_r, PHt_r) + np.dot(H_l, PHt_a[block]) + Q
+        H_inv = np.linalg.inv(H)
+        K_r = np.dot(PHt_r, H_inv)
+        K_a = np.dot(PHt_a, H_inv)
+        innovation = observation - z
+
+        active = self._active_landmarks >= 0
+        active_shift = np.dot(K_a, innovation).reshape(-1, self.LANDMARK_SIZE)
+        self._landmarks_xy[self._active_landmarks[active]] += active_shift[active]
+        self._grid_drift += float(np.sqrt(np.max(np.sum(active_shift[active]**2, axis=-1))))
+        # S_ab -= K_a * H * K_b^T, такая форма сохраняет симметричность блоков
+        K_r_H = np.dot(K_r, H)
+        self._active_robot_covariance = S_ra - np.dot(K_r_H, K_a.T)
+        self._active_covariance = S_aa - np.dot(np.dot(K_a, H), K_a.T)
+        self.state = mu + np.dot(K_r, innovation)
+        self.covariance_matrix = S_rr - np.dot(K_r_H, K_r.T)
+
+    def get_landmarks_predictions(self, indices, noise_covariance):
+        """Ожидаемые наблюдения маяков с номерами indices (в порядке landmarks_ids) и ковариации невязок
+        с учетом взаимных ковариаций робот-маяк из активного окна.
+        :returns: (z (K, 2), ковариации невязок (K, 2, 2), матрицы Якоби по состоянию робота (K, 2, n))
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        size = self.LANDMARK_SIZE
+        z, H_r, H_l = get_landmark_observation_jacobians(self._state, self._landmarks_xy[indices], type(self))
+        S_ll = np.array(self._landmark_covariances[indices])
+        S_rl = np.zeros((indices.shape[0], self.state_size, size), dtype=np.float64)
+        slots = self._landmarks_slots[indices]
+        active = slots >= 0
+        if np.any(active):
+            rows = size * slots[active][:, None] + np.arange(size)[None, :]
+            S_ll[active] = self._active_covariance[rows[:, :, None], rows[:, None, :]]
+            S_rl[active] = np.transpose(self._active_robot_covariance[:, rows], (1, 0, 2))
+        H_l_t = np.swapaxes(H_l, -1, -2)
+        cross = np.matmul(np.matmul(H_r, S_rl), H_l_t)
+        covariances = (
+            np.matmul(np.matmul(H_r, self.covariance_matrix), np.swapaxes(H_r, -1, -2))
+            + np.matmul(np.matmul(H_l, S_ll), H_l_t)
+            + cross + np.swapaxes(cross, -1, -2) + noise_covariance)
+        return z, covariances, H_r
+
+    def associate_landmarks_observations(self, observations, noise_covariance, method='nn', gate_probability=0.99):
+        """Сопоставляет анонимные наблюдения маяков (в локальной системе координат) маякам карты.
+        Кандидаты отбираются по сетке: наблюдения переводятся в глобальную систему координат по текущей
+        оценке положения, а радиус поиска ограничивает сверху расстояние, на котором пара еще может пройти
+        порог Махаланобиса (при линеаризации). Поэтому расстояния считаются только для маяков рядом.
+        :param observations: np.ndarray размера (D, 2)
+        :param method: 'nn', 'hungarian' или 'jcbb', см. data_association.associate
+        :returns: список идентификаторов маяков длины D, None - наблюдение не сопоставлено
+        """
+        observations = np.asarray(observations, dtype=np.float64).reshape(-1, self.LANDMARK_SIZE)
+        Q = np.asarray(noise_covariance, dtype=np.float64)
+        number = self._landmarks_number
+        if number == 0 or observations.shape[0] == 0:
+            return [None] * observations.shape[0]
+        state = self._state_view
+        rotation = np.array([[state.cos_yaw, -state.sin_yaw], [state.sin_yaw, state.cos_yaw]])
+        global_observations = np.dot(observations, rotation.T) + [state.position_x, state.position_y]
+
+        # Ошибка ожидаемого наблюдения складывается из ошибок положения робота, угла (растет с дальностью),
+        # положения маяка и шума наблюдения; радиус - сумма соответствующих стандартных отклонений
+        S = self.covariance_matrix
+        position_indices = [self.POS_X_INDEX, self.POS_Y_INDEX]
+        position_std = np.sqrt(np.trace(S[np.ix_(position_indices, position_indices)]))
+        yaw_std = np.sqrt(S[self.YAW_INDEX, self.YAW_INDEX])
+        noise_std = np.sqrt(np.max(np.linalg.eigvalsh(Q)))
+        ranges = np.hypot(observations[:, 0], observations[:, 1])
+        gate_sigmas = np.sqrt(get_chi2_gate(gate_probability, self.LANDMARK_SIZE))
+        robot_radii = gate_sigmas * (position_std + ranges * yaw_std + noise_std)
+
+        # Сначала отбор по сетке с общей верхней границей ошибки маяка, затем уточнение по каждому маяку
+        # (сохраненные ковариации маяков - верхние границы текущих)
+        detection_indices, landmark_indices = self._get_landmarks_candidates(
+            global_observations, robot_radii + gate_sigmas * np.sqrt(self._max_landmark_variance))
+        landmark_covariances = self._landmark_covariances[landmark_indices]
+        pair_radii = robot_radii[detection_indices] + gate_sigmas * np.sqrt(
+            landmark_covariances[:, 0, 0] + landmark_covariances[:, 1, 1])
+        deltas = self._landmarks_xy[landmark_indices] - global_observations[detection_indices]
+        near = np.sum(deltas**2, axis=-1) <= pair_radii**2
+        detection_indices, landmark_indices = detection_indices[near], landmark_indices[near]
+        candidate_landmarks, columns = np.unique(landmark_indices, return_inverse=True)
+        z, covariances, H_r = self.get_landmarks_predictions(candidate_landmarks, Q)
+        assignment = associate(
+            observations, z, covariances, method=method, gate_probability=gate_probability,
+            candidates=(detection_indices, columns), robot_jacobians=H_r, robot_covariance=S)
+        landmarks_ids = self._landmarks_ids_list
+        return [None if column < 0 else landmarks_ids[candidate_landmarks[column]] for column in assignment]
+
+    def _get_landmarks_candidates(self, points, radii):
+        """Пары (точка, маяк) на расстоянии не больше радиуса точки.
+        Сетка перестраивается, только когда маяков добавилось много или они заметно сместились; маяки,
+        добавленные после построения, проверяются перебором, а смещения учитываются расширением радиуса.
+        Поэтому в среднем запрос не требует прохода по всей карте.
+        """
+        number = self._landmarks_number
+        cell_size = max(float(np.max(radii)), 1e-6)
+        if (self._grid is None
+                or number - self._grid_landmarks_number > max(64, self._grid_landmarks_number // 4)
+                or self._grid_drift > cell_size):
+            self._grid = LandmarkGrid(self._landmarks_xy[:number], cell_size=cell_size)
+            self._grid_landmarks_number = number
+            self._grid_drift = 0.
+        radii = radii + self._grid_drift
+        detection_indices, landmark_indices = self._grid.query(points, radii)
+        if number > self._grid_landmarks_number:
+            new_indices = np.arange(self._grid_landmarks_number, number)
+            deltas = self._landmarks_xy[new_indices][None, :, :] - points[:, None, :]
+            near_detections, near_landmarks = np.nonzero(np.sum(deltas**2, axis=-1) <= radii[:, None]**2)
+            detection_indices = np.concatenate([detection_indices, near_detections])
+            landmark_indices = np.concatenate([landmark_indices, new_indices[near_landmarks]])
+        return detection_indices, landmark_indices
+
+    def process_anonymous_landmarks_observations(
+            self, observations, noise_covariance, method='nn', gate_probability=0.99, new_landmark_probability=0.999):
+        """Обрабатывает анонимные наблюдения маяков: сопоставляет их карте (associate_landmarks_observations),
+        сопоставленные обрабатывает как обычные наблюдения, а остальные добавляет в карту как новые маяки.
+        Порог сопоставления пропускает долю 1 - gate_probability истинных соответствий, и каждый такой промах
+        создал бы дубликат маяка, который потом никогда не объединяется с оригиналом. Поэтому новый маяк
+        создается, только если наблюдение не проходит и более широкий порог new_landmark_probability ни для одного
+        маяка карты; наблюдения между двумя порогами неоднозначны и отбрасываются.
+        :param new_landmark_probability: порог создания маяка, больше gate_probability; None - создавать маяк
+            для каждого несопоставленного наблюдения
+        :returns: список идентификаторов маяков, которым отнесены наблюдения, None - наблюдение отброшено
+        """
+        assert new_landmark_probability is None or new_landmark_probability > gate_probability
+        observations = np.asarray(observations, dtype=np.float64).reshape(-1, self.LANDMARK_SIZE)
+        landmarks_ids = self.associate_landmarks_observations(
+            observations, noise_covariance, method=method, gate_probability=gate_probability)
+        discarded = set()
+        if new_landmark_probability is not None:
+            for i, landmark_id in enumerate(landmarks_ids):
+                # По одному наблюдению: несколько промахов рядом с одним маяком не должны делить его между собой
+                if landmark_id is not None:
+                    continue
+                nearby_ids = self.associate_landmarks_observations(
+                    observations[i:i + 1], noise_covariance, gate_probability=new_landmark_probability)
+                if nearby_ids[0] is not None:
+                    discarded.add(i)
+        for i, landmark_id in enumerate(landmarks_ids):
+            if i in discarded:
+                continue
+            if landmark_id is None:
+                landmark_id = self._landmarks_number
+                while landmark_id in self._landmarks_indices:
+                    landmark_id += 1
+                landmarks_ids[i] = landmark_id
+            self.process_landmark_observation(landmark_id, observations[i], noise_covariance)
+        return landmarks_ids
+
+    def _add_landmark(self, landmark_id, observation, Q):
+        """Инициализирует маяк по первому наблюдению: l = p + R(yaw) * z"""
+        if self._landmarks_number == self._landmarks_xy.shape[0]:
+            self._allocate_landmarks(2 * self._landmarks_xy.shape[0])
+        mu = self._state
+        yaw = mu[self.YAW_INDEX]
+        cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+        R = np.array([[cos_yaw, -sin_yaw], [sin_yaw, cos_yaw]])
+        offset = np.dot(R, observation)
+
+        G_r = np.zeros((self.LANDMARK_SIZE, self.state_size), dtype=np.float64)
+        G_r[0, self.POS_X_INDEX] = 1
+        G_r[1, self.POS_Y_INDEX] = 1
+        G_r[:, self.YAW_INDEX] = [-offset[1], offset[0]]
+        S_rr = self.covariance_matrix
+
+        index = self._landmarks_number
+        self._landmarks_xy[index] = [mu[self.POS_X_INDEX] + offset[0], mu[self.POS_Y_INDEX] + offset[1]]
+        self._landmark_covariances[index] = np.dot(np.dot(G_r, S_rr), G_r.T) + np.dot(np.dot(R, Q), R.T)
+        self._landmarks_indices[landmark_id] = index
+        self._landmarks_ids_list.append(landmark_id)
+        self._max_landmark_variance = max(self._max_landmark_variance, np.trace(self._landmark_covariances[index]))
+        self._landmarks_number += 1
+
+        # Новый маяк коррелирован с роботом и с остальными маяками активного окна
+        slot = self._activate(index)
+        block = slice(self.LANDMARK_SIZE * slot, self.LANDMARK_SIZE * (slot + 1))
+        self._active_robot_covariance[:, block] = np.dot(S_rr, G_r.T)
+        cross = np.dot(G_r, self._active_robot_covariance)
+        cross[:, block] = self._landmark_covariances[index]
+        self._active_covariance[block, :] = cross
+        self._active_covariance[:, block] = cross.T
+
+
+def benchmark(landmarks_numbers=(10, 100, 1000, 10000), steps_number=200, random_state=0):
+    """Время одного шага (предсказание + наблюдение одного маяка) в зависимости от числа маяков.
+    :returns: dict {число маяков: секунд на шаг}
+    """
+    gen = np.random.RandomState(random_state)
+    dt = Timestamp.milliseconds(100)
+    Q = np.diag([0.1, 0.1])
+    results = {}
+    for landmarks_number in landmarks_numbers:
+        car = EkfSlamCar(
+            initial_landmarks_capacity=landmarks_number,
+            initial_position=[0., 0.],
+            initial_velocity=1.,
+            initial_covariance_matrix=0.01 * np.eye(5))
+        landmarks = gen.uniform(-50, 50, size=(landmarks_number, 2))
+        for i, landmark in enumerate(landmarks):
+            observation, _, _ = get_landmark_observation_jacobians(car.state, landmark)
+            car.process_landmark_observation(i, observation, Q)
+        start = time.perf_counter()
+        for step in range(steps_number):
+            car.move(dt)
+            landmark_id = gen.randint(landmarks_number)
+            observation, _, _ = get_landmark_observation_jacobians(car.state, landmarks[landmark_id])
+            car.process_landmark_observation(landmark_id, observation + gen.normal(scale=0.3, size=2), Q)
+        results[landmarks_number] = (time.perf_counter() - start) / steps_number
+    return results
+
+
+if __name__ == '__main__':
+    for landmarks_number, step_time in benchmark().items():
+        print(f'landmarks={landmarks_number:>6d}: {1e6 * step_time:.1f} us/step')
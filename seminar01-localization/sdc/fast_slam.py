@@ -0,0 +1,366 @@
+import numpy as np
+from .car import Car
+from .timestamp import Timestamp
+from .ekf_slam import get_landmark_observation_jacobians
+from .kalman_movement_model import move_state
+
+
+class PersistentLandmarkMaps:
+    """Карты маяков для набора частиц в виде персистентных сбалансированных деревьев.
+
+    Все деревья живут в общем пуле узлов. Дерево имеет фиксированную глубину D, ключ (номер маяка)
+    задает путь от корня к листу битами от старшего к младшему, в листах хранятся 2x2 EKF маяков.
+    Узел 0 - общее пустое дерево любой глубины. Изменение маяка копирует только путь от корня к листу
+    (copy-on-write, O(log N) узлов), поэтому частицы после ресемплинга разделяют неизмененные поддеревья,
+    а сам ресемплинг сводится к копированию корней за O(M). Обход и копирование путей выполняются
+    векторно сразу для всех частиц.
+    """
+    LANDMARK_SIZE = 2
+
+    def __init__(self, particles_number, initial_depth=4, initial_pool_size=1024):
+        self._depth = int(initial_depth)
+        self._roots = np.zeros(particles_number, dtype=np.int64)
+        self._allocate_pool(max(int(initial_pool_size), 1))
+        # Узел 0 - пустое дерево
+        self._size = 1
+
+    def _allocate_pool(self, pool_size):
+        size = getattr(self, '_size', 0)
+        children = np.zeros((pool_size, 2), dtype=np.int64)
+        means = np.zeros((pool_size, self.LANDMARK_SIZE), dtype=np.float64)
+        covariances = np.zeros((pool_size, self.LANDMARK_SIZE, self.LANDMARK_SIZE), dtype=np.float64)
+        initialized = np.zeros(pool_size, dtype=bool)
+        if size > 0:
+            children[:size] = self._children[:size]
+            means[:size] = self._means[:size]
+            covariances[:size] = self._covariances[:size]
+            initialized[:size] = self._initialized[:size]
+        self._children = children
+        self._means = means
+        self._covariances = covariances
+        self._initialized = initialized
+
+    @property
+    def particles_number(self):
+        return self._roots.shape[0]
+
+    @property
+    def capacity(self):
+        """Максимальный номер маяка + 1 при текущей глубине деревьев"""
+        return 1 << self._depth
+
+    @property
+    def nodes_number(self):
+        return self._size
+
+    def _get_bits(self, landmark_id):
+        return [(landmark_id >> (self._depth - 1 - level)) & 1 for level in range(self._depth)]
+
+    def _get_leaves(self, landmark_id, roots):
+        nodes = roots
+        for bit in self._get_bits(landmark_id):
+            nodes = self._children[nodes, bit]
+        return nodes
+
+    def get(self, landmark_id, particles=None):
+        """Возвращает EKF маяка во всех (или выбранных) частицах.
+        :returns: (means (M, 2), covariances (M, 2, 2), initialized (M,))
+        """
+        roots = self._roots if particles is None else self._roots[particles]
+        if landmark_id >= self.capacity:
+            number = roots.shape[0]
+            return (np.zeros((number, self.LANDMARK_SIZE)),
+                    np.zeros((number, self.LANDMARK_SIZE, self.LANDMARK_SIZE)),
+                    np.zeros(number, dtype=bool))
+        leaves = self._get_leaves(landmark_id, roots)
+        return self._means[leaves], self._covariances[leaves], self._initialized[leaves]
+
+    def set(self, landmark_id, means, covariances, particles=None):
+        """Записывает EKF маяка в выбранные частицы, копируя пути от корней до листьев.
+        :param means: np.ndarray размера (K, 2)
+        :param covariances: np.ndarray размера (K, 2, 2)
+        :param particles: индексы K частиц или None (все частицы)
+        """
+        assert landmark_id >= 0
+        while landmark_id >= self.capacity:
+            self._grow_depth()
+        if particles is None:
+            particles = np.arange(self.particles_number)
+        particles = np.asarray(particles)
+        number = particles.shape[0]
+        if number == 0:
+            return
+        path_length = self._depth + 1
+        self._reserve(number * path_length)
+
+        # Старый путь и новые узлы для каждой частицы: (D + 1, K)
+        bits = self._get_bits(landmark_id)
+        old_path = np.empty((path_length, number), dtype=np.int64)
+        old_path[0] = self._roots[particles]
+        for level, bit in enumerate(bits):
+            old_path[level + 1] = self._children[old_path[level], bit]
+        new_path = self._size + np.arange(number * path_length, dtype=np.int64).reshape(path_length, number)
+        self._size += number * path_length
+
+        for level, bit in enumerate(bits):
+            self._children[new_path[level]] = self._children[old_path[level]]
+            self._children[new_path[level], bit] = new_path[level + 1]
+        leaves = new_path[-1]
+        self._children[leaves] = 0
+        self._means[leaves] = means
+        self._covariances[leaves] = covariances
+        self._initialized[leaves] = True
+        self._roots[particles] = new_path[0]
+
+    def resample(self, indices):
+        """Новые частицы - копии частиц с индексами indices. Стоит O(M): копируются только корни."""
+        self._roots = self._roots[np.asarray(indices)]
+
+    def _grow_depth(self):
+        """Увеличивает глубину деревьев на 1: старые деревья становятся левыми поддеревьями новых корней"""
+        number = self.particles_number
+        self._reserve(number)
+        new_roots = self._size + np.arange(number, dtype=np.int64)
+        self._size += number
+        self._children[new_roots, 0] = self._roots
+        self._children[new_roots, 1] = 0
+        self._initialized[new_roots] = False
+        self._roots = new_roots
+        self._depth += 1
+
+    def _reserve(self, nodes_number):
+        """Гарантирует наличие места под nodes_number новых узлов: сначала собирает мусор,
+        и только если после этого пул заполнен больше чем наполовину - расширяет его."""
+        pool_size = self._children.shape[0]
+        if self._size + nodes_number <= pool_size:
+            return
+        self._collect_garbage()
+        pool_size = self._children.shape[0]
+        if self._size + nodes_number > pool_size // 2:
+            self._allocate_pool(max(2 * pool_size, 2 * (self._size + nodes_number)))
+
+    def _collect_garbage(self):
+        """Уплотняет пул, оставляя только узлы, достижимые из корней"""
+        reachable = np.zeros(self._size, dtype=bool)
+        reachable[0] = True
+        nodes = np.unique(self._roots)
+        for _ in range(self._depth):
+            reachable[nodes] = True
+            nodes = np.unique(self._children[nodes].ravel())
+        reachable[nodes] = True
+
+        new_indices = np.cumsum(reachable) - 1
+        old_indices = np.flatnonzero(reachable)
+        size = old_indices.shape[0]
+        self._children[:size] = new_indices[self._children[old_indices]]
+        self._means[:size] = self._means[old_indices]
+        self._covariances[:size] = self._covariances[old_indices]
+        self._initialized[:size] = self._initialized[old_indices]
+        self._roots = new_indices[self._roots]
+        self._size = size
+
+
+class FastSlam:
+    """FastSLAM (Rao-Blackwellized particle filter). Каждая частица - гипотеза о состоянии робота
+    (в раскладке Car) и карта маяков из независимых 2x2 EKF, хранящаяся в PersistentLandmarkMaps.
+    Наблюдения маяков - положения в локальной системе координат робота, как у LandmarkSensor.
+    Номера маяков известны (например, порядковый номер LandmarkSensor).
+
+    version=1: FastSLAM 1.0, новое положение частицы сэмплируется из модели движения.
+    version=2: FastSLAM 2.0, новое положение сэмплируется из гауссова приближения распределения,
+        учитывающего наблюдения уже известных маяков.
+    Обновления EKF маяков выполняются векторно сразу для всех частиц.
+    """
+    def __init__(
+            self,
+            particles_number,
+            initial_state,
+            initial_covariance=None,
+            noise_covariance_density=None,
+            version=2,
+            resample_threshold=0.5,
+            random_state=None):
+        """
+        :param particles_number: число частиц M
+        :param initial_state: начальное состояние робота (n,)
+        :param initial_covariance: ковариация начального разброса частиц (n, n) или None
+        :param noise_covariance_density: плотность ковариации шума модели движения (n, n), как в
+            KalmanMovementModel
+        :param version: 1 или 2
+        :param resample_threshold: ресемплинг выполняется, когда эффективное число частиц
+            меньше resample_threshold * M
+        """
+        assert version in (1, 2)
+        self._version = version
+        self._gen = np.random.RandomState(random_state)
+        initial_state = np.array(initial_state, dtype=np.float64)
+        state_size = initial_state.shape[0]
+        self._particles = np.tile(initial_state, (particles_number, 1))
+        if initial_covariance is not None:
+            self._particles += self._gen.multivariate_normal(
+                np.zeros(state_size), initial_covariance, size=particles_number)
+        if noise_covariance_density is None:
+            noise_covariance_density = np.zeros((state_size, state_size), dtype=np.float64)
+        self._noise_covariance_density = np.array(noise_covariance_density, dtype=np.float64)
+        assert self._noise_covariance_density.shape == (state_size, state_size)
+        self._log_weights = np.zeros(particles_number, dtype=np.float64)
+        self._resample_threshold = resample_threshold
+        self._maps = PersistentLandmarkMaps(particles_number)
+        self._landmarks_ids = set()
+        # Ковариация еще не просэмплированного шума движения (FastSLAM 2.0)
+        self._pending_covariance = None
+
+    @property
+    def particles_number(self):
+        return self._particles.shape[0]
+
+    @property
+    def particles(self):
+        self._sample_pending()
+        return np.array(self._particles)
+
+    @property
+    def maps(self):
+        return self._maps
+
+    @property
+    def weights(self):
+        weights = np.exp(self._log_weights - np.max(self._log_weights))
+        return weights / weights.sum()
+
+    @property
+    def effective_particles_number(self):
+        weights = self.weights
+        return 1. / np.sum(weights**2)
+
+    @property
+    def state(self):
+        """Взвешенное среднее состояние робота"""
+        return np.dot(self.weights, self.particles)
+
+    @property
+    def landmarks_ids(self):
+        return sorted(self._landmarks_ids)
+
+    def get_landmarks(self, particle_index=None):
+        """Карта одной частицы (по умолчанию - с наибольшим весом).
+        :returns: (ids, means (L, 2), covariances (L, 2, 2))
+        """
+        if particle_index is None:
+            particle_index = int(np.argmax(self._log_weights))
+        ids = self.landmarks_ids
+        particles = np.array([particle_index])
+        means = np.zeros((len(ids), 2), dtype=np.float64)
+        covariances = np.zeros((len(ids), 2, 2), dtype=np.float64)
+        for i, landmark_id in enumerate(ids):
+            mean, covariance, _ = self._maps.get(landmark_id, particles)
+            means[i] = mean[0]
+            covariances[i] = covariance[0]
+        return ids, means, covariances
+
+    def _sample_noise(self, covariance, size):
+        # Матрица ковариации шума может быть вырожденной, поэтому корень берется через собственные числа
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+        root = eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))[..., None, :]
+        noise = self._gen.standard_normal(size=(size, covariance.shape[-1]))
+        return np.matmul(root, noise[..., None])[..., 0]
+
+    def _sample_pending(self):
+        if self._pending_covariance is not None:
+            self._particles += self._sample_noise(self._pending_covariance, self.particles_number)
+            self._pending_covariance = None
+
+    def move(self, dt):
+        assert isinstance(dt, Timestamp)
+        self._sample_pending()
+        dt_sec = dt.to_seconds()
+        self._particles = move_state(self._particles, dt_sec)
+        R = self._noise_covariance_density * dt_sec
+        if self._version == 1:
+            self._particles += self._sample_noise(R, self.particles_number)
+        else:
+            self._pending_covariance = np.broadcast_to(R, (self.particles_number,) + R.shape)
+
+    def process_landmarks_observations(self, landmarks_ids, observations, noise_covariance):
+        """Обрабатывает наблюдения маяков, сделанные в один момент времени.
+        :param landmarks_ids: номера наблюдаемых маяков (L,)
+        :param observations: положения маяков в локальной системе координат (L, 2)
+        :param noise_covariance: ковариация шума наблюдения (2, 2)
+        """
+        observations = np.asarray(observations, dtype=np.float64).reshape(-1, 2)
+        Q = np.asarray(noise_covariance, dtype=np.float64)
+        assert len(landmarks_ids) == observations.shape[0]
+        if self._version == 2:
+            self._sample_proposal(landmarks_ids, observations, Q)
+        self._sample_pending()
+
+        for landmark_id, observation in zip(landmarks_ids, observations):
+            means, covariances, initialized = self._maps.get(landmark_id)
+            z, _, H_l = get_landmark_observation_jacobians(self._particles, means)
+            # Новый маяк: l = p + R(yaw) * z, ковариация R * Q * R^T (H_l = R^T)
+            new_means = np.array(self._particles[:, [Car.POS_X_INDEX, Car.POS_Y_INDEX]])
+            R = np.swapaxes(H_l, -1, -2)
+            new_means += np.matmul(R, observation)
+            new_covariances = np.matmul(np.matmul(R, Q), H_l)
+
+            # Известный маяк: EKF-обновление и вес частицы
+            Z = np.matmul(np.matmul(H_l, covariances), R) + Q
+            Z_inv = np.linalg.inv(Z)
+            K = np.matmul(np.matmul(covariances, R), Z_inv)
+            innovation = observation - z
+            updated_means = means + np.matmul(K, innovation[..., None])[..., 0]
+            updated_covariances = covariances - np.matmul(np.matmul(K, Z), np.swapaxes(K, -1, -2))
+            if self._version == 1:
+                _, log_det = np.linalg.slogdet(Z)
+                mahalanobis = np.einsum('ki,kij,kj->k', innovation, Z_inv, innovation)
+                self._log_weights[initialized] += -0.5 * (mahalanobis + log_det)[initialized]
+
+            new_means[initialized] = updated_means[initialized]
+            new_covariances[initialized] = updated_covariances[initialized]
+            self._maps.set(landmark_id, new_means, new_covariances)
+            self._landmarks_ids.add(landmark_id)
+
+        self._log_weights -= np.max(self._log_weights)
+        if self.effective_particles_number < self._resample_threshold * self.particles_number:
+            self.resample()
+
+    def _sample_proposal(self, landmarks_ids, observations, Q):
+        """FastSLAM 2.0: уточняет гауссово распределение нового положения частиц по наблюдениям известных
+        маяков (последовательно, как в EKF), обновляет веса и сэмплирует положения."""
+        if self._pending_covariance is None:
+            return
+        mu = self._particles
+        S = np.array(self._pending_covariance)
+        for landmark_id, observation in zip(landmarks_ids, observations):
+            means, covariances, initialized = self._maps.get(landmark_id)
+            if not np.any(initialized):
+                continue
+            z, H_r, H_l = get_landmark_observation_jacobians(mu, means)
+            Z = np.matmul(np.matmul(H_l, covariances), np.swapaxes(H_l, -1, -2)) + Q
+            SHt = np.matmul(S, np.swapaxes(H_r, -1, -2))
+            H = np.matmul(H_r, SHt) + Z
+            H_inv = np.linalg.inv(H)
+            K = np.matmul(SHt, H_inv)
+            innovation = observation - z
+            innovation[~initialized] = 0
+            K[~initialized] = 0
+
+            _, log_det = np.linalg.slogdet(H)
+            mahalanobis = np.einsum('ki,kij,kj->k', innovation, H_inv, innovation)
+            self._log_weights[initialized] += -0.5 * (mahalanobis + log_det)[initialized]
+
+            mu = mu + np.matmul(K, innovation[..., None])[..., 0]
+            S = S - np.matmul(K, np.swapaxes(SHt, -1, -2))
+        self._particles = mu
+        self._pending_covariance = 0.5 * (S + np.swapaxes(S, -1, -2))
+
+    def resample(self):
+        """Систематический ресемплинг. Карты не копируются - частицы разделяют деревья."""
+        self._sample_pending()
+        particles_number = self.particles_number
+        positions = (self._gen.uniform() + np.arange(particles_number)) / particles_number
+        indices = np.searchsorted(np.cumsum(self.weights), positions)
+        indices = np.minimum(indices, particles_number - 1)
+        self._particles = self._particles[indices]
+        self._maps.resample(indices)
+        self._log_weights = np.zeros(particles_number, dtype=np.float64)
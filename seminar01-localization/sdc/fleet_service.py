@@ -0,0 +1,510 @@
+import json
+import math
+import traceback
+import time
+import asyncio
+import argparse
+import typing as T
+import numpy as np
+from .car import Car
+from .kalman_filter import kalman_transit_covariance_batch, kalman_process_observation_batch
+from .kalman_movement_model import move_state, get_state_jacobian_matrix
+
+
+# Наблюдаемые компоненты состояния для каждого типа сенсора
+SENSORS_INDICES = {
+    'gps': [Car.POS_X_INDEX, Car.POS_Y_INDEX],
+    'can': [Car.VEL_INDEX],
+    'imu': [Car.OMEGA_INDEX],
+}
+
+
+class Observation(T.NamedTuple):
+    """Показание сенсора одного автомобиля.
+    :param time: момент наблюдения в секундах
+    :param received: момент поступления в сервис (time.perf_counter), для подсчета задержки
+    """
+    vehicle_id: T.Hashable
+    sensor: str
+    time: float
+    values: T.Sequence[float]
+    received: float = 0.
+
+
+class Estimate(T.NamedTuple):
+    """Оценка состояния автомобиля после обработки пачки наблюдений.
+    :param received: момент поступления самого раннего из учтенных наблюдений
+    """
+    vehicle_id: T.Hashable
+    time: float
+    mean: np.ndarray
+    covariance: np.ndarray
+    received: float
+
+
+class FleetFilter:
+    """Фильтры Калмана для многих автомобилей, хранящиеся в общих массивах (K, n) и (K, n, n).
+    Пачка наблюдений разных автомобилей обрабатывается векторно: одно предсказание для всех автомобилей пачки
+    до моментов их наблюдений и одна коррекция на каждый тип сенсора. Наблюдения одного автомобиля внутри
+    пачки обрабатываются по порядку времени в последовательных раундах.
+    """
+    def __init__(
+            self,
+            sensors_noise_stds=None,
+            noise_covariance_density=None,
+            initial_covariance=None,
+            capacity=1024):
+        """
+        :param sensors_noise_stds: dict {имя сенсора: std шума}, по умолчанию как в сценарии по умолчанию
+        :param noise_covariance_density: плотность ковариации шума модели эволюции (n, n)
+        :param initial_covariance: ковариация состояния нового автомобиля (n, n)
+        :param capacity: начальное число автомобилей, под которое выделяется память
+        """
+        state_size = Car.STATE_LAYOUT.size
+        if sensors_noise_stds is None:
+            sensors_noise_stds = {'gps': 1., 'can': 0.2, 'imu': 0.2}
+        self._observation_models = {}
+        for name, noise_std in sensors_noise_stds.items():
+            indices = SENSORS_INDICES[name]
+            C = np.zeros((len(indices), state_size), dtype=np.float64)
+            C[np.arange(len(indices)), indices] = 1
+            self._observation_models[name] = (C, np.eye(len(indices)) * noise_std**2)
+        self._observation_sizes = {name: C.shape[0] for name, (C, _) in self._observation_models.items()}
+        if noise_covariance_density is None:
+            noise_covariance_density = np.diag([0.1, 0.1, 0.1, 1., 1.])
+        self._noise_covariance_density = np.asarray(noise_covariance_density, dtype=np.float64)
+        if initial_covariance is None:
+            initial_covariance = 100 * np.eye(state_size)
+        self._initial_covariance = np.asarray(initial_covariance, dtype=np.float64)
+        self._rows = {}
+        self._means = np.zeros((capacity, state_size), dtype=np.float64)
+        self._covariances = np.zeros((capacity, state_size, state_size), dtype=np.float64)
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._dropped_number = 0
+
+    @property
+    def vehicles_number(self):
+        return len(self._rows)
+
+    @property
+    def dropped_number(self):
+        """Число отброшенных наблюдений: некорректных (см. is_valid) и пришедших позже уже обработанных
+        (по модельному времени)"""
+        return self._dropped_number
+
+    def is_valid(self, observation):
+        """Наблюдение от известного фильтру сенсора: значения - список или кортеж конечных чисел размера
+        наблюдения сенсора, время конечно. NaN и бесконечности навсегда испортили бы оценку автомобиля."""
+        # Проверка на чистом Python: для наблюдений из двух-трех чисел она в разы быстрее np.asarray
+        size = self._observation_sizes.get(observation.sensor)
+        values = observation.values
+        if size is None or not isinstance(values, (list, tuple)) or len(values) != size:
+            return False
+        try:
+            # Идентификатор из JSON может оказаться списком
+            hash(observation.vehicle_id)
+            if not math.isfinite(observation.time):
+                return False
+            for value in values:
+                if not math.isfinite(value):
+                    return False
+        except TypeError:
+            return False
+        return True
+
+    def drop(self, number=1):
+        """Учитывает наблюдения, отброшенные до обработки (например, сервисом при приеме)"""
+        self._dropped_number += number
+
+    def _get_row(self, vehicle_id, time):
+        row = self._rows.get(vehicle_id)
+        if row is None:
+            row = len(self._rows)
+            if row == self._means.shape[0]:
+                self._means = np.concatenate([self._means, np.zeros_like(self._means)])
+                self._covariances = np.concatenate([self._covariances, np.zeros_like(self._covariances)])
+                self._times = np.concatenate([self._times, np.zeros_like(self._times)])
+            self._means[row] = 0
+            self._covariances[row] = self._initial_covariance
+            self._times[row] = time
+            self._rows[vehicle_id] = row
+        return row
+
+    def get_estimate(self, vehicle_id):
+        """(время, среднее, ковариация) для автомобиля"""
+        row = self._rows[vehicle_id]
+        return self._times[row], np.array(self._means[row]), np.array(self._covariances[row])
+
+    def process(self, observations, validate=True):
+        """Обрабатывает пачку наблюдений.
+        :param observations: последовательность Observation
+        :param validate: отбросить некорректные наблюдения (is_valid); False - наблюдения уже проверены
+        :returns: dict {номер строки: (vehicle_id, самый ранний received)} для обновленных автомобилей
+        """
+        if validate:
+            valid = [observation for observation in observations if self.is_valid(observation)]
+            self.drop(len(observations) - len(valid))
+            observations = valid
+        if len(observations) == 0:
+            return {}
+        times = np.array([o.time for o in observations], dtype=np.float64)
+        rows = np.empty(len(observations), dtype=np.int64)
+        # Новые автомобили заводятся в момент их самого раннего наблюдения в пачке
+        for i in np.argsort(times, kind='stable').tolist():
+            rows[i] = self._get_row(observations[i].vehicle_id, times[i])
+        # Номер раунда - порядковый номер наблюдения среди наблюдений того же автомобиля в пачке
+        order = np.lexsort((times, rows))
+        sorted_rows = rows[order]
+        group_starts = np.flatnonzero(np.concatenate([[True], sorted_rows[1:] != sorted_rows[:-1]]))
+        group_sizes = np.diff(np.concatenate([group_starts, [order.shape[0]]]))
+        rounds = np.empty_like(order)
+        rounds[order] = np.arange(order.shape[0]) - np.repeat(group_starts, group_sizes)
+
+        updated = {}
+        for round_number in range(int(rounds.max()) + 1):
+            selected = np.flatnonzero(rounds == round_number)
+            round_rows = rows[selected]
+            dt = times[selected] - self._times[round_rows]
+            late = dt < 0
+            if np.any(late):
+                self._dropped_number += int(np.sum(late))
+                selected, round_rows, dt = selected[~late], round_rows[~late], dt[~late]
+            # Предсказание до моментов наблюдений всех автомобилей раунда
+            mu = self._means[round_rows]
+            J = get_state_jacobian_matrix(mu, dt)
+            self._means[round_rows] = move_state(mu, dt)
+            self._covariances[round_rows] = kalman_transit_covariance_batch(
+                self._covariances[round_rows], J, self._noise_covariance_density * dt[:, None, None])
+            self._times[round_rows] = times[selected]
+
+            # Коррекция: одна векторная операция на тип сенсора
+            sensors = [observations[i].sensor for i in selected]
+            for name, (C, Q) in self._observation_models.items():
+                mask = np.array([sensor == name for sensor in sensors], dtype=bool)
+                if not np.any(mask):
+                    continue
+                sensor_rows = round_rows[mask]
+                z = np.array([observations[i].values for i in selected[mask]], dtype=np.float64)
+                new_mu, new_S, _, _ = kalman_process_observation_batch(
+                    self._means[sensor_rows], self._covariances[sensor_rows], z.reshape(-1, C.shape[0]), C, Q)
+                self._means[sensor_rows] = new_mu
+                self._covariances[sensor_rows] = new_S
+
+            for i, row in zip(selected.tolist(), round_rows.tolist()):
+                received = observations[i].received
+                if row in updated:
+                    received = min(received, updated[row][1])
+                updated[row] = (observations[i].vehicle_id, received)
+        return updated
+
+
+class LocalizationService:
+    """Asyncio-сервис локализации парка автомобилей.
+    Наблюдения поступают через submit (в том же процессе) или по TCP (serve, JSON-строки) в ограниченную
+    очередь. Цикл run забирает все наблюдения, пришедшие за один такт batch_window, обрабатывает их одной
+    пачкой в FleetFilter и публикует оценки подписчикам.
+
+    Обратное давление: очереди подписчиков ограничены, и сервис ждет, пока медленный подписчик освободит место;
+    пока он ждет, заполняется входная очередь, и submit у производителей тоже начинает ждать.
+
+    Пример:
+
+        service = LocalizationService()
+        estimates = service.subscribe()
+        task = asyncio.create_task(service.run())
+        await service.submit(Observation('car-1', 'gps', 0.1, (5., 5.)))
+        estimate = await estimates.get()
+    """
+    def __init__(self, fleet_filter=None, batch_window=0.002, max_batch_size=4096, queue_size=65536):
+        """
+        :param fleet_filter: FleetFilter или None для фильтра с параметрами по умолчанию
+        :param batch_window: длительность такта сбора пачки в секундах
+        :param max_batch_size: максимальный размер пачки
+        :param queue_size: размер входной очереди
+        """
+        self._filter = FleetFilter() if fleet_filter is None else fleet_filter
+        self._batch_window = batch_window
+        self._max_batch_size = max_batch_size
+        self._queue = asyncio.Queue(queue_size)
+        self._subscribers = []
+        self._batches_number = 0
+        self._processed_number = 0
+        self._processing_time = 0.
+
+    @property
+    def fleet_filter(self):
+        return self._filter
+
+    @property
+    def metrics(self):
+        return {
+            'batches_number': self._batches_number,
+            'processed_number': self._processed_number,
+            'dropped_number': self._filter.dropped_number,
+            'vehicles_number': self._filter.vehicles_number,
+            'mean_batch_size': self._processed_number / max(self._batches_number, 1),
+            'processing_time': self._processing_time,
+        }
+
+    async def submit(self, observation):
+        """Ставит наблюдение в очередь; ждет, если очередь заполнена.
+        Некорректное наблюдение (FleetFilter.is_valid) не ставится и учитывается в dropped_number.
+        :returns: True, если наблюдение поставлено в очередь
+        """
+        if not self._filter.is_valid(observation):
+            self._filter.drop()
+            return False
+        await self._queue.put(observation)
+        return True
+
+    def subscribe(self, vehicles_ids=None, maxsize=65536):
+        """Очередь оценок для автомобилей vehicles_ids (множество, None - для всех)"""
+        queue = asyncio.Queue(maxsize)
+        self._subscribers.append((queue, vehicles_ids))
+        return queue
+
+    def unsubscribe(self, queue):
+        """Отписывает очередь и очищает ее: публикация, ожидающая места в этой очереди, продолжится"""
+        self._subscribers = [(q, ids) for q, ids in self._subscribers if q is not queue]
+        while not queue.empty():
+            queue.get_nowait()
+
+    async def join(self):
+        """Ждет обработки и публикации всех поставленных в очередь наблюдений"""
+        await self._queue.join()
+
+    async def stop(self):
+        await self._queue.put(None)
+
+    async def _get_batch(self):
+        batch = [await self._queue.get()]
+        if self._batch_window > 0 and self._queue.qsize() < self._max_batch_size:
+            await asyncio.sleep(self._batch_window)
+        while len(batch) < self._max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def run(self):
+        """Основной цикл: сбор пачки за такт, обработка, публикация. Завершается после stop()"""
+        running = True
+        while running:
+            batch = await self._get_batch()
+            # task_done вызывается и при ошибке обработки, иначе join и submit ждали бы вечно
+            try:
+                observations = [observation for observation in batch if observation is not None]
+                running = len(observations) == len(batch)
+                start = time.perf_counter()
+                try:
+                    # Наблюдения проверены в submit
+                    updated = self._filter.process(observations, validate=False)
+                except Exception:
+                    # Пачка, которую фильтр не смог обработать, отбрасывается целиком: цикл сервиса не должен
+                    # завершаться из-за одной пачки
+                    traceback.print_exc()
+                    self._filter.drop(len(observations))
+                    observations, updated = [], {}
+                self._processing_time += time.perf_counter() - start
+                self._batches_number += 1
+                self._processed_number += len(observations)
+                if updated and self._subscribers:
+                    await self._publish(updated)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _publish(self, updated):
+        means = self._filter._means
+        covariances = self._filter._covariances
+        times = self._filter._times
+        for row, (vehicle_id, received) in updated.items():
+            estimate = Estimate(
+                vehicle_id, float(times[row]), np.array(means[row]), np.array(covariances[row]), received)
+            for queue, vehicles_ids in list(self._subscribers):
+                # Пока публикация ждала места в другой очереди, эту могли отписать
+                if (vehicles_ids is None or vehicle_id in vehicles_ids) and \
+                        any(queue is subscribed for subscribed, _ in self._subscribers):
+                    await queue.put(estimate)
+
+    async def serve(self, host='127.0.0.1', port=0):
+        """TCP-транспорт: клиент присылает JSON-строки {"vehicle_id", "sensor", "time", "values", "sent"}
+        и получает JSON-строки с оценками для автомобилей, которые он присылал.
+        :returns: asyncio.Server
+        """
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _handle_connection(self, reader, writer):
+        vehicles_ids = set()
+        estimates = self.subscribe(vehicles_ids, maxsize=1024)
+
+        async def write_estimates():
+            while True:
+                estimate = await estimates.get()
+                writer.write((json.dumps({
+                    'vehicle_id': estimate.vehicle_id,
+                    'time': estimate.time,
+                    'mean': estimate.mean.tolist(),
+                    'sent': estimate.received,
+                }) + '\n').encode())
+                # Медленный клиент задерживает публикацию, а с ней и весь сервис
+                await writer.drain()
+
+        def on_writer_done(task):
+            # Клиент отключился: очередь отписывается сразу, иначе заполнившись она остановила бы публикацию
+            # для всех, и join (в том числе в этом обработчике) никогда бы не завершился
+            self.unsubscribe(estimates)
+            if not task.cancelled():
+                task.exception()
+
+        writer_task = asyncio.create_task(write_estimates())
+        writer_task.add_done_callback(on_writer_done)
+        try:
+            async for line in reader:
+                try:
+                    message = json.loads(line)
+                    observation = Observation(
+                        message['vehicle_id'], message['sensor'], message['time'], message['values'],
+                        message.get('sent', time.perf_counter()))
+                except (ValueError, KeyError, TypeError):
+                    self._filter.drop()
+                    continue
+                if await self.submit(observation):
+                    vehicles_ids.add(observation.vehicle_id)
+            await self.join()
+            while not estimates.empty() and not writer_task.done():
+                await asyncio.sleep(0)
+        finally:
+            writer_task.cancel()
+            self.unsubscribe(estimates)
+            writer.close()
+
+
+def make_fleet_log(vehicles_number, scenario=None, random_state=0):
+    """Журнал наблюдений парка автомобилей, смоделированных simulate_scenario с разными начальными положениями
+    и шумом сенсоров.
+    :returns: список Observation, упорядоченный по времени
+    """
+    from .scenario import make_scenario, simulate_scenario
+    if scenario is None:
+        scenario = make_scenario()
+    gen = np.random.RandomState(random_state)
+    seeds = np.random.SeedSequence(random_state).generate_state(vehicles_number)
+    records = []
+    for vehicle, seed in enumerate(seeds):
+        vehicle_scenario = dict(scenario)
+        vehicle_scenario['initial_position'] = gen.uniform(-1000, 1000, size=2).tolist()
+        vehicle_scenario['initial_yaw'] = gen.uniform(-np.pi, np.pi)
+        result = simulate_scenario(vehicle_scenario, random_state=int(seed))
+        for name, values in result['observations'].items():
+            steps = np.flatnonzero(~np.isnan(values[:, 0]))
+            records.extend(
+                (t, vehicle, name, tuple(v)) for t, v in zip(result['times'][steps].tolist(), values[steps].tolist()))
+    records.sort(key=lambda record: record[:2])
+    return [Observation(vehicle, name, t, values) for t, vehicle, name, values in records]
+
+
+def get_latency_report(latencies, observations_number, duration, service):
+    latencies = np.asarray(latencies, dtype=np.float64)
+    report = {
+        'observations_number': observations_number,
+        'duration': duration,
+        'throughput': observations_number / duration,
+        'estimates_number': int(latencies.shape[0]),
+    }
+    if latencies.shape[0] > 0:
+        report.update({
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+            'latency_max': float(np.max(latencies)),
+        })
+    report.update(service.metrics)
+    return report
+
+
+async def generate_load(service, log, speedup=None, transport='queue'):
+    """Нагрузочный генератор: проигрывает журнал наблюдений в сервис и измеряет пропускную способность
+    и задержку от поступления наблюдения до публикации оценки.
+    :param log: список Observation, см. make_fleet_log
+    :param speedup: во сколько раз быстрее реального времени подавать наблюдения; None - без ожидания
+    :param transport: 'queue' - в том же процессе, 'socket' - через TCP (serve)
+    :returns: dict с отчетом
+    """
+    assert transport in ('queue', 'socket')
+    latencies = []
+    run_task = asyncio.create_task(service.run())
+    loop = asyncio.get_running_loop()
+
+    async def pace(observation, start):
+        if speedup is not None:
+            delay = (observation.time - log[0].time) / speedup - (loop.time() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    start_time = time.perf_counter()
+    if transport == 'queue':
+        estimates = service.subscribe()
+
+        async def consume():
+            while True:
+                estimate = await estimates.get()
+                latencies.append(time.perf_counter() - estimate.received)
+
+        consumer = asyncio.create_task(consume())
+        start = loop.time()
+        for observation in log:
+            await pace(observation, start)
+            await service.submit(observation._replace(received=time.perf_counter()))
+        await service.join()
+        while not estimates.empty():
+            await asyncio.sleep(0)
+        consumer.cancel()
+    else:
+        server = await service.serve()
+        host, port = server.sockets[0].getsockname()[:2]
+        reader, writer = await asyncio.open_connection(host, port)
+
+        async def consume():
+            async for line in reader:
+                latencies.append(time.perf_counter() - json.loads(line)['sent'])
+
+        consumer = asyncio.create_task(consume())
+        start = loop.time()
+        for observation in log:
+            await pace(observation, start)
+            writer.write((json.dumps({
+                'vehicle_id': observation.vehicle_id,
+                'sensor': observation.sensor,
+                'time': observation.time,
+                'values': list(observation.values),
+                'sent': time.perf_counter(),
+            }) + '\n').encode())
+            await writer.drain()
+        writer.write_eof()
+        await consumer
+        writer.close()
+        server.close()
+        await server.wait_closed()
+    duration = time.perf_counter() - start_time
+    await service.stop()
+    await run_task
+    return get_latency_report(latencies, len(log), duration, service)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный тест сервиса локализации парка автомобилей')
+    parser.add_argument('--vehicles', type=int, default=200, help='число автомобилей')
+    parser.add_argument('--duration', type=float, default=10., help='длительность сценария в секундах')
+    parser.add_argument('--speedup', type=float, default=None, help='ускорение относительно реального времени')
+    parser.add_argument('--transport', choices=['queue', 'socket'], default='queue')
+    parser.add_argument('--batch-window', type=float, default=0.002, help='такт сбора пачки в секундах')
+    args = parser.parse_args(argv)
+
+    from .scenario import make_scenario
+    log = make_fleet_log(args.vehicles, make_scenario(duration=args.duration))
+    service = LocalizationService(batch_window=args.batch_window)
+    report = asyncio.run(generate_load(service, log, speedup=args.speedup, transport=args.transport))
+    for name, value in report.items():
+        print(f'{name:<20} {value:.6g}' if isinstance(value, float) else f'{name:<20} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,10 +15,5 @@ class GpsSensor(CarSensorBase):
         return 2
 
     def _observe_clear(self):
-        return np.array([self._car._position_x, self._car._position_y])
-
-
-if __name__ != '__main__':
-    sensor = GpsSensor(noise_variances=[15, 15])
-    assert sensor.observation_size == 2
-    assert np.all(sensor.get_noise_covariance() == np.diag([15, 15]))
+        state = self._car._state_view
+        return np.array([state.position_x, state.position_y])
@@ -0,0 +1,287 @@
+import numpy as np
+from .timestamp import Timestamp
+
+
+def get_landmarks_log_likelihood(x, y, yaw, observations, landmarks_xy, noise_covariance):
+    """Логарифм правдоподобия наблюдений маяков (как у LandmarkSensor) для поз робота (x, y, yaw).
+    Массивы x, y, yaw могут иметь любые совместимые для broadcasting размеры. Сумма квадратичных форм
+    по маякам раскрывается через моменты наблюдений и положений маяков (суммы 2x2), поэтому
+    стоимость O(число поз) не зависит от числа маяков, а временные массивы (позы x маяки x 2) не создаются.
+    Моменты раскрывают квадраты координат, и их сокращение теряет точность вдали от начала координат,
+    поэтому координаты отсчитываются от центра маяков: точность определяется удаленностью поз от маяков,
+    а не от начала координат (например, в UTM).
+    :param observations: положения маяков в локальной системе координат робота (L, 2)
+    :param landmarks_xy: положения маяков в глобальной системе координат (L, 2)
+    :param noise_covariance: ковариация шума наблюдения (2, 2)
+    """
+    observations = np.asarray(observations, dtype=np.float64).reshape(-1, 2)
+    landmarks_xy = np.asarray(landmarks_xy, dtype=np.float64).reshape(-1, 2)
+    landmarks_number = observations.shape[0]
+    assert landmarks_xy.shape[0] == landmarks_number
+    Q = np.asarray(noise_covariance, dtype=np.float64)
+    Qi = np.linalg.inv(Q)
+    # Невязки не меняются при одновременном сдвиге поз и маяков
+    center = landmarks_xy.mean(axis=0) if landmarks_number else np.zeros(2)
+    landmarks_xy = landmarks_xy - center
+    x = x - center[0]
+    y = y - center[1]
+
+    # d_l = z_l - R^T (l - p) = a_l + u, где u = R^T p, a_l = z_l - R^T l
+    cos_yaw, sin_yaw = np.cos(yaw), np.sin(yaw)
+    u0 = cos_yaw * x + sin_yaw * y
+    u1 = -sin_yaw * x + cos_yaw * y
+    sum_z = observations.sum(axis=0)
+    sum_l = landmarks_xy.sum(axis=0)
+    a0 = sum_z[0] - (cos_yaw * sum_l[0] + sin_yaw * sum_l[1])
+    a1 = sum_z[1] - (-sin_yaw * sum_l[0] + cos_yaw * sum_l[1])
+
+    # Sum_l a_l^T Qi a_l = Sum z^T Qi z - 2 tr(Qi R^T Sum l z^T) + tr(R Qi R^T Sum l l^T)
+    zz = np.einsum('li,ij,lj->', observations, Qi, observations)
+    M_lz = np.dot(landmarks_xy.T, observations)
+    M_ll = np.dot(landmarks_xy.T, landmarks_xy)
+    # R^T M_lz, где R = [[c, -s], [s, c]]
+    Rt_M_lz = np.array([
+        [cos_yaw * M_lz[0, 0] + sin_yaw * M_lz[1, 0], cos_yaw * M_lz[0, 1] + sin_yaw * M_lz[1, 1]],
+        [-sin_yaw * M_lz[0, 0] + cos_yaw * M_lz[1, 0], -sin_yaw * M_lz[0, 1] + cos_yaw * M_lz[1, 1]]])
+    cross = np.einsum('ij,ji...->...', Qi, Rt_M_lz)
+    # R^T M_ll R
+    Rt_M_ll = np.array([
+        [cos_yaw * M_ll[0, 0] + sin_yaw * M_ll[1, 0], cos_yaw * M_ll[0, 1] + sin_yaw * M_ll[1, 1]],
+        [-sin_yaw * M_ll[0, 0] + cos_yaw * M_ll[1, 0], -sin_yaw * M_ll[0, 1] + cos_yaw * M_ll[1, 1]]])
+    Rt_M_ll_R = np.array([
+        [Rt_M_ll[0, 0] * cos_yaw + Rt_M_ll[0, 1] * sin_yaw, -Rt_M_ll[0, 0] * sin_yaw + Rt_M_ll[0, 1] * cos_yaw],
+        [Rt_M_ll[1, 0] * cos_yaw + Rt_M_ll[1, 1] * sin_yaw, -Rt_M_ll[1, 0] * sin_yaw + Rt_M_ll[1, 1] * cos_yaw]])
+    ll = np.einsum('ij,ji...->...', Qi, Rt_M_ll_R)
+    constant_term = zz - 2 * cross + ll
+
+    quadratic = landmarks_number * (Qi[0, 0] * u0**2 + 2 * Qi[0, 1] * u0 * u1 + Qi[1, 1] * u1**2)
+    linear = 2 * (u0 * (Qi[0, 0] * a0 + Qi[0, 1] * a1) + u1 * (Qi[1, 0] * a0 + Qi[1, 1] * a1))
+    _, log_det = np.linalg.slogdet(2 * np.pi * Q)
+    return -0.5 * (quadratic + linear + constant_term + landmarks_number * log_det)
+
+
+def get_motion_kernel(shifts, sigma):
+    """Неотрицательное ядро предсказания вдоль одной оси сетки: сдвиг на дробное число ячеек shifts
+    линейной интерполяцией между двумя соседними целыми сдвигами, свернутый с дискретной гауссианой
+    со стандартным отклонением sigma ячеек. Веса неотрицательны и в сумме дают 1, поэтому в отличие
+    от фазового множителя FFT ядро не создает осцилляций вокруг узких пиков, а среднее положение
+    сдвигается ровно на shifts и при сдвигах меньше ячейки.
+    :param shifts: сдвиги в ячейках (K,)
+    :param sigma: стандартное отклонение размытия в ячейках
+    :returns: (first_offsets, weights): содержимое ячейки i переходит в ячейку i + first_offsets[k] + t
+        с весом weights[k, t]; first_offsets размера (K,), weights размера (K, T)
+    """
+    shifts = np.atleast_1d(np.asarray(shifts, dtype=np.float64))
+    radius = int(np.ceil(4 * sigma))
+    offsets = np.arange(-radius, radius + 1)
+    gaussian = np.exp(-0.5 * (offsets / sigma)**2) if sigma > 0 else (offsets == 0).astype(np.float64)
+    gaussian /= gaussian.sum()
+    floor = np.floor(shifts)
+    fraction = (shifts - floor)[:, None]
+    weights = np.zeros((shifts.shape[0], offsets.shape[0] + 1))
+    weights[:, :-1] += (1 - fraction) * gaussian
+    weights[:, 1:] += fraction * gaussian
+    return floor.astype(np.int64) - radius, weights
+
+
+def _apply_motion_kernel(P, first_offsets, weights, axis):
+    """Применяет к P (K, Nx, Ny) вдоль оси axis (1 или 2) ядро get_motion_kernel, свое для каждого индекса k
+    первой оси. Вероятность, сдвинутая за пределы сетки, отбрасывается."""
+    n = P.shape[axis]
+    result = np.zeros_like(P)
+    for k in range(P.shape[0]):
+        # Непрерывные срезы P[k] быстрее выборки по индексам для всех k сразу
+        source, target = P[k], result[k]
+        if axis == 2:
+            source, target = source.T, target.T
+        for t, weight in enumerate(weights[k]):
+            offset = first_offsets[k] + t
+            if abs(offset) >= n:
+                continue
+            if offset >= 0:
+                target[offset:] += weight * source[:n - offset]
+            else:
+                target[:n + offset] += weight * source[-offset:]
+    return result
+
+
+class GridLocalization:
+    """Гистограммный (сеточный) байесовский фильтр по позе (x, y, yaw) в квадратной области
+    [-region_side / 2, region_side / 2]^2. Подходит для многомодальных распределений и глобальной
+    локализации (в том числе задачи похищенного робота).
+
+    Распределение хранится на плотной сетке (Nx, Ny, Nyaw). Предсказание - сдвиг по (x, y), зависящий
+    от yaw, и по yaw с гауссовым размытием - выполняется неотрицательным ядром get_motion_kernel
+    (линейная интерполяция дробного сдвига), поэтому вероятность не становится отрицательной
+    и не растекается от узких пиков.
+
+    При обработке наблюдений правдоподобие в ячейках, в которых сосредоточена основная масса вероятности
+    (не более max_refined_cells), интегрируется по refinement^3 подъячейкам вместо значения в центре ячейки.
+    Подъячейки доступны через get_cells только до следующего move: предсказание выполняется на сетке, и
+    разрешение распределения между наблюдениями - cell_size. Память ограничена размером сетки плюс
+    max_refined_cells * refinement^3.
+    """
+    def __init__(
+            self,
+            region_side=100.,
+            cell_size=2.,
+            yaw_bins_number=64,
+            refinement=4,
+            max_refined_cells=2000,
+            refined_mass=0.999,
+            position_noise_density=0.1,
+            yaw_noise_density=0.01):
+        """
+        :param region_side: сторона квадратной области
+        :param cell_size: размер ячейки грубой сетки по x и y
+        :param yaw_bins_number: число ячеек грубой сетки по углу
+        :param refinement: во сколько раз мельче уточненные ячейки по каждой из осей
+        :param max_refined_cells: максимальное число уточняемых ячеек грубой сетки
+        :param refined_mass: уточняются ячейки, покрывающие эту долю вероятности
+        :param position_noise_density: дисперсия шума положения в секунду
+        :param yaw_noise_density: дисперсия шума угла в секунду
+        """
+        self._region_side = float(region_side)
+        self._cell_size = float(cell_size)
+        cells_number = int(np.ceil(self._region_side / self._cell_size))
+        self._yaw_cell_size = 2 * np.pi / yaw_bins_number
+        self._x = -self._region_side / 2. + self._cell_size * (np.arange(cells_number) + 0.5)
+        self._y = np.array(self._x)
+        self._yaw = self._yaw_cell_size * np.arange(yaw_bins_number)
+        self._refinement = int(refinement)
+        self._max_refined_cells = int(max_refined_cells)
+        self._refined_mass = refined_mass
+        self._position_noise_density = position_noise_density
+        self._yaw_noise_density = yaw_noise_density
+
+        # Равномерное начальное распределение - глобальная локализация
+        self._probabilities = np.full(self.shape, 1. / np.prod(self.shape))
+        self._refined_cells = np.zeros(0, dtype=np.int64)
+        self._refined_probabilities = np.zeros((0,) + (self._refinement,) * 3)
+
+    @property
+    def shape(self):
+        return self._x.shape[0], self._y.shape[0], self._yaw.shape[0]
+
+    @property
+    def probabilities(self):
+        """Распределение на грубой сетке (Nx, Ny, Nyaw)"""
+        return np.array(self._probabilities)
+
+    @property
+    def grid(self):
+        """Центры ячеек грубой сетки по каждой из осей: (x, y, yaw)"""
+        return self._x, self._y, self._yaw
+
+    def reset(self, probabilities=None):
+        """Сбрасывает распределение (по умолчанию - в равномерное)"""
+        if probabilities is None:
+            probabilities = np.ones(self.shape)
+        probabilities = np.array(probabilities, dtype=np.float64)
+        assert probabilities.shape == self.shape
+        self._probabilities = probabilities / probabilities.sum()
+        self._refined_cells = np.zeros(0, dtype=np.int64)
+        self._refined_probabilities = np.zeros((0,) + (self._refinement,) * 3)
+
+    def move(self, dt, velocity, omega):
+        """Предсказание: движение с линейной скоростью velocity и угловой скоростью omega
+        (например, по показаниям CAN и IMU) в течение dt."""
+        assert isinstance(dt, Timestamp)
+        dt_sec = dt.to_seconds()
+        # Раскладка (Nyaw, Nx, Ny): сдвиг по (x, y) свой для каждого yaw
+        P = np.ascontiguousarray(self._probabilities.transpose(2, 0, 1))
+
+        # Сдвиг и размытие по x, затем по y; вероятность, сдвинутая за пределы области, отбрасывается
+        sigma = np.sqrt(self._position_noise_density * dt_sec) / self._cell_size
+        shift_x = velocity * np.cos(self._yaw) * dt_sec / self._cell_size
+        shift_y = velocity * np.sin(self._yaw) * dt_sec / self._cell_size
+        P = _apply_motion_kernel(P, *get_motion_kernel(shift_x, sigma), axis=1)
+        P = _apply_motion_kernel(P, *get_motion_kernel(shift_y, sigma), axis=2)
+
+        # Циклический сдвиг и размытие по yaw
+        yaw_shift = omega * dt_sec / self._yaw_cell_size
+        yaw_sigma = np.sqrt(self._yaw_noise_density * dt_sec) / self._yaw_cell_size
+        (first_offset,), (weights,) = get_motion_kernel(yaw_shift, yaw_sigma)
+        P = sum(weight * np.roll(P, first_offset + t, axis=0) for t, weight in enumerate(weights))
+        P = np.ascontiguousarray(P.transpose(1, 2, 0))
+
+        total = P.sum()
+        self._probabilities = P / total if total > 0 else np.full(self.shape, 1. / np.prod(self.shape))
+        # Уточнение не переносится через предсказание, см. описание класса
+        self._refined_cells = np.zeros(0, dtype=np.int64)
+        self._refined_probabilities = np.zeros((0,) + (self._refinement,) * 3)
+
+    def process_landmarks_observations(self, observations, landmarks_xy, noise_covariance):
+        """Коррекция по наблюдениям маяков в локальной системе координат робота.
+        :param observations: np.ndarray размера (L, 2)
+        :param landmarks_xy: положения маяков в глобальной системе координат (L, 2)
+        :param noise_covariance: ковариация шума наблюдения (2, 2)
+        """
+        P = self._probabilities
+        log_prior = np.log(np.maximum(P, np.finfo(np.float64).tiny))
+        log_posterior = log_prior + get_landmarks_log_likelihood(
+            self._x[:, None, None], self._y[None, :, None], self._yaw[None, None, :],
+            observations, landmarks_xy, noise_covariance)
+
+        # Уточнение: самые вероятные ячейки делятся на подъячейки
+        refined_cells = self._select_cells_to_refine(P)
+        r = self._refinement
+        offsets = (np.arange(r) + 0.5) / r - 0.5
+        ix, iy, iyaw = np.unravel_index(refined_cells, self.shape)
+        sub_x = self._x[ix][:, None, None, None] + self._cell_size * offsets[None, :, None, None]
+        sub_y = self._y[iy][:, None, None, None] + self._cell_size * offsets[None, None, :, None]
+        sub_yaw = self._yaw[iyaw][:, None, None, None] + self._yaw_cell_size * offsets[None, None, None, :]
+        log_refined = log_prior.ravel()[refined_cells][:, None, None, None] - 3 * np.log(r) + \
+            get_landmarks_log_likelihood(sub_x, sub_y, sub_yaw, observations, landmarks_xy, noise_covariance)
+
+        max_log = max(np.max(log_posterior), np.max(log_refined))
+        posterior = np.exp(log_posterior - max_log)
+        refined = np.exp(log_refined - max_log)
+        posterior.ravel()[refined_cells] = refined.reshape(refined_cells.shape[0], -1).sum(axis=1)
+        total = posterior.sum()
+        self._probabilities = posterior / total
+        self._refined_cells = refined_cells
+        self._refined_probabilities = refined / total
+
+    def _select_cells_to_refine(self, P):
+        flat = P.ravel()
+        number = min(self._max_refined_cells, flat.shape[0])
+        candidates = np.argpartition(flat, flat.shape[0] - number)[flat.shape[0] - number:]
+        candidates = candidates[np.argsort(flat[candidates])[::-1]]
+        mass = np.cumsum(flat[candidates])
+        number = int(np.searchsorted(mass, self._refined_mass * flat.sum())) + 1
+        return np.sort(candidates[:number])
+
+    def get_cells(self):
+        """Все ячейки распределения с учетом уточнения: (x, y, yaw, probabilities), одномерные массивы"""
+        refined = np.zeros(np.prod(self.shape), dtype=bool)
+        refined[self._refined_cells] = True
+        ix, iy, iyaw = np.unravel_index(np.flatnonzero(~refined), self.shape)
+        x, y, yaw = [self._x[ix]], [self._y[iy]], [self._yaw[iyaw]]
+        probabilities = [self._probabilities.ravel()[~refined]]
+        if self._refined_cells.size:
+            r = self._refinement
+            offsets = (np.arange(r) + 0.5) / r - 0.5
+            ix, iy, iyaw = np.unravel_index(self._refined_cells, self.shape)
+            shape = (self._refined_cells.shape[0], r, r, r)
+            x.append(np.broadcast_to(
+                self._x[ix][:, None, None, None] + self._cell_size * offsets[None, :, None, None], shape).ravel())
+            y.append(np.broadcast_to(
+                self._y[iy][:, None, None, None] + self._cell_size * offsets[None, None, :, None], shape).ravel())
+            yaw.append(np.broadcast_to(
+                self._yaw[iyaw][:, None, None, None] + self._yaw_cell_size * offsets[None, None, None, :],
+                shape).ravel())
+            probabilities.append(self._refined_probabilities.ravel())
+        return np.concatenate(x), np.concatenate(y), np.concatenate(yaw), np.concatenate(probabilities)
+
+    def get_most_probable_pose(self):
+        """Поза (x, y, yaw) ячейки с максимальной вероятностью с учетом уточнения"""
+        x, y, yaw, probabilities = self.get_cells()
+        i = np.argmax(probabilities)
+        return np.array([x[i], y[i], yaw[i] % (2 * np.pi)])
+
+    def get_mean_pose(self):
+        """Среднее положение и круговое среднее угла"""
+        x, y, yaw, probabilities = self.get_cells()
+        mean_yaw = np.arctan2(np.dot(probabilities, np.sin(yaw)), np.dot(probabilities, np.cos(yaw)))
+        return np.array([np.dot(probabilities, x), np.dot(probabilities, y), mean_yaw % (2 * np.pi)])
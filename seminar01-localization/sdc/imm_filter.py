@@ -0,0 +1,166 @@
+import numpy as np
+from .timestamp import Timestamp
+from .kalman_filter import kalman_transit_covariance_batch, kalman_process_observation_batch
+from .kalman_movement_model import (
+    move_state,
+    get_state_jacobian_matrix,
+    move_state_straight,
+    get_straight_state_jacobian_matrix,
+)
+
+
+def get_straight_and_turn_modes(straight_noise_covariance_density, turn_noise_covariance_density):
+    """Стандартный набор режимов для IMM: движение по прямой (как LinearMovementModel с нулевой
+    угловой скоростью) и движение по окружности с постоянными скоростями (как CircleMovementModel).
+    :returns: список режимов (state_transition, state_jacobian, noise_covariance_density)
+    """
+    return [
+        (move_state_straight, get_straight_state_jacobian_matrix, straight_noise_covariance_density),
+        (move_state, get_state_jacobian_matrix, turn_noise_covariance_density),
+    ]
+
+
+class ImmFilter:
+    """Interacting Multiple Model фильтр. Хранит банк из K расширенных фильтров Калмана, каждый со своей
+    моделью эволюции, в виде стопок средних (K, n) и ковариаций (K, n, n). Переключение между режимами
+    описывается марковской цепью с матрицей переходных вероятностей.
+
+    Смешивание, предсказание ковариаций, обработка наблюдений и объединение оценок выполняются
+    векторно над всей стопкой. Функции перехода вызываются по одному разу на каждую группу режимов
+    с одинаковой функцией, поэтому режимы, отличающиеся только шумом, обрабатываются одним вызовом.
+    """
+    def __init__(
+            self,
+            modes,
+            transition_probabilities,
+            initial_mean,
+            initial_covariance,
+            initial_mode_probabilities=None):
+        """
+        :param modes: список режимов (state_transition, state_jacobian, noise_covariance_density), где
+            state_transition(state, dt_sec) и state_jacobian(state, dt_sec) принимают стопку состояний (k, n)
+        :param transition_probabilities: np.ndarray размера (K, K), P[i, j] - вероятность перейти из режима i
+            в режим j за один шаг предсказания
+        :param initial_mean: np.ndarray размера (n,) или (K, n)
+        :param initial_covariance: np.ndarray размера (n, n) или (K, n, n)
+        :param initial_mode_probabilities: np.ndarray размера (K,) или None (равномерное распределение)
+        """
+        modes_number = len(modes)
+        assert modes_number > 0
+        initial_mean = np.array(initial_mean, dtype=np.float64)
+        state_size = initial_mean.shape[-1]
+
+        self._means = np.array(np.broadcast_to(initial_mean, (modes_number, state_size)))
+        self._covariances = np.array(np.broadcast_to(
+            np.asarray(initial_covariance, dtype=np.float64), (modes_number, state_size, state_size)))
+
+        self._transition_probabilities = np.array(transition_probabilities, dtype=np.float64)
+        assert self._transition_probabilities.shape == (modes_number, modes_number)
+        assert np.all(self._transition_probabilities >= 0)
+        assert np.allclose(self._transition_probabilities.sum(axis=1), 1)
+
+        if initial_mode_probabilities is None:
+            initial_mode_probabilities = np.full(modes_number, 1. / modes_number)
+        self._mode_probabilities = np.array(initial_mode_probabilities, dtype=np.float64)
+        assert self._mode_probabilities.shape == (modes_number,)
+        assert np.isclose(self._mode_probabilities.sum(), 1)
+
+        # Режимы с одинаковыми функциями перехода группируются для одного векторного вызова
+        self._noise_covariance_densities = np.zeros((modes_number, state_size, state_size), dtype=np.float64)
+        groups = {}
+        for k, (state_transition, state_jacobian, noise_covariance_density) in enumerate(modes):
+            if noise_covariance_density is not None:
+                self._noise_covariance_densities[k] = noise_covariance_density
+            groups.setdefault((state_transition, state_jacobian), []).append(k)
+        self._groups = [
+            (state_transition, state_jacobian, np.array(indices))
+            for (state_transition, state_jacobian), indices in groups.items()]
+        self._jacobians = np.zeros_like(self._covariances)
+
+    @property
+    def modes_number(self):
+        return self._means.shape[0]
+
+    @property
+    def state_size(self):
+        return self._means.shape[1]
+
+    @property
+    def mode_probabilities(self):
+        return np.array(self._mode_probabilities)
+
+    @property
+    def means(self):
+        """Оценки состояния каждого из режимов, (K, n)"""
+        return np.array(self._means)
+
+    @property
+    def covariances(self):
+        """Матрицы ковариации каждого из режимов, (K, n, n)"""
+        return np.array(self._covariances)
+
+    @property
+    def state(self):
+        """Объединенная оценка состояния"""
+        return np.dot(self._mode_probabilities, self._means)
+
+    @property
+    def covariance_matrix(self):
+        """Объединенная матрица ковариации с учетом разброса оценок режимов"""
+        deltas = self._means - self.state[None, :]
+        return np.einsum('k,kij->ij', self._mode_probabilities, self._covariances) + \
+            np.einsum('k,ki,kj->ij', self._mode_probabilities, deltas, deltas)
+
+    def _mix(self):
+        """Смешивание оценок режимов перед предсказанием"""
+        # weights[i, j] = P(режим i на прошлом шаге | режим j на текущем шаге)
+        weights = self._transition_probabilities * self._mode_probabilities[:, None]
+        predicted_mode_probabilities = weights.sum(axis=0)
+        # В режим j можно не попасть ни из какого режима (нулевой столбец матрицы переходов или вероятности,
+        # ушедшие в ноль): тогда его оценка не смешивается и остается прежней, а не превращается в NaN
+        unreachable = predicted_mode_probabilities < np.finfo(np.float64).tiny
+        weights[:, unreachable] = np.eye(self.modes_number)[:, unreachable]
+        weights /= np.maximum(weights.sum(axis=0), np.finfo(np.float64).tiny)[None, :]
+
+        mixed_means = np.einsum('ij,in->jn', weights, self._means)
+        deltas = self._means[:, None, :] - mixed_means[None, :, :]
+        mixed_covariances = np.einsum('ij,inm->jnm', weights, self._covariances) + \
+            np.einsum('ij,ijn,ijm->jnm', weights, deltas, deltas)
+
+        self._means = mixed_means
+        self._covariances = mixed_covariances
+        self._mode_probabilities = predicted_mode_probabilities
+
+    def move(self, dt):
+        """Смешивание и предсказание всех режимов на момент времени t + dt"""
+        assert isinstance(dt, Timestamp)
+        self._mix()
+        dt_sec = dt.to_seconds()
+        for state_transition, state_jacobian, indices in self._groups:
+            means = self._means[indices]
+            self._jacobians[indices] = state_jacobian(means, dt_sec)
+            self._means[indices] = state_transition(means, dt_sec)
+        self._covariances = kalman_transit_covariance_batch(
+            self._covariances, self._jacobians, self._noise_covariance_densities * dt_sec)
+
+    def process_observation(self, observation, C, Q):
+        """Обрабатывает наблюдение z = C * x + noise во всех режимах и пересчитывает вероятности режимов.
+        :param observation: np.ndarray размера (m,)
+        :param C: матрица наблюдений (m, n)
+        :param Q: матрица ковариации шума наблюдений (m, m)
+        """
+        observation = np.asarray(observation, dtype=np.float64)
+        self._means, self._covariances, innovations, H = kalman_process_observation_batch(
+            self._means, self._covariances, observation, np.asarray(C), np.asarray(Q))
+
+        # Логарифм правдоподобия наблюдения в каждом из режимов
+        observation_size = observation.shape[-1]
+        _, log_det = np.linalg.slogdet(H)
+        mahalanobis = np.einsum('ki,ki->k', innovations, np.linalg.solve(H, innovations[..., None])[..., 0])
+        log_likelihoods = -0.5 * (mahalanobis + log_det + observation_size * np.log(2 * np.pi))
+
+        mode_probabilities = np.maximum(self._mode_probabilities, np.finfo(np.float64).tiny)
+        log_probabilities = np.log(mode_probabilities) + log_likelihoods
+        log_probabilities -= np.max(log_probabilities)
+        probabilities = np.exp(log_probabilities)
+        self._mode_probabilities = probabilities / probabilities.sum()
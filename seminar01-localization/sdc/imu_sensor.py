@@ -3,7 +3,8 @@ from .car_sensor_base import CarSensorBase
 
 
 class ImuSensor(CarSensorBase):
-    """IMU-датчик. Измеряет угловую скорость автомобиля"""
+    """IMU-датчик. Измеряет угловую скорость автомобиля.
+    Дрейф нуля и масштаба задаются параметрами bias и scale_drift (см. CarSensorBase, sensor_drift.py)"""
     def __init__(self, *args, **kwargs):
         super(ImuSensor, self).__init__(*args, **kwargs)
 
@@ -16,9 +17,3 @@ class ImuSensor(CarSensorBase):
 
     def _observe_clear(self):
         return np.array([self._car._omega])
-
-
-if __name__ != '__main__':
-    sensor = ImuSensor(noise_variances=[1])
-    assert sensor.observation_size == 1
-    assert np.all(sensor.get_noise_covariance() == np.diag([1]))
@@ -0,0 +1,169 @@
+import os
+import time
+import _thread
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+_profiler = None
+
+
+def stage(name):
+    """Контекстный менеджер, измеряющий время этапа name, если профилировщик включен"""
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+
+def count(name, value=1):
+    """Увеличивает счетчик name, если профилировщик включен"""
+    if _profiler is not None:
+        _profiler.count(name, value)
+
+
+def get_profiler():
+    """Текущий профилировщик или None"""
+    return _profiler
+
+
+class _Stage:
+    __slots__ = ('_profiler', '_name', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profiler._add(self._name, self._start, time.perf_counter_ns())
+        return False
+
+
+class Profiler:
+    """Собирает время этапов (число вызовов, суммарное, минимальное и максимальное время) и счетчики.
+    При trace=True дополнительно запоминает каждый вызов для экспорта в формате Chrome trace events,
+    но не больше max_events событий."""
+    def __init__(self, trace=False, max_events=1000000):
+        self._trace = trace
+        self._max_events = max_events
+        self._stages = {}
+        self._counters = {}
+        self._events = []
+        self._origin = time.perf_counter_ns()
+        self._pid = os.getpid()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def count(self, name, value=1):
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def _add(self, name, start, end):
+        duration = end - start
+        statistics = self._stages.get(name)
+        if statistics is None:
+            self._stages[name] = [1, duration, duration, duration]
+        else:
+            statistics[0] += 1
+            statistics[1] += duration
+            if duration < statistics[2]:
+                statistics[2] = duration
+            if duration > statistics[3]:
+                statistics[3] = duration
+        if self._trace and len(self._events) < self._max_events:
+            self._events.append((name, start, duration, _thread.get_ident()))
+
+    @property
+    def stages(self):
+        """dict {этап: {'calls', 'total', 'min', 'max', 'mean'}}, времена в секундах"""
+        return {
+            name: {
+                'calls': calls,
+                'total': total * 1e-9,
+                'min': minimum * 1e-9,
+                'max': maximum * 1e-9,
+                'mean': total / calls * 1e-9,
+            }
+            for name, (calls, total, minimum, maximum) in self._stages.items()}
+
+    @property
+    def counters(self):
+        return dict(self._counters)
+
+    def reset(self):
+        self._stages.clear()
+        self._counters.clear()
+        self._events.clear()
+
+    def summary(self):
+        """Таблица этапов, отсортированная по суммарному времени"""
+        lines = ['{:<45} {:>10} {:>12} {:>10} {:>10} {:>10}'.format(
+            'stage', 'calls', 'total[ms]', 'mean[us]', 'min[us]', 'max[us]')]
+        stages = sorted(self.stages.items(), key=lambda item: -item[1]['total'])
+        for name, statistics in stages:
+            lines.append('{:<45} {:>10d} {:>12.3f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+                name, statistics['calls'], statistics['total'] * 1e3, statistics['mean'] * 1e6,
+                statistics['min'] * 1e6, statistics['max'] * 1e6))
+        for name, value in sorted(self._counters.items()):
+            lines.append('{:<45} {:>10}'.format(name, value))
+        return '\n'.join(lines)
+
+    def get_chrome_trace(self):
+        """События в формате Chrome trace events (для chrome://tracing и Perfetto)"""
+        events = [
+            {'name': name, 'ph': 'X', 'pid': self._pid, 'tid': thread_id,
+             'ts': (start - self._origin) / 1e3, 'dur': duration / 1e3}
+            for name, start, duration, thread_id in self._events]
+        timestamp = (time.perf_counter_ns() - self._origin) / 1e3
+        for name, value in self._counters.items():
+            events.append({'name': name, 'ph': 'C', 'pid': self._pid, 'ts': timestamp, 'args': {name: value}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save_chrome_trace(self, path):
+        import json
+        with open(path, 'w') as output:
+            json.dump(self.get_chrome_trace(), output)
+
+
+class profile:
+    """Контекстный менеджер, включающий профилировщик на время блока. Вложенные блоки допустимы:
+    по выходу из блока восстанавливается предыдущий профилировщик.
+    Пока профилировщик не включен, stage() возвращает общий пустой контекстный менеджер, поэтому
+    накладные расходы инструментации - один вызов функции на этап. Пример:
+
+        from sdc import instrumentation
+
+        with instrumentation.profile(trace=True) as profiler:
+            for ...:
+                kalman_car.move(dt)
+                sensor.process_observation(observation)
+        print(profiler.summary())
+        profiler.save_chrome_trace('trace.json')  # открывается в chrome://tracing или ui.perfetto.dev
+    """
+    def __init__(self, trace=False, max_events=1000000, profiler=None):
+        self._profiler = profiler if profiler is not None else Profiler(trace=trace, max_events=max_events)
+        self._previous = None
+
+    def __enter__(self):
+        global _profiler
+        self._previous = _profiler
+        _profiler = self._profiler
+        return self._profiler
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _profiler
+        _profiler = self._previous
+        return False
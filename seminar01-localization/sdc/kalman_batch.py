@@ -0,0 +1,143 @@
+import numpy as np
+from .kalman_movement_model import move_state, get_state_jacobian_matrix
+from .precision import get_state_dtype
+
+
+def stack_observations(observations_by_sensor, times_number):
+    """Собирает наблюдения всех сенсоров в один непрерывный массив.
+    :param observations_by_sensor: dict {имя сенсора: (observations, C, Q)}, где observations -
+        np.ndarray размера (T, m) или (T,), C - матрица наблюдений (m, n), Q - ковариация шума (m, m).
+        Отсутствующие в момент времени наблюдения обозначаются NaN.
+    :param times_number: количество моментов времени T
+    :returns: (Z, C, Q) - наблюдения (T, M), матрица наблюдений (M, n) и блочно-диагональная
+        матрица ковариации шума (M, M), где M - суммарный размер наблюдений всех сенсоров
+    """
+    observations_list = []
+    matrices_list = []
+    for name, (observations, C, Q) in observations_by_sensor.items():
+        observations = np.asarray(observations, dtype=np.float64)
+        if observations.ndim == 1:
+            observations = observations[:, None]
+        C = np.atleast_2d(np.asarray(C, dtype=np.float64))
+        Q = np.atleast_2d(np.asarray(Q, dtype=np.float64))
+        observation_size = C.shape[0]
+        assert observations.shape == (times_number, observation_size), \
+            f'Sensor {name}: expected observations of shape {(times_number, observation_size)}, '\
+            f'got {observations.shape}'
+        assert Q.shape == (observation_size, observation_size)
+        observations_list.append(observations)
+        matrices_list.append((C, Q))
+
+    total_size = sum(C.shape[0] for C, _ in matrices_list)
+    state_size = matrices_list[0][0].shape[1] if matrices_list else 0
+    Z = np.empty((times_number, total_size), dtype=np.float64)
+    C_all = np.zeros((total_size, state_size), dtype=np.float64)
+    Q_all = np.zeros((total_size, total_size), dtype=np.float64)
+    offset = 0
+    for observations, (C, Q) in zip(observations_list, matrices_list):
+        size = C.shape[0]
+        assert C.shape[1] == state_size
+        Z[:, offset:offset + size] = observations
+        C_all[offset:offset + size] = C
+        Q_all[offset:offset + size, offset:offset + size] = Q
+        offset += size
+    return Z, C_all, Q_all
+
+
+def filter_arrays(
+        times,
+        observations_by_sensor,
+        initial_mean,
+        initial_covariance,
+        noise_covariance_density=None,
+        max_dt=None,
+        state_transition=move_state,
+        state_jacobian=get_state_jacobian_matrix,
+        means_out=None,
+        covariances_out=None,
+        dtype=None):
+    """Расширенный фильтр Калмана по всей траектории сразу, без создания KalmanCar и Timestamp на каждом шаге.
+    В момент times[0] состояние равно initial_mean, далее для каждого момента времени выполняется
+    предсказание до times[t] и обработка всех доступных в этот момент наблюдений.
+
+    :param times: np.ndarray размера (T,), неубывающие моменты времени наблюдений в секундах
+    :param observations_by_sensor: dict {имя сенсора: (observations, C, Q)}, см. stack_observations
+    :param initial_mean: np.ndarray размера (n,), начальное состояние
+    :param initial_covariance: np.ndarray размера (n, n), начальная матрица ковариации
+    :param noise_covariance_density: np.ndarray размера (n, n) или None, плотность ковариации шума модели
+        эволюции (как в KalmanMovementModel). Если не задана, то полагается нулевой.
+    :param max_dt: float или None. Максимальный шаг интегрирования модели эволюции в секундах. Интервалы
+        между наблюдениями длиннее max_dt разбиваются на равные подшаги.
+    :param state_transition: функция (state, dt_sec) -> new_state
+    :param state_jacobian: функция (state, dt_sec) -> матрица Якоби (n, n)
+    :param means_out: np.ndarray размера (T, n) или None. Массив для записи результата.
+    :param covariances_out: np.ndarray размера (T, n, n) или None. Массив для записи результата.
+    :param dtype: тип хранения результата, если means_out и covariances_out не заданы: np.float64
+        (по умолчанию) или np.float32. Это только формат хранения: рекурсия фильтра всегда выполняется
+        в float64, округляются сохраняемые значения, а float32 вдвое сокращает память под ковариации (T, n, n).
+    :returns: (means, covariances) - средние (T, n) и ковариации (T, n, n) после обработки наблюдений
+    """
+    times = np.asarray(times, dtype=np.float64)
+    assert times.ndim == 1
+    times_number = times.shape[0]
+    assert np.all(np.diff(times) >= 0), 'Times must be non-decreasing'
+
+    mu = np.array(initial_mean, dtype=np.float64)
+    state_size = mu.shape[0]
+    S = np.array(initial_covariance, dtype=np.float64)
+    assert S.shape == (state_size, state_size)
+    if noise_covariance_density is None:
+        noise_covariance_density = np.zeros((state_size, state_size), dtype=np.float64)
+    noise_covariance_density = np.asarray(noise_covariance_density, dtype=np.float64)
+    assert noise_covariance_density.shape == (state_size, state_size)
+
+    dtype = get_state_dtype(dtype)
+    if means_out is None:
+        means_out = np.empty((times_number, state_size), dtype=dtype)
+    if covariances_out is None:
+        covariances_out = np.empty((times_number, state_size, state_size), dtype=dtype)
+    assert means_out.shape == (times_number, state_size)
+    assert covariances_out.shape == (times_number, state_size, state_size)
+
+    Z, C_all, Q_all = stack_observations(observations_by_sensor, times_number)
+    if Z.shape[1] > 0:
+        assert C_all.shape[1] == state_size
+    observed = ~np.isnan(Z)
+    fully_observed = np.all(observed, axis=1)
+
+    for t in range(times_number):
+        # Предсказание
+        if t > 0:
+            interval = times[t] - times[t - 1]
+            steps_number = 1
+            if max_dt is not None and interval > max_dt:
+                steps_number = int(np.ceil(interval / max_dt))
+            dt_sec = interval / steps_number
+            if dt_sec > 0:
+                R = noise_covariance_density * dt_sec
+                for _ in range(steps_number):
+                    J = state_jacobian(mu, dt_sec)
+                    mu = state_transition(mu, dt_sec)
+                    S = np.dot(np.dot(J, S), J.T) + R
+
+        # Коррекция по всем наблюдениям, доступным в момент times[t]
+        if fully_observed[t]:
+            z, C, Q = Z[t], C_all, Q_all
+        elif np.any(observed[t]):
+            rows = observed[t]
+            z, C, Q = Z[t, rows], C_all[rows], Q_all[np.ix_(rows, rows)]
+        else:
+            z = None
+        if z is not None and z.shape[0] > 0:
+            CS = np.dot(C, S)
+            H = np.dot(CS, C.T) + Q
+            # K = S * C^T * H^-1, при этом H и S симметричны
+            K = np.linalg.solve(H, CS).T
+            mu = mu + np.dot(K, z - np.dot(C, mu))
+            S = S - np.dot(K, CS)
+            # Избавляемся от маленьких чисел. Из-за них могут быть мнимые числа в собственных значениях
+            S[np.abs(S) < 1e-16] = 0
+
+        means_out[t] = mu
+        covariances_out[t] = S
+    return means_out, covariances_out
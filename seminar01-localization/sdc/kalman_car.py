@@ -6,14 +6,23 @@ from .kalman_can_sensor import KalmanCanSensor
 from .kalman_gps_sensor import KalmanGpsSensor
 from .kalman_imu_sensor import KalmanImuSensor
 from .kalman_filter import kalman_transit_covariance
+from .instrumentation import stage
 
 
 class KalmanCar(Car):
-    def __init__(self, initial_covariance_matrix=None, *args, **kwargs):
+    def __init__(self, initial_covariance_matrix=None, *args, state_layout=None, **kwargs):
+        """
+        :param state_layout: StateLayout или None. Раскладка вектора состояния; по умолчанию
+            (pos_x, pos_y, yaw, vel, omega). Дополнительные поля изначально равны нулю.
+        """
+        if state_layout is not None:
+            self._set_state_layout(state_layout)
         super(KalmanCar, self).__init__(*args, **kwargs)
         if initial_covariance_matrix is None:
             initial_covariance_matrix = 100 * np.eye(self.state_size)
         self._covariance_matrix = initial_covariance_matrix
+        # Матрица Якоби переиспользуется между шагами, см. KalmanMovementModel.get_state_jacobian_matrix
+        self._state_jacobian = None
 
     @property
     def state_size(self):
@@ -29,13 +38,7 @@ class KalmanCar(Car):
         assert state.shape == (self.state_size,)
         self._state = state
         # Храним историю состояний
-        self._positions_x.append(self._position_x)
-        self._positions_y.append(self._position_y)
-        self._yaws.append(self._yaw)
-        self._velocities.append(self._velocity)
-        self._velocities_x.append(self._velocity_x)
-        self._velocities_y.append(self._velocity_y)
-        self._omegas.append(self._omega)
+        self._append_history()
 
     @property
     def covariance_matrix(self):
@@ -71,21 +74,20 @@ class KalmanCar(Car):
     def move(self, dt):
         assert isinstance(dt, Timestamp)
         # Делаем предсказание на момент времени t + dt
-        new_mu = self.movement_model.get_next_state(dt)
+        with stage('KalmanCar.move.predict'):
+            new_mu = self.movement_model.get_next_state(dt)
 
-        J = self.movement_model.get_state_jacobian_matrix(dt)
-        R = self.movement_model.get_noise_covariance(dt)
-        S = self.covariance_matrix
-        new_S = kalman_transit_covariance(S, J, R)
+        with stage('KalmanCar.move.jacobian'):
+            J = self.movement_model.get_state_jacobian_matrix(dt, out=self._state_jacobian)
+            self._state_jacobian = J
+        with stage('KalmanCar.move.covariance_transit'):
+            R = self.movement_model.get_noise_covariance(dt)
+            S = self.covariance_matrix
+            new_S = kalman_transit_covariance(S, J, R)
 
-        self.state = new_mu
-        self.covariance_matrix = new_S
+        with stage('KalmanCar.move.history_append'):
+            self.state = new_mu
+            self.covariance_matrix = new_S
 
-        # Храним историю состояний
-        self._positions_x.append(self._position_x)
-        self._positions_y.append(self._position_y)
-        self._yaws.append(self._yaw)
-        self._velocities.append(self._velocity)
-        self._velocities_x.append(self._velocity_x)
-        self._velocities_y.append(self._velocity_y)
-        self._omegas.append(self._omega)
+            # Храним историю состояний
+            self._append_history()
@@ -15,7 +15,7 @@ def kalman_transit_covariance(S, A, R):
     return new_S
 
 
-def kalman_process_observation(mu, S, observation, C, Q):
+def kalman_process_observation(mu, S, observation, C, Q, return_innovation=False):
     """
     Performs processing of an observation coming from the model: z = C * x + noise
     :param mu: Current mean
@@ -23,16 +23,63 @@ def kalman_process_observation(mu, S, observation, C, Q):
     :param observation: Vector z
     :param C: Observation matrix
     :param Q: Noise covariance matrix (with zero mean)
+    :param return_innovation: also return the innovation z - C * mu and its covariance C * S * C^T + Q
+    :returns: new mean and covariance matrix (and the innovation with its covariance if requested)
     """
     state_size = mu.shape[0]
     observation_size = observation.shape[0]
     assert S.shape == (state_size, state_size)
     assert observation_size == C.shape[0]
     assert observation_size == Q.shape[0]
-    H = np.linalg.inv(np.dot(np.dot(C, S), C.T) + Q)
+    innovation_covariance = np.dot(np.dot(C, S), C.T) + Q
+    H = np.linalg.inv(innovation_covariance)
     K = np.dot(np.dot(S, C.T), H)
-    new_mu = mu + np.dot(K, observation - np.dot(C, mu))
+    innovation = observation - np.dot(C, mu)
+    new_mu = mu + np.dot(K, innovation)
     new_S = np.dot(np.eye(state_size) - np.dot(K, C), S)
     # Избавляемся от маленьких чисел. Из-за них могут быть мнимые числа в собственных значениях
     new_S[np.abs(new_S) < 1e-16] = 0
+    if return_innovation:
+        return new_mu, new_S, innovation, innovation_covariance
     return new_mu, new_S
+
+
+def kalman_transit_covariance_batch(S, A, R):
+    """
+    Batched version of kalman_transit_covariance for a stack of K independent filters.
+    :param S: Current covariance matrices, shape (K, n, n)
+    :param A: Transition or jacobian matrices, shape (K, n, n) or (n, n)
+    :param R: Noise covariance matrices, shape (K, n, n) or (n, n)
+    """
+    state_size = S.shape[-1]
+    assert S.ndim == 3 and S.shape[1:] == (state_size, state_size)
+    assert A.shape[-2:] == (state_size, state_size)
+    assert R.shape[-2:] == (state_size, state_size)
+    return np.matmul(np.matmul(A, S), np.swapaxes(A, -1, -2)) + R
+
+
+def kalman_process_observation_batch(mu, S, observation, C, Q):
+    """
+    Batched version of kalman_process_observation for a stack of K independent filters.
+    :param mu: Current means, shape (K, n)
+    :param S: Current covariance matrices, shape (K, n, n)
+    :param observation: Vectors z, shape (K, m) or (m,)
+    :param C: Observation matrices, shape (K, m, n) or (m, n)
+    :param Q: Noise covariance matrices, shape (K, m, m) or (m, m)
+    :returns: new means (K, n), new covariances (K, n, n), innovations (K, m)
+        and innovation covariances (K, m, m)
+    """
+    filters_number, state_size = mu.shape
+    observation_size = observation.shape[-1]
+    assert S.shape == (filters_number, state_size, state_size)
+    assert C.shape[-2:] == (observation_size, state_size)
+    assert Q.shape[-2:] == (observation_size, observation_size)
+    CS = np.matmul(C, S)
+    H = np.matmul(CS, np.swapaxes(C, -1, -2)) + Q
+    # K = S * C^T * H^-1, while H and S are symmetric
+    K = np.swapaxes(np.linalg.solve(H, CS), -1, -2)
+    innovation = observation - np.matmul(C, mu[..., None])[..., 0]
+    new_mu = mu + np.matmul(K, innovation[..., None])[..., 0]
+    new_S = S - np.matmul(K, CS)
+    new_S[np.abs(new_S) < 1e-16] = 0
+    return new_mu, new_S, innovation, H
@@ -1,4 +1,3 @@
-import numpy as np
 from .kalman_sensor_base import KalmanSensorBase
 
 
@@ -16,12 +15,4 @@ class KalmanImuSensor(KalmanSensorBase):
 
     def get_observation_matrix(self):
         """Калмановская матрица наблюдений C"""
-        observation_matrix = np.zeros((self.observation_size, self.state_size), dtype=np.float64)
-        observation_matrix[0, self._car_model.OMEGA_INDEX] = 1
-        return observation_matrix
-
-
-if __name__ != '__main__':
-    sensor = KalmanImuSensor(noise_variances=[5])
-    assert sensor.observation_size == 1
-    assert np.all(sensor.get_noise_covariance() == np.diag([5]))
+        return self._car_model.STATE_LAYOUT.get_observation_matrix(('omega',))
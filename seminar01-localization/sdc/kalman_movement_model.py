@@ -1,5 +1,67 @@
 import numpy as np
+from .car import Car
 from .timestamp import Timestamp
+from .state_layout import make_move_kernel, make_jacobian_kernel
+
+
+def move_state(state, dt_sec):
+    """Продвигает состояние (x, y, yaw, v, omega) вперед на dt_sec секунд с текущими скоростями.
+    :param state: np.ndarray размера (..., 5). Допускается стопка состояний по первым осям.
+    :param dt_sec: float, шаг по времени в секундах
+    """
+    x = state[..., Car.POS_X_INDEX]
+    y = state[..., Car.POS_Y_INDEX]
+    yaw = state[..., Car.YAW_INDEX]
+    vel = state[..., Car.VEL_INDEX]
+    omega = state[..., Car.OMEGA_INDEX]
+
+    new_state = np.zeros_like(state)
+    new_state[..., Car.POS_X_INDEX] = x + vel * np.cos(yaw) * dt_sec
+    new_state[..., Car.POS_Y_INDEX] = y + vel * np.sin(yaw) * dt_sec
+    new_state[..., Car.YAW_INDEX] = yaw + omega * dt_sec
+    new_state[..., Car.VEL_INDEX] = vel
+    new_state[..., Car.OMEGA_INDEX] = omega
+    return new_state
+
+
+def get_state_jacobian_matrix(state, dt_sec):
+    """Матрица Якоби функции move_state по состоянию.
+    :param state: np.ndarray размера (..., n)
+    :param dt_sec: float, шаг по времени в секундах
+    :returns: np.ndarray размера (..., n, n)
+    """
+    state_size = state.shape[-1]
+    vel = state[..., Car.VEL_INDEX]
+    yaw = state[..., Car.YAW_INDEX]
+    J = np.zeros(state.shape + (state_size,), dtype=np.float64)
+    J[..., np.arange(state_size), np.arange(state_size)] = 1
+    J[..., Car.POS_X_INDEX, Car.VEL_INDEX] = np.cos(yaw) * dt_sec
+    J[..., Car.POS_Y_INDEX, Car.VEL_INDEX] = np.sin(yaw) * dt_sec
+    J[..., Car.POS_X_INDEX, Car.YAW_INDEX] = -vel * np.sin(yaw) * dt_sec
+    J[..., Car.POS_Y_INDEX, Car.YAW_INDEX] = vel * np.cos(yaw) * dt_sec
+    J[..., Car.YAW_INDEX, Car.OMEGA_INDEX] = dt_sec
+    return J
+
+
+def move_state_straight(state, dt_sec):
+    """Продвигает состояние вдоль прямой: направление движения не меняется, угловая скорость обнуляется.
+    :param state: np.ndarray размера (..., 5)
+    :param dt_sec: float, шаг по времени в секундах
+    """
+    new_state = move_state(state, dt_sec)
+    new_state[..., Car.YAW_INDEX] = state[..., Car.YAW_INDEX]
+    new_state[..., Car.OMEGA_INDEX] = 0
+    return new_state
+
+
+def get_straight_state_jacobian_matrix(state, dt_sec):
+    """Матрица Якоби функции move_state_straight по состоянию.
+    :returns: np.ndarray размера (..., n, n)
+    """
+    J = get_state_jacobian_matrix(state, dt_sec)
+    J[..., Car.YAW_INDEX, Car.OMEGA_INDEX] = 0
+    J[..., Car.OMEGA_INDEX, Car.OMEGA_INDEX] = 0
+    return J
 
 
 class KalmanMovementModel:
@@ -14,6 +76,8 @@ class KalmanMovementModel:
         """
         self._car_model = None
         self._noise_covariance_density = noise_covariance_density
+        self._move_kernel = None
+        self._jacobian_kernel = None
 
     @property
     def state_size(self):
@@ -25,6 +89,9 @@ class KalmanMovementModel:
         """
         self._car_model = car_model
         state_size = car_model._state_size
+        # Ядра предсказания и матрицы Якоби строятся под раскладку состояния автомобиля
+        self._move_kernel = make_move_kernel(car_model.STATE_LAYOUT)
+        self._jacobian_kernel = make_jacobian_kernel(car_model.STATE_LAYOUT)
         if self._noise_covariance_density is None:
             self._noise_covariance_density = np.zeros((state_size, state_size), dtype=np.float64)
         else:
@@ -34,44 +101,17 @@ class KalmanMovementModel:
     def get_next_state(self, dt):
         """Возвращает состояние в следующий момент времени."""
         assert isinstance(dt, Timestamp)
-        car = self._car_model
-        state_size = car.state_size
-        state = car.state
-        assert state.shape[0] == state_size
-        dt_sec = dt.to_seconds()
-        x = state[car.POS_X_INDEX]
-        y = state[car.POS_Y_INDEX]
-        yaw = state[car.YAW_INDEX]
-        vel = state[car.VEL_INDEX]
-        omega = state[car.OMEGA_INDEX]
-
-        new_state = np.zeros_like(state)
-        new_state[car.POS_X_INDEX] = x + vel * np.cos(yaw) * dt_sec
-        new_state[car.POS_Y_INDEX] = y + vel * np.sin(yaw) * dt_sec
-        new_state[car.YAW_INDEX] = yaw + omega * dt_sec
-        new_state[car.VEL_INDEX] = vel
-        new_state[car.OMEGA_INDEX] = omega
-        return new_state
-
-    def get_state_jacobian_matrix(self, dt):
+        state = self._car_model._state
+        return self._move_kernel(state, dt.to_seconds())
+
+    def get_state_jacobian_matrix(self, dt, out=None):
         """Возвращает матрицу матрицу Якоби car.time. В случае линейной системе матрица Якоби представляет
-        собой матрицу перехода A для текущего момента времени car.time."""
+        собой матрицу перехода A для текущего момента времени car.time.
+        :param out: матрица, возвращенная предыдущим вызовом, для повторного использования, или None
+        """
         assert isinstance(dt, Timestamp)
-        car = self._car_model
-        state_size = car._state_size
-        state = car.state
-        assert state.shape[0] == state_size
-
-        dt_sec = dt.to_seconds()
-        vel = state[car.VEL_INDEX]
-        yaw = state[car.YAW_INDEX]
-        J = np.eye(state_size, dtype=np.float64)
-        J[car.POS_X_INDEX, car.VEL_INDEX] = np.cos(yaw) * dt_sec
-        J[car.POS_Y_INDEX, car.VEL_INDEX] = np.sin(yaw) * dt_sec
-        J[car.POS_X_INDEX, car.YAW_INDEX] = -vel * np.sin(yaw) * dt_sec
-        J[car.POS_Y_INDEX, car.YAW_INDEX] = vel * np.cos(yaw) * dt_sec
-        J[car.YAW_INDEX, car.OMEGA_INDEX] = dt_sec
-        return J
+        state = self._car_model._state
+        return self._jacobian_kernel(state, dt.to_seconds(), out)
 
     def get_noise_covariance(self, dt):
         """Возвращает матрицу ковариации шума для текущего момента времени car.time"""
@@ -1,6 +1,7 @@
 import abc
 import numpy as np
 from .kalman_filter import kalman_process_observation
+from .instrumentation import stage
 
 
 class KalmanSensorBase(abc.ABC):
@@ -20,6 +21,8 @@ class KalmanSensorBase(abc.ABC):
     def _initialize(self, car_model):
         """Вызывается в момент добавления сенсора в машину"""
         self._car_model = car_model
+        self._last_innovation = None
+        self._last_innovation_covariance = None
 
     @property
     def state_size(self):
@@ -40,11 +43,26 @@ class KalmanSensorBase(abc.ABC):
         """Диагональная матрица ковариации шума для фильтра Калмана"""
         return np.diag(self._noise_variances)
 
+    @property
+    def last_innovation(self):
+        """Невязка z - C * mu последнего обработанного наблюдения"""
+        return self._last_innovation
+
+    @property
+    def last_innovation_covariance(self):
+        """Ковариация невязки C * S * C^T + Q последнего обработанного наблюдения"""
+        return self._last_innovation_covariance
+
     def process_observation(self, observation):
-        C = self.get_observation_matrix()
-        Q = self.get_noise_covariance()
-        mu = self._car_model.state
-        S = self._car_model.covariance_matrix
-        new_mu, new_S = kalman_process_observation(mu, S, observation, C, Q)
-        self._car_model.state = new_mu
-        self._car_model.covariance_matrix = new_S
+        with stage('KalmanSensorBase.process_observation.matrices'):
+            C = self.get_observation_matrix()
+            Q = self.get_noise_covariance()
+            mu = self._car_model.state
+            S = self._car_model.covariance_matrix
+        with stage('KalmanSensorBase.process_observation.innovation_solve'):
+            # Невязка и ее ковариация сохраняются для подсчета NIS (см. metrics.py)
+            new_mu, new_S, self._last_innovation, self._last_innovation_covariance = kalman_process_observation(
+                mu, S, observation, C, Q, return_innovation=True)
+        with stage('KalmanSensorBase.process_observation.history_append'):
+            self._car_model.state = new_mu
+            self._car_model.covariance_matrix = new_S
@@ -0,0 +1,107 @@
+import numpy as np
+from .precision import ACCUMULATOR_DTYPE
+
+
+# Наибольшее число элементов во временном массиве (позы части x 2 * маяки), 512 КБ в float64:
+# часть помещается в кеш L2
+MAX_CHUNK_ELEMENTS = 1 << 16
+
+
+def log_sum_exp(log_values):
+    """log(sum(exp(log_values))) без переполнения и потери значимости.
+    Для пустого массива или массива из -inf возвращает -inf."""
+    log_values = np.asarray(log_values, dtype=ACCUMULATOR_DTYPE)
+    if log_values.size == 0:
+        return -np.inf
+    max_log_value = np.max(log_values)
+    if not np.isfinite(max_log_value):
+        return max_log_value
+    return max_log_value + np.log(np.sum(np.exp(log_values - max_log_value)))
+
+
+def normalize_log_weights(log_weights, out=None):
+    """Нормированные веса exp(log_w - log_sum_exp(log_w)).
+    :param out: массив для весов или None
+    :returns: (веса, log_sum_exp(log_weights)); второе - логарифм правдоподобия наблюдений (evidence)
+    """
+    log_weights = np.asarray(log_weights, dtype=ACCUMULATOR_DTYPE)
+    log_normalizer = log_sum_exp(log_weights)
+    assert np.isfinite(log_normalizer), 'All weights are zero'
+    weights = np.subtract(log_weights, log_normalizer, out=out)
+    return np.exp(weights, out=weights), log_normalizer
+
+
+def get_landmarks_log_likelihood_fused(
+        x, y, yaw, observations, landmarks_xy, noise_covariance, out=None, accumulate=False,
+        max_chunk_elements=MAX_CHUNK_ELEMENTS):
+    """Логарифм правдоподобия наблюдений маяков (как у LandmarkSensor) для набора поз (x, y, yaw).
+    В отличие от grid_localization.get_landmarks_log_likelihood считается прямо по невязкам между
+    наблюдениями и предсказанными положениями маяков в локальной системе координат каждой позы, поэтому
+    нет сокращения больших слагаемых и точность не зависит ни от удаленности от начала координат
+    (например, в UTM), ни от удаленности поз от маяков.
+
+    Позы обрабатываются частями, для каждой части все маяки считаются одним матричным умножением:
+    выбеленная невязка W (z_l - R^T (l - p)) = W z_l + W R^T p - W R^T l линейна по (cos yaw, sin yaw, 1)
+    и R^T p, после чего квадраты невязок суммируются по строкам.
+    Временные массивы занимают не больше max_chunk_elements чисел независимо от числа поз,
+    массивы (позы x маяки x 2) целиком не создаются.
+    :param x, y, yaw: одномерные массивы поз (N,), допускается float32
+    :param observations: положения маяков в локальной системе координат робота (L, 2)
+    :param landmarks_xy: положения маяков в глобальной системе координат (L, 2)
+    :param noise_covariance: ковариация шума наблюдения (2, 2)
+    :param out: массив (N,) float64 для результата или None
+    :param accumulate: прибавить результат к out (например, к логарифмам весов частиц), а не записать в него
+    :returns: out
+    """
+    x = np.asarray(x).ravel()
+    y = np.asarray(y).ravel()
+    yaw = np.asarray(yaw).ravel()
+    poses_number = x.shape[0]
+    assert y.shape == (poses_number,) and yaw.shape == (poses_number,)
+    observations = np.asarray(observations, dtype=ACCUMULATOR_DTYPE).reshape(-1, 2)
+    landmarks_xy = np.asarray(landmarks_xy, dtype=ACCUMULATOR_DTYPE).reshape(-1, 2)
+    landmarks_number = observations.shape[0]
+    assert landmarks_xy.shape[0] == landmarks_number
+    Q = np.asarray(noise_covariance, dtype=ACCUMULATOR_DTYPE)
+    if out is None:
+        out = np.zeros(poses_number, dtype=ACCUMULATOR_DTYPE)
+        accumulate = False
+    assert out.shape == (poses_number,)
+
+    # W W^T = Q^-1, W = L^-1 для разложения Холецкого Q = L L^T; W нижнетреугольная
+    W = np.linalg.inv(np.linalg.cholesky(Q))
+    _, log_det = np.linalg.slogdet(2 * np.pi * Q)
+    constant = -0.5 * landmarks_number * log_det
+    # Компоненты выбеленных невязок всех маяков линейны по (cos yaw, sin yaw, 1, u0, u1), где (u0, u1) = R^T p,
+    # а R^T l = (c lx + s ly, -s lx + c ly). Коэффициенты (5, 2L): сначала L первых компонент, затем L вторых.
+    lx, ly = landmarks_xy[:, 0], landmarks_xy[:, 1]
+    coefficients = np.empty((5, 2, landmarks_number), dtype=ACCUMULATOR_DTYPE)
+    coefficients[0] = -np.dot(W, np.stack([lx, ly]))
+    coefficients[1] = -np.dot(W, np.stack([ly, -lx]))
+    coefficients[2] = np.dot(W, observations.T)
+    coefficients[3] = W[:, 0, None]
+    coefficients[4] = W[:, 1, None]
+    coefficients = coefficients.reshape(5, 2 * landmarks_number)
+
+    chunk_size = max(1, max_chunk_elements // max(1, 2 * landmarks_number))
+    basis = np.empty((min(chunk_size, poses_number), 5), dtype=ACCUMULATOR_DTYPE)
+    for begin in range(0, poses_number, chunk_size):
+        end = min(begin + chunk_size, poses_number)
+        chunk_basis = basis[:end - begin]
+        cos_yaw, sin_yaw, _, u0, u1 = chunk_basis.T
+        np.cos(yaw[begin:end], out=cos_yaw)
+        np.sin(yaw[begin:end], out=sin_yaw)
+        chunk_basis[:, 2] = 1
+        chunk_x = x[begin:end].astype(ACCUMULATOR_DTYPE, copy=False)
+        chunk_y = y[begin:end].astype(ACCUMULATOR_DTYPE, copy=False)
+        np.add(cos_yaw * chunk_x, sin_yaw * chunk_y, out=u0)
+        np.subtract(cos_yaw * chunk_y, sin_yaw * chunk_x, out=u1)
+        residuals = np.dot(chunk_basis, coefficients)
+        log_likelihood = np.einsum('ij,ij->i', residuals, residuals)
+        log_likelihood *= -0.5
+        log_likelihood += constant
+        if accumulate:
+            out[begin:end] += log_likelihood
+        else:
+            out[begin:end] = log_likelihood
+    return out
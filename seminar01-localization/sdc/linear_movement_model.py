@@ -10,8 +10,17 @@ class LinearMovementModel(MovementModelBase):
 
     def _move(self,  dt):
         assert isinstance(dt, Timestamp)
-        self._car._state = self.move_state(self._car._state, dt)
-        self._car._time = self._car._time + dt
+        car = self._car
+        state = car._state_view
+        dt_sec = dt.to_seconds()
+        # То же, что move_state, но на скалярах из снимка состояния без промежуточных массивов
+        car._set_state_values(
+            state.position_x + state.velocity_x * dt_sec,
+            state.position_y + state.velocity_y * dt_sec,
+            state.yaw + state.omega * dt_sec,
+            state.velocity,
+            state.omega)
+        car._time = car._time + dt
 
     def move_state(self, state, dt):
         assert isinstance(dt, Timestamp)
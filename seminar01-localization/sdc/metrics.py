@@ -0,0 +1,183 @@
+import numpy as np
+from .car import Car
+
+
+def get_state_errors(true_states, estimates, yaw_index=Car.YAW_INDEX):
+    """Ошибки оценки состояния, угол приводится к [-pi, pi).
+    :param true_states: np.ndarray размера (..., n)
+    :param estimates: np.ndarray размера (..., n)
+    """
+    errors = np.asarray(estimates, dtype=np.float64) - np.asarray(true_states, dtype=np.float64)
+    if yaw_index is not None:
+        errors[..., yaw_index] = (errors[..., yaw_index] + np.pi) % (2 * np.pi) - np.pi
+    return errors
+
+
+def get_mahalanobis_squared(vectors, covariances):
+    """Квадраты расстояний Махаланобиса v^T * S^-1 * v для стопки векторов.
+    :param vectors: np.ndarray размера (..., n)
+    :param covariances: np.ndarray размера (..., n, n)
+    :returns: np.ndarray размера (...)
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    solved = np.linalg.solve(covariances, vectors[..., None])[..., 0]
+    return np.einsum('...i,...i->...', vectors, solved)
+
+
+def get_nees(true_states, means, covariances, yaw_index=Car.YAW_INDEX):
+    """Normalized estimation error squared для стопки оценок (..., n) с ковариациями (..., n, n).
+    Для состоятельного фильтра NEES распределен как хи-квадрат с n степенями свободы."""
+    return get_mahalanobis_squared(get_state_errors(true_states, means, yaw_index), covariances)
+
+
+def get_nis(innovations, innovation_covariances):
+    """Normalized innovation squared для стопки невязок (..., m) с ковариациями (..., m, m).
+    Для состоятельного фильтра NIS распределен как хи-квадрат с m степенями свободы."""
+    return get_mahalanobis_squared(innovations, innovation_covariances)
+
+
+def get_rmse(true_states, estimates, indices=(Car.POS_X_INDEX, Car.POS_Y_INDEX), axis=None):
+    """RMSE по компонентам indices (по умолчанию - ошибка положения).
+    :param axis: оси усреднения квадратов ошибок; None - по всем
+    """
+    errors = get_state_errors(true_states, estimates)[..., list(indices)]
+    return np.sqrt(np.mean(np.sum(errors**2, axis=-1), axis=axis))
+
+
+class WelfordAccumulator:
+    """Среднее и дисперсия потока значений за O(1) памяти (алгоритм Уэлфорда).
+    Значения могут быть векторами фиксированной формы; стопки значений добавляются сразу
+    через объединение моментов (Chan et al.)."""
+    def __init__(self, shape=()):
+        self._count = 0
+        self._mean = np.zeros(shape, dtype=np.float64)
+        self._m2 = np.zeros(shape, dtype=np.float64)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return np.array(self._mean)
+
+    @property
+    def variance(self):
+        if self._count == 0:
+            return np.full_like(self._mean, np.nan)
+        return self._m2 / self._count
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+    def update(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        self._count += 1
+        delta = value - self._mean
+        self._mean = self._mean + delta / self._count
+        self._m2 = self._m2 + delta * (value - self._mean)
+
+    def update_batch(self, values):
+        """Добавляет стопку значений (k, *shape)"""
+        values = np.asarray(values, dtype=np.float64)
+        count = values.shape[0]
+        if count == 0:
+            return
+        mean = values.mean(axis=0)
+        m2 = np.sum((values - mean)**2, axis=0)
+        total = self._count + count
+        delta = mean - self._mean
+        self._mean = self._mean + delta * (count / total)
+        self._m2 = self._m2 + m2 + delta**2 * (self._count * count / total)
+        self._count = total
+
+
+class StreamingMetrics:
+    """Потоковый подсчет RMSE, NEES и NIS по ходу фильтрации без хранения траекторий.
+    Пример:
+
+        metrics = StreamingMetrics()
+        for ...:
+            kalman_car.move(dt)
+            sensor.process_observation(observation)
+            metrics.update_innovation(str(sensor), sensor.last_innovation, sensor.last_innovation_covariance)
+            metrics.update_state(car._state, kalman_car.state, kalman_car.covariance_matrix)
+        metrics.summary()
+    """
+    def __init__(self, state_size=5, position_indices=(Car.POS_X_INDEX, Car.POS_Y_INDEX), yaw_index=Car.YAW_INDEX):
+        self._position_indices = list(position_indices)
+        self._yaw_index = yaw_index
+        self._squared_errors = WelfordAccumulator((state_size,))
+        self._position_squared_errors = WelfordAccumulator()
+        self._nees = WelfordAccumulator()
+        self._nis = {}
+
+    def update_state(self, true_state, estimate, covariance=None):
+        """Добавляет оценку состояния (n,) или стопку оценок (k, n) с ковариациями (n, n) / (k, n, n).
+        :returns: (квадрат ошибки положения, NEES или None) для добавленных оценок
+        """
+        errors = get_state_errors(true_state, estimate, self._yaw_index)
+        position_squared_errors = np.sum(errors[..., self._position_indices]**2, axis=-1)
+        nees = None
+        if covariance is not None:
+            nees = get_mahalanobis_squared(errors, covariance)
+        if errors.ndim == 1:
+            self._squared_errors.update(errors**2)
+            self._position_squared_errors.update(position_squared_errors)
+            if nees is not None:
+                self._nees.update(nees)
+        else:
+            self._squared_errors.update_batch(errors**2)
+            self._position_squared_errors.update_batch(position_squared_errors)
+            if nees is not None:
+                self._nees.update_batch(nees)
+        return position_squared_errors, nees
+
+    def update_innovation(self, name, innovation, innovation_covariance):
+        """Добавляет невязку наблюдения (m,) или стопку невязок (k, m) для сенсора name.
+        :returns: NIS
+        """
+        nis = get_nis(innovation, innovation_covariance)
+        accumulator = self._nis.setdefault(name, WelfordAccumulator())
+        if np.ndim(nis) == 0:
+            accumulator.update(nis)
+        else:
+            accumulator.update_batch(nis)
+        return nis
+
+    @property
+    def steps_number(self):
+        return self._position_squared_errors.count
+
+    @property
+    def position_rmse(self):
+        return float(np.sqrt(self._position_squared_errors.mean))
+
+    @property
+    def state_rmse(self):
+        """RMSE по каждой компоненте состояния, (n,)"""
+        return np.sqrt(self._squared_errors.mean)
+
+    @property
+    def nees(self):
+        """Накопитель NEES (среднее, дисперсия)"""
+        return self._nees
+
+    @property
+    def nis(self):
+        """dict {имя сенсора: накопитель NIS}"""
+        return dict(self._nis)
+
+    def summary(self):
+        summary = {
+            'steps_number': self.steps_number,
+            'position_rmse': self.position_rmse,
+            'state_rmse': self.state_rmse.tolist(),
+            'nees_mean': float(self._nees.mean),
+            'nees_std': float(self._nees.std),
+        }
+        for name, accumulator in self._nis.items():
+            summary[f'nis_{name}_mean'] = float(accumulator.mean)
+            summary[f'nis_{name}_std'] = float(accumulator.std)
+        return summary
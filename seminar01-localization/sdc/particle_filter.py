@@ -0,0 +1,459 @@
+import time
+import numpy as np
+from .car import Car
+from .timestamp import Timestamp
+from .kalman_movement_model import move_state
+from .precision import get_state_dtype, to_accumulator
+from .grid_localization import get_landmarks_log_likelihood
+from .likelihood import get_landmarks_log_likelihood_fused, normalize_log_weights
+
+
+# Способы подсчета правдоподобия наблюдений маяков:
+#   fused - по невязкам в локальной системе координат частями ограниченного размера, O(N * L), точный
+#     при любых координатах (по умолчанию);
+#   moments - через моменты наблюдений и маяков, O(N) независимо от числа маяков; координаты отсчитываются
+#     от центра маяков, но при удаленности поз от маяков на километры сокращение слагаемых порядка
+#     квадрата этого расстояния все равно теряет точность.
+LIKELIHOOD_METHODS = ('fused', 'moments')
+
+
+def get_uniform_particles(particles_number, region_side, velocity_range, omega_range=(0., 0.), random_state=None):
+    """Частицы, равномерно распределенные в квадратной области [-region_side / 2, region_side / 2]^2
+    с произвольным yaw и скоростями из заданных диапазонов. Состояние в раскладке Car: (x, y, yaw, v, omega).
+    :returns: np.ndarray размера (N, 5)
+    """
+    gen = np.random.RandomState(random_state)
+    particles = np.empty((particles_number, 5), dtype=np.float64)
+    particles[:, Car.POS_X_INDEX] = gen.uniform(-region_side / 2., region_side / 2., size=particles_number)
+    particles[:, Car.POS_Y_INDEX] = gen.uniform(-region_side / 2., region_side / 2., size=particles_number)
+    particles[:, Car.YAW_INDEX] = gen.uniform(0, 2 * np.pi, size=particles_number)
+    particles[:, Car.VEL_INDEX] = gen.uniform(*velocity_range, size=particles_number)
+    particles[:, Car.OMEGA_INDEX] = gen.uniform(*omega_range, size=particles_number)
+    return particles
+
+
+class _ParticlesShard:
+    """Часть частиц [begin, end), над которой выполняются все поэлементные операции фильтра.
+    Массивы общие для всех частей: в многопроцессном режиме они лежат в shared memory,
+    и каждая часть работает со своим срезом без копирования."""
+    def __init__(self, arrays, begin, end, noise_covariance_density, seed, likelihood='fused'):
+        self._arrays = arrays
+        self._begin = begin
+        self._end = end
+        self._noise_covariance_density = noise_covariance_density
+        self._likelihood = likelihood
+        # Независимый поток случайных чисел для каждой части
+        self._gen = np.random.default_rng(seed)
+
+    def set_bounds(self, begin, end):
+        self._begin = begin
+        self._end = end
+
+    def move(self, dt_sec, active):
+        particles = self._arrays['particles'][active, self._begin:self._end]
+        particles[:] = move_state(particles, dt_sec)
+        R = self._noise_covariance_density * dt_sec
+        eigenvalues, eigenvectors = np.linalg.eigh(R)
+        root = (eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))[None, :]).astype(particles.dtype)
+        particles += np.dot(self._gen.standard_normal(size=particles.shape, dtype=particles.dtype), root.T)
+
+    def weight(self, observations, landmarks_xy, noise_covariance, active):
+        """Добавляет логарифм правдоподобия к логарифмам весов, возвращает локальный максимум
+        (-inf для пустой части: частиц может быть меньше, чем процессов).
+        Позы частиц float32 переводятся в float64, см. precision.py"""
+        particles = self._arrays['particles'][active, self._begin:self._end]
+        log_weights = self._arrays['log_weights'][self._begin:self._end]
+        if self._likelihood == 'fused':
+            # Ядро само переводит части поз в float64 и прибавляет правдоподобие к логарифмам весов на месте
+            get_landmarks_log_likelihood_fused(
+                particles[:, Car.POS_X_INDEX], particles[:, Car.POS_Y_INDEX], particles[:, Car.YAW_INDEX],
+                observations, landmarks_xy, noise_covariance, out=log_weights, accumulate=True)
+            return np.max(log_weights, initial=-np.inf)
+        log_weights += get_landmarks_log_likelihood(
+            to_accumulator(particles[:, Car.POS_X_INDEX]), to_accumulator(particles[:, Car.POS_Y_INDEX]),
+            to_accumulator(particles[:, Car.YAW_INDEX]), observations, landmarks_xy, noise_covariance)
+        return np.max(log_weights, initial=-np.inf)
+
+    def normalize(self, max_log_weight):
+        """Ненормированные веса exp(log_w - max) и их локальные кумулятивные суммы.
+        Возвращает сумму весов и сумму их квадратов."""
+        weights = self._arrays['weights'][self._begin:self._end]
+        np.exp(self._arrays['log_weights'][self._begin:self._end] - max_log_weight, out=weights)
+        np.cumsum(weights, out=self._arrays['cumulative'][self._begin:self._end])
+        return np.sum(weights), np.dot(weights, weights)
+
+    def add_offset(self, offset):
+        """Превращает локальные кумулятивные суммы в глобальные"""
+        self._arrays['cumulative'][self._begin:self._end] += offset
+
+    def gather(self, uniform, total, particles_number, active):
+        """Систематический ресемплинг для выходных позиций [begin, end): частицы копируются
+        из активного буфера в неактивный, логарифмы весов обнуляются."""
+        positions = (uniform + np.arange(self._begin, self._end)) * (total / particles_number)
+        indices = np.searchsorted(self._arrays['cumulative'][:particles_number], positions)
+        np.minimum(indices, particles_number - 1, out=indices)
+        self._arrays['particles'][1 - active, self._begin:self._end] = self._arrays['particles'][active, indices]
+        self._arrays['log_weights'][self._begin:self._end] = 0
+
+    def gather_indices(self, active):
+        """Ресемплинг по заранее выбранным индексам из массива indices"""
+        indices = self._arrays['indices'][self._begin:self._end]
+        self._arrays['particles'][1 - active, self._begin:self._end] = self._arrays['particles'][active, indices]
+        self._arrays['log_weights'][self._begin:self._end] = 0
+
+
+def _shard_worker(connection, shared_names, specs, begin, end, noise_covariance_density, seed, likelihood):
+    """Цикл рабочего процесса: подключается к shared memory и выполняет команды над своей частью частиц.
+    На каждую команду отвечает парой (None, результат) или (текст исключения, None)"""
+    import traceback
+    from multiprocessing import shared_memory
+    memories = {name: shared_memory.SharedMemory(name=shared_name) for name, shared_name in shared_names.items()}
+    arrays = {
+        name: np.ndarray(specs[name][0], dtype=specs[name][1], buffer=memory.buf)
+        for name, memory in memories.items()}
+    shard = _ParticlesShard(arrays, begin, end, noise_covariance_density, seed, likelihood)
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            command, args = message
+            try:
+                result = getattr(shard, command)(*args)
+            except Exception:
+                connection.send((traceback.format_exc(), None))
+            else:
+                connection.send((None, result))
+    finally:
+        del shard, arrays
+        for memory in memories.values():
+            memory.close()
+        connection.close()
+
+
+class ParticleFilter:
+    """Векторизованный фильтр частиц для локализации по наблюдениям маяков (как у LandmarkSensor).
+    Частицы хранятся в раскладке Car: массив (N, 5) со столбцами (x, y, yaw, v, omega).
+
+    При workers_number > 1 частицы делятся на равные части между процессами. Состояния частиц и веса
+    лежат в multiprocessing.shared_memory, поэтому на каждом шаге процессам пересылаются только команды
+    и наблюдения. Правдоподобия считаются локально в каждом процессе, а нормировка весов, кумулятивные
+    суммы и систематический ресемплинг - глобальные: они собираются из локальных результатов
+    в фиксированном порядке, единственное равномерное случайное число берется из генератора фильтра.
+    Результат детерминирован при фиксированных random_state и workers_number.
+    Фильтр нужно закрывать (close() или with), чтобы остановить процессы и освободить shared memory.
+
+    При dtype=np.float32 частицы хранятся и продвигаются моделью движения в float32, что вдвое сокращает
+    объем памяти и трафик на шаге; правдоподобия, веса и их нормировка остаются в float64 (см. precision.py).
+    """
+    def __init__(
+            self,
+            particles,
+            noise_covariance_density=None,
+            resample_threshold=0.5,
+            random_state=None,
+            workers_number=1,
+            capacity=None,
+            dtype=None,
+            likelihood='fused'):
+        """
+        :param particles: начальные частицы (N, n)
+        :param noise_covariance_density: плотность ковариации шума модели движения (n, n)
+        :param resample_threshold: ресемплинг выполняется, когда эффективное число частиц
+            меньше resample_threshold * N
+        :param random_state: seed; потоки случайных чисел частей порождаются из него через SeedSequence
+        :param workers_number: число процессов; 1 - все вычисления в текущем процессе
+        :param capacity: под сколько частиц выделяется память (не меньше N). Запас позволяет менять
+            число частиц без переаллокации.
+        :param dtype: тип хранения частиц, np.float64 (по умолчанию) или np.float32
+        :param likelihood: способ подсчета правдоподобия маяков из LIKELIHOOD_METHODS
+        """
+        particles = np.asarray(particles, dtype=np.float64)
+        particles_number, state_size = particles.shape
+        if capacity is None:
+            capacity = particles_number
+        assert capacity >= particles_number
+        if noise_covariance_density is None:
+            noise_covariance_density = np.zeros((state_size, state_size), dtype=np.float64)
+        noise_covariance_density = np.array(noise_covariance_density, dtype=np.float64)
+        assert noise_covariance_density.shape == (state_size, state_size)
+        assert workers_number >= 1
+        assert likelihood in LIKELIHOOD_METHODS, f'Unknown likelihood method {likelihood}'
+        self._resample_threshold = resample_threshold
+        seed_sequence = np.random.SeedSequence(random_state)
+        shards_seeds = seed_sequence.spawn(workers_number + 1)
+        self._gen = np.random.default_rng(shards_seeds[-1])
+
+        specs = {
+            'particles': ((2, capacity, state_size), get_state_dtype(dtype).name),
+            'log_weights': ((capacity,), 'float64'),
+            'weights': ((capacity,), 'float64'),
+            'cumulative': ((capacity,), 'float64'),
+            'indices': ((capacity,), 'int64'),
+        }
+        if workers_number > 1:
+            # multiprocessing нужен только в многопроцессном режиме и заметно замедляет импорт модуля
+            import multiprocessing
+            from multiprocessing import shared_memory
+        self._memories = {}
+        self._arrays = {}
+        for name, (shape, dtype) in specs.items():
+            if workers_number > 1:
+                size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+                memory = shared_memory.SharedMemory(create=True, size=size)
+                self._memories[name] = memory
+                self._arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+            else:
+                self._arrays[name] = np.empty(shape, dtype=dtype)
+        # Индекс буфера частиц, в котором лежит текущее состояние
+        self._active = 0
+        self._particles_number = particles_number
+        self._arrays['particles'][self._active, :particles_number] = particles
+        self._arrays['log_weights'][:] = 0
+        self._metrics = {'particles_number': [], 'move_time': [], 'update_time': []}
+
+        self._workers_number = workers_number
+        bounds = self._get_bounds(particles_number)
+        self._shards = []
+        self._connections = []
+        self._processes = []
+        if workers_number == 1:
+            self._shards.append(_ParticlesShard(
+                self._arrays, 0, particles_number, noise_covariance_density, shards_seeds[0], likelihood))
+        else:
+            shared_names = {name: memory.name for name, memory in self._memories.items()}
+            for i in range(workers_number):
+                connection, child_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(
+                    target=_shard_worker,
+                    args=(child_connection, shared_names, specs, int(bounds[i]), int(bounds[i + 1]),
+                          noise_covariance_density, shards_seeds[i], likelihood),
+                    daemon=True)
+                process.start()
+                child_connection.close()
+                self._connections.append(connection)
+                self._processes.append(process)
+
+    def _get_bounds(self, particles_number):
+        return np.linspace(0, particles_number, self._workers_number + 1).astype(np.int64)
+
+    def _set_particles_number(self, particles_number):
+        """Меняет текущее число частиц в пределах capacity и заново делит их между частями"""
+        assert 0 < particles_number <= self.capacity
+        self._particles_number = particles_number
+        bounds = self._get_bounds(particles_number)
+        self._run('set_bounds', per_shard_args=[
+            (int(bounds[i]), int(bounds[i + 1])) for i in range(self._workers_number)])
+
+    def _run(self, command, *args, per_shard_args=None):
+        """Выполняет команду на всех частях и возвращает результаты в порядке частей"""
+        if self._connections:
+            for i, connection in enumerate(self._connections):
+                shard_args = args if per_shard_args is None else per_shard_args[i]
+                connection.send((command, shard_args))
+            # Ответы читаются из всех каналов, даже если какая-то часть упала, чтобы каналы не рассинхронизировались
+            replies = [connection.recv() for connection in self._connections]
+            for error, _ in replies:
+                if error is not None:
+                    raise RuntimeError(f'Particle filter worker failed on {command}:\n{error}')
+            return [result for _, result in replies]
+        shard_args = args if per_shard_args is None else per_shard_args[0]
+        return [getattr(self._shards[0], command)(*shard_args)]
+
+    def close(self):
+        """Останавливает процессы и освобождает shared memory; процессы могут быть уже завершены"""
+        try:
+            for connection in self._connections:
+                try:
+                    connection.send(None)
+                except OSError:
+                    # Процесс уже завершился и закрыл свой конец канала
+                    pass
+            for process in self._processes:
+                process.join()
+        finally:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._processes = []
+            self._arrays = {name: np.array(array) for name, array in self._arrays.items()}
+            for memory in self._memories.values():
+                memory.close()
+                memory.unlink()
+            self._memories = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def particles_number(self):
+        return self._particles_number
+
+    @property
+    def capacity(self):
+        return self._arrays['log_weights'].shape[0]
+
+    @property
+    def particles(self):
+        return np.array(self._arrays['particles'][self._active, :self._particles_number])
+
+    @property
+    def weights(self):
+        weights, _ = normalize_log_weights(self._arrays['log_weights'][:self._particles_number])
+        return weights
+
+    @property
+    def metrics(self):
+        """Метрики по шагам: число частиц после обработки наблюдений и время move/обработки наблюдений"""
+        return {name: np.array(values) for name, values in self._metrics.items()}
+
+    @property
+    def state(self):
+        """Взвешенное среднее состояние (угол усредняется как направление)"""
+        weights = self.weights
+        particles = self._arrays['particles'][self._active, :self._particles_number]
+        state = np.dot(weights, particles)
+        yaws = particles[:, Car.YAW_INDEX]
+        state[Car.YAW_INDEX] = np.arctan2(np.dot(weights, np.sin(yaws)), np.dot(weights, np.cos(yaws)))
+        return state
+
+    def move(self, dt):
+        assert isinstance(dt, Timestamp)
+        start = time.perf_counter()
+        self._run('move', dt.to_seconds(), self._active)
+        self._metrics['move_time'].append(time.perf_counter() - start)
+
+    def process_landmarks_observations(self, observations, landmarks_xy, noise_covariance):
+        """Взвешивание частиц по наблюдениям маяков и, при необходимости, ресемплинг.
+        :param observations: положения маяков в локальной системе координат робота (L, 2)
+        :param landmarks_xy: положения маяков в глобальной системе координат (L, 2)
+        :param noise_covariance: ковариация шума наблюдения (2, 2)
+        :returns: True, если был выполнен ресемплинг
+        """
+        start = time.perf_counter()
+        total, effective_particles_number = self._weight(observations, landmarks_xy, noise_covariance)
+        resampled = effective_particles_number < self._resample_threshold * self.particles_number
+        if resampled:
+            self._run('gather', self._gen.uniform(), total, self._particles_number, self._active)
+            self._active = 1 - self._active
+        self._metrics['particles_number'].append(self._particles_number)
+        self._metrics['update_time'].append(time.perf_counter() - start)
+        return resampled
+
+    def _weight(self, observations, landmarks_xy, noise_covariance):
+        """Взвешивание частиц и глобальные кумулятивные суммы весов.
+        :returns: (сумма ненормированных весов, эффективное число частиц)
+        """
+        observations = np.asarray(observations, dtype=np.float64)
+        landmarks_xy = np.asarray(landmarks_xy, dtype=np.float64)
+        noise_covariance = np.asarray(noise_covariance, dtype=np.float64)
+        max_log_weight = max(self._run('weight', observations, landmarks_xy, noise_covariance, self._active))
+
+        sums = self._run('normalize', max_log_weight)
+        totals = np.array([total for total, _ in sums])
+        total = np.sum(totals)
+        squares_total = np.sum([squares for _, squares in sums])
+        offsets = np.concatenate([[0.], np.cumsum(totals)[:-1]])
+        self._run('add_offset', per_shard_args=[(offset,) for offset in offsets])
+        return total, total**2 / squares_total
+
+
+class KldParticleFilter(ParticleFilter):
+    """Фильтр частиц с адаптивным числом частиц (KLD-sampling, Fox 2003).
+    На каждом шаге частицы ресемплируются до тех пор, пока их число не станет достаточным, чтобы
+    с вероятностью kld_quantile расстояние Кульбака-Лейблера между выборочным и истинным распределением
+    было меньше kld_error. Требуемое число растет с числом занятых ячеек в пространстве (x, y, yaw):
+    при глобальной локализации частиц много, после сходимости - мало.
+    Массивы частиц выделяются один раз под capacity частиц, поэтому рост и уменьшение их числа
+    не требуют переаллокации (и пересоздания shared memory). Число частиц и занятых ячеек по шагам
+    доступно в metrics.
+    """
+    def __init__(
+            self,
+            particles,
+            capacity,
+            bin_size=(1., 1., np.deg2rad(10.)),
+            kld_error=0.05,
+            kld_quantile=0.99,
+            min_particles_number=100,
+            *args,
+            **kwargs):
+        """
+        :param particles: начальные частицы (N, n), N <= capacity
+        :param capacity: максимальное число частиц
+        :param bin_size: размеры ячеек по x, y и yaw
+        :param kld_error: допустимое расстояние Кульбака-Лейблера
+        :param kld_quantile: вероятность 1 - delta, с которой должна выполняться оценка
+        :param min_particles_number: минимальное число частиц
+        """
+        super(KldParticleFilter, self).__init__(particles, *args, capacity=capacity, **kwargs)
+        self._bin_size = np.array(bin_size, dtype=np.float64)
+        assert self._bin_size.shape == (3,)
+        self._kld_error = kld_error
+        import statistics
+        self._kld_z = statistics.NormalDist().inv_cdf(kld_quantile)
+        self._min_particles_number = min(min_particles_number, capacity)
+        self._metrics['occupied_bins'] = []
+
+    def get_required_particles_number(self, bins_number):
+        """Число частиц, достаточное для bins_number занятых ячеек (аппроксимация Вильсона-Хилферти)"""
+        bins_number = np.asarray(bins_number, dtype=np.float64)
+        k = np.maximum(bins_number - 1, 1)
+        a = 2. / (9. * k)
+        required = k / (2. * self._kld_error) * (1. - a + np.sqrt(a) * self._kld_z)**3
+        required = np.where(bins_number > 1, required, 0)
+        return np.maximum(np.ceil(required), self._min_particles_number)
+
+    def _get_bins(self, particles):
+        bins = np.floor(np.stack([
+            particles[:, Car.POS_X_INDEX] / self._bin_size[0],
+            particles[:, Car.POS_Y_INDEX] / self._bin_size[1],
+            (particles[:, Car.YAW_INDEX] % (2 * np.pi)) / self._bin_size[2]], axis=1)).astype(np.int64)
+        # Упаковка трех индексов по 21 биту в одно число
+        bins += 1 << 20
+        return (bins[:, 0] << 42) | (bins[:, 1] << 21) | bins[:, 2]
+
+    def _sample_indices(self, total):
+        """Выбирает индексы частиц пачками растущего размера, пока их число не станет достаточным
+        для числа занятых ячеек"""
+        cumulative = self._arrays['cumulative'][:self._particles_number]
+        particles = self._arrays['particles'][self._active]
+        capacity = self.capacity
+        indices = np.zeros(0, dtype=np.int64)
+        bins = np.zeros(0, dtype=np.int64)
+        batch = self._min_particles_number
+        while True:
+            new_indices = np.searchsorted(cumulative, self._gen.uniform(0, total, size=batch))
+            np.minimum(new_indices, self._particles_number - 1, out=new_indices)
+            indices = np.concatenate([indices, new_indices])
+            bins = np.concatenate([bins, self._get_bins(particles[new_indices])])
+            # Число занятых ячеек среди первых n частиц для каждого n
+            _, first_occurrences = np.unique(bins, return_index=True)
+            is_new_bin = np.zeros(bins.shape[0], dtype=np.int64)
+            is_new_bin[first_occurrences] = 1
+            occupied_bins = np.cumsum(is_new_bin)
+            required = self.get_required_particles_number(occupied_bins)
+            enough = np.flatnonzero(np.arange(1, bins.shape[0] + 1) >= required)
+            if enough.size:
+                number = int(enough[0]) + 1
+                return indices[:number], int(occupied_bins[number - 1])
+            if indices.shape[0] >= capacity:
+                return indices[:capacity], int(occupied_bins[capacity - 1])
+            batch = min(indices.shape[0], capacity - indices.shape[0])
+
+    def process_landmarks_observations(self, observations, landmarks_xy, noise_covariance):
+        """Взвешивание частиц и KLD-ресемплинг с выбором нового числа частиц"""
+        start = time.perf_counter()
+        total, _ = self._weight(observations, landmarks_xy, noise_covariance)
+        indices, occupied_bins = self._sample_indices(total)
+        self._arrays['indices'][:indices.shape[0]] = indices
+        self._set_particles_number(indices.shape[0])
+        self._run('gather_indices', self._active)
+        self._active = 1 - self._active
+        self._metrics['particles_number'].append(self._particles_number)
+        self._metrics['occupied_bins'].append(occupied_bins)
+        self._metrics['update_time'].append(time.perf_counter() - start)
+        return True
@@ -0,0 +1,38 @@
+import numpy as np
+
+
+# Политика точности вычислений.
+# Частицы ParticleFilter могут храниться и продвигаться моделью движения в float32: при сотнях тысяч частиц
+# шаг фильтра упирается в пропускную способность памяти, а не в арифметику.
+# Для filter_arrays float32 - только формат хранения результата: рекурсия фильтра Калмана выполняется в float64,
+# округляются лишь сохраняемые средние и ковариации. У ImmFilter и tuning.sweep режима float32 нет: их состояния
+# малы, и выигрыша по памяти он не дает.
+# Величины, чувствительные к округлению, всегда вычисляются и хранятся в ACCUMULATOR_DTYPE:
+#   - ковариации в рекурсии фильтра Калмана (вычитание K C S теряет точность при малых дисперсиях);
+#   - логарифмы правдоподобий и весов частиц: правдоподобие маяков раскрыто через моменты, слагаемые которого
+#     растут как квадрат координат и почти сокращаются;
+#   - нормировка весов и их кумулятивные суммы для ресемплинга.
+# Состояния float32 читаются из памяти как есть и переводятся в float64 только на время этих вычислений.
+STATE_DTYPES = (np.dtype(np.float64), np.dtype(np.float32))
+ACCUMULATOR_DTYPE = np.dtype(np.float64)
+
+# Допустимые отклонения вычислений в float32 от float64, проверяются в self_check.check_precision:
+#   particle_state - компоненты взвешенного среднего фильтра частиц при одинаковых случайных числах.
+FLOAT32_TOLERANCES = {
+    'particle_state': 1e-4,
+}
+
+
+def get_state_dtype(dtype=None):
+    """Тип хранения состояний.
+    :param dtype: None (float64), np.float32, np.float64 или их имена
+    :returns: np.dtype из STATE_DTYPES
+    """
+    dtype = ACCUMULATOR_DTYPE if dtype is None else np.dtype(dtype)
+    assert dtype in STATE_DTYPES, f'Unsupported state dtype {dtype}, expected one of {STATE_DTYPES}'
+    return dtype
+
+
+def to_accumulator(array):
+    """Массив в ACCUMULATOR_DTYPE; массивы float64 возвращаются без копирования"""
+    return np.asarray(array, dtype=ACCUMULATOR_DTYPE)
@@ -0,0 +1,430 @@
+import os
+import sys
+import glob
+import time
+import queue
+import argparse
+import itertools
+import traceback
+import numpy as np
+from .timestamp import Timestamp
+from .kalman_car import KalmanCar
+from .kalman_movement_model import KalmanMovementModel
+from .kalman_gps_sensor import KalmanGpsSensor
+from .kalman_can_sensor import KalmanCanSensor
+from .kalman_imu_sensor import KalmanImuSensor
+from .scenario_cache import save_arrays, load_arrays
+
+
+# Сенсоры журнала: номер сенсора в журнале равен номеру в этом списке
+LOG_SENSORS = ('gps', 'can', 'imu')
+LOG_SENSORS_CODES = {name: code for code, name in enumerate(LOG_SENSORS)}
+# Калмановские сенсоры и размеры их наблюдений
+KALMAN_SENSORS = {
+    'gps': (KalmanGpsSensor, 2),
+    'can': (KalmanCanSensor, 1),
+    'imu': (KalmanImuSensor, 1),
+}
+# Наибольший размер наблюдения; недостающие компоненты в журнале равны NaN
+LOG_VALUES_SIZE = 2
+CSV_HEADER = 'drive,time,sensor,value_0,value_1'
+ESTIMATES_PART_PATTERN = 'estimates-*.sdc'
+
+
+######################################################################
+#  Журналы наблюдений                                               #
+######################################################################
+# Журнал - последовательность наблюдений (drive, time, sensor, values), упорядоченная по времени внутри
+# каждой поездки. Поездка (drive) - целочисленный идентификатор автомобиля или отдельной поездки.
+# Поддерживаются два формата:
+#   - CSV со столбцами drive,time,sensor,value_0,value_1 (sensor - имя из LOG_SENSORS);
+#   - бинарный: файл save_arrays со столбцами drive (N,) int64, time (N,) float64, sensor (N,) int8
+#     и values (N, LOG_VALUES_SIZE) float64. Он отображается в память и читается по частям без разбора текста.
+def get_log_columns(observations):
+    """Столбцы журнала из последовательности fleet_service.Observation с целочисленными vehicle_id"""
+    observations = list(observations)
+    values = np.full((len(observations), LOG_VALUES_SIZE), np.nan, dtype=np.float64)
+    for row, observation in enumerate(observations):
+        values[row, :len(observation.values)] = observation.values
+    return {
+        'drive': np.array([observation.vehicle_id for observation in observations], dtype=np.int64),
+        'time': np.array([observation.time for observation in observations], dtype=np.float64),
+        'sensor': np.array([LOG_SENSORS_CODES[observation.sensor] for observation in observations], dtype=np.int8),
+        'values': values,
+    }
+
+
+def write_log(path, columns):
+    """Записывает журнал в формате, определяемом расширением: .csv - текстовый, иначе бинарный.
+    :param columns: dict столбцов, см. get_log_columns
+    """
+    if not path.endswith('.csv'):
+        save_arrays(path, columns)
+        return
+    with open(path, 'w') as output:
+        output.write(CSV_HEADER + '\n')
+        for drive, t, sensor, values in zip(
+                columns['drive'].tolist(), columns['time'].tolist(),
+                columns['sensor'].tolist(), columns['values'].tolist()):
+            output.write('{},{!r},{},{}\n'.format(
+                drive, t, LOG_SENSORS[sensor], ','.join('' if np.isnan(v) else repr(v) for v in values)))
+
+
+def _read_csv_chunks(path, chunk_size):
+    with open(path) as input_file:
+        header = input_file.readline().strip()
+        assert header == CSV_HEADER, f'{path}: unexpected header {header!r}'
+        while True:
+            lines = list(itertools.islice(input_file, chunk_size))
+            if not lines:
+                return
+            drives = []
+            times = []
+            sensors = []
+            values = np.full((len(lines), LOG_VALUES_SIZE), np.nan, dtype=np.float64)
+            for row, line in enumerate(lines):
+                drive, t, sensor, *row_values = line.rstrip('\n').split(',')
+                drives.append(int(drive))
+                times.append(float(t))
+                sensors.append(LOG_SENSORS_CODES[sensor])
+                for column, value in enumerate(row_values):
+                    if value:
+                        values[row, column] = float(value)
+            yield {
+                'drive': np.array(drives, dtype=np.int64),
+                'time': np.array(times, dtype=np.float64),
+                'sensor': np.array(sensors, dtype=np.int8),
+                'values': values,
+            }
+
+
+def _read_binary_chunks(path, chunk_size):
+    columns = load_arrays(path, mmap=True)
+    rows_number = columns['time'].shape[0]
+    for start in range(0, rows_number, chunk_size):
+        # Копируются только строки текущей части, остальной файл не читается
+        yield {name: np.array(column[start:start + chunk_size]) for name, column in columns.items()}
+
+
+def read_log_chunks(path, chunk_size=65536):
+    """Читает журнал частями не более чем по chunk_size строк, не загружая его в память целиком.
+    Формат определяется по расширению: .csv - текстовый, иначе бинарный.
+    :returns: генератор dict столбцов drive, time, sensor, values
+    """
+    if path.endswith('.csv'):
+        return _read_csv_chunks(path, chunk_size)
+    return _read_binary_chunks(path, chunk_size)
+
+
+######################################################################
+#  Воспроизведение журнала                                          #
+######################################################################
+def make_replay_car(filter_config=None):
+    """KalmanCar с калмановскими сенсорами для воспроизведения одной поездки.
+    :param filter_config: dict с необязательными полями sensors_noise_stds (dict {имя сенсора: std шума}),
+        noise_covariance_density (n, n) и initial_covariance (n, n); умолчания как у fleet_service.FleetFilter
+    :returns: (KalmanCar, список сенсоров в порядке LOG_SENSORS; None для отсутствующих)
+    """
+    filter_config = filter_config or {}
+    sensors_noise_stds = filter_config.get('sensors_noise_stds', {'gps': 1., 'can': 0.2, 'imu': 0.2})
+    noise_covariance_density = filter_config.get('noise_covariance_density', np.diag([0.1, 0.1, 0.1, 1., 1.]))
+    initial_covariance = np.array(filter_config.get('initial_covariance', 100 * np.eye(5)), dtype=np.float64)
+    car = KalmanCar(
+        initial_covariance,
+        initial_position=[0., 0.],
+        movement_model=KalmanMovementModel(noise_covariance_density))
+    sensors = [None] * len(LOG_SENSORS)
+    for name, noise_std in sensors_noise_stds.items():
+        sensor_class, observation_size = KALMAN_SENSORS[name]
+        sensor = sensor_class(noise_variances=[noise_std**2] * observation_size)
+        car.add_sensor(sensor)
+        sensors[LOG_SENSORS_CODES[name]] = sensor
+    return car, sensors
+
+
+class LogReplayer:
+    """Прогоняет наблюдения журнала через KalmanCar: для каждой поездки свой автомобиль, предсказание до момента
+    наблюдения и коррекция соответствующим сенсором. Оценки после каждого наблюдения копятся по столбцам
+    и сбрасываются в файлы save_arrays по part_size строк, поэтому память не растет с длиной журнала.
+    Наблюдения поездки, идущие раньше уже обработанных, отбрасываются.
+    """
+    def __init__(self, output_directory=None, filter_config=None, part_prefix='estimates-000',
+                 part_size=65536, store_covariance=False):
+        """
+        :param output_directory: каталог для файлов с оценками или None, чтобы не сохранять оценки
+        :param part_prefix: начало имен файлов, у разных процессов должно различаться
+        :param store_covariance: сохранять полную ковариацию (N, n, n), а не только дисперсии (N, n)
+        """
+        self._output_directory = output_directory
+        self._filter_config = filter_config
+        self._part_prefix = part_prefix
+        self._part_size = part_size
+        self._store_covariance = store_covariance
+        self._drives = {}
+        self._parts_number = 0
+        self._buffer = self._make_buffer()
+        self._observations_number = 0
+        self._dropped_number = 0
+        self._busy_time = 0.
+
+    @staticmethod
+    def _make_buffer():
+        return {'drive': [], 'time': [], 'sensor': [], 'mean': [], 'covariance': []}
+
+    @property
+    def stats(self):
+        return {
+            'observations_number': self._observations_number,
+            'dropped_number': self._dropped_number,
+            'drives_number': len(self._drives),
+            # Суммарная длительность воспроизведенных поездок в секундах
+            'log_duration': sum(last - first for _, _, first, last in self._drives.values()) / 1e9,
+            'busy_time': self._busy_time,
+            'parts_number': self._parts_number,
+        }
+
+    def process_chunk(self, chunk):
+        """Обрабатывает часть журнала (dict столбцов, см. read_log_chunks)"""
+        start_time = time.perf_counter()
+        buffer = self._buffer
+        drives = self._drives
+        for drive, t, sensor_code, values in zip(
+                chunk['drive'].tolist(), chunk['time'].tolist(), chunk['sensor'].tolist(), chunk['values']):
+            t_ns = int(round(t * Timestamp.NANO_SEC_COEFF))
+            drive_state = drives.get(drive)
+            if drive_state is None:
+                car, sensors = make_replay_car(self._filter_config)
+                car.time = Timestamp.nanoseconds(t_ns)
+                drive_state = drives[drive] = [car, sensors, t_ns, t_ns]
+            car, sensors, _, last_ns = drive_state
+            sensor = sensors[sensor_code]
+            if t_ns < last_ns or sensor is None:
+                self._dropped_number += 1
+                continue
+            if t_ns > last_ns:
+                dt = Timestamp.nanoseconds(t_ns - last_ns)
+                car.move(dt)
+                car.time = car.time + dt
+                drive_state[3] = t_ns
+            sensor.process_observation(values[:sensor.observation_size])
+            # История состояний KalmanCar при воспроизведении не нужна и растет с каждым шагом
+            car.clear_history()
+            self._observations_number += 1
+            if self._output_directory is not None:
+                buffer['drive'].append(drive)
+                buffer['time'].append(t)
+                buffer['sensor'].append(sensor_code)
+                buffer['mean'].append(car.state)
+                buffer['covariance'].append(car.covariance_matrix)
+                if len(buffer['time']) >= self._part_size:
+                    self._flush()
+        self._busy_time += time.perf_counter() - start_time
+
+    def _flush(self):
+        buffer = self._buffer
+        if not buffer['time']:
+            return
+        covariances = np.array(buffer['covariance'], dtype=np.float64)
+        columns = {
+            'drive': np.array(buffer['drive'], dtype=np.int64),
+            'time': np.array(buffer['time'], dtype=np.float64),
+            'sensor': np.array(buffer['sensor'], dtype=np.int8),
+            'mean': np.array(buffer['mean'], dtype=np.float64),
+            'variance': np.diagonal(covariances, axis1=1, axis2=2),
+        }
+        if self._store_covariance:
+            columns['covariance'] = covariances
+        path = os.path.join(self._output_directory, f'{self._part_prefix}-{self._parts_number:06d}.sdc')
+        save_arrays(path, columns)
+        self._parts_number += 1
+        self._buffer = self._make_buffer()
+
+    def close(self):
+        """Сбрасывает накопленные оценки на диск
+        :returns: статистика воспроизведения (stats)"""
+        if self._output_directory is not None:
+            self._flush()
+        return self.stats
+
+
+def _replay_worker(worker_index, input_queue, result_queue, output_directory, filter_config, part_size,
+                   store_covariance):
+    """Процесс пула: обрабатывает части журнала своих поездок до получения None"""
+    try:
+        replayer = LogReplayer(
+            output_directory, filter_config, part_prefix=f'estimates-{worker_index:03d}',
+            part_size=part_size, store_covariance=store_covariance)
+        while True:
+            chunk = input_queue.get()
+            if chunk is None:
+                break
+            replayer.process_chunk(chunk)
+        result_queue.put((worker_index, replayer.close(), None))
+    except Exception:
+        result_queue.put((worker_index, None, traceback.format_exc()))
+
+
+def _put(input_queue, item, processes, result_queue):
+    """Блокирующая запись в ограниченную очередь; если процесс пула упал, запись не зависает навсегда,
+    а исключение содержит ошибки, о которых процессы успели сообщить в result_queue"""
+    while True:
+        try:
+            input_queue.put(item, timeout=1.)
+            return
+        except queue.Full:
+            if not all(process.is_alive() for process in processes):
+                errors = []
+                while True:
+                    try:
+                        # Короткое ожидание: сообщение завершившегося процесса может быть еще в пути по каналу
+                        index, _, error = result_queue.get(timeout=0.1)
+                    except queue.Empty:
+                        break
+                    if error is not None:
+                        errors.append(f'Replay worker {index} failed:\n{error}')
+                raise RuntimeError('\n'.join(errors) if errors else 'Replay worker exited unexpectedly')
+
+
+def split_by_worker(chunk, workers_number):
+    """Разбивает часть журнала по процессам: поездка drive всегда попадает в процесс drive % workers_number,
+    порядок строк внутри поездки сохраняется.
+    :returns: список dict столбцов (или None, если процессу нечего обрабатывать) длины workers_number
+    """
+    workers = chunk['drive'] % workers_number
+    order = np.argsort(workers, kind='stable')
+    bounds = np.searchsorted(workers[order], np.arange(workers_number + 1))
+    parts = []
+    for worker in range(workers_number):
+        rows = order[bounds[worker]:bounds[worker + 1]]
+        parts.append({name: column[rows] for name, column in chunk.items()} if rows.shape[0] > 0 else None)
+    return parts
+
+
+def replay(log_paths, output_directory=None, workers_number=None, filter_config=None, chunk_size=65536,
+           part_size=65536, queue_size=4, store_covariance=False):
+    """Воспроизводит журналы наблюдений фильтром Калмана быстрее реального времени.
+    Журналы читаются по частям в главном процессе, строки распределяются по процессам по номеру поездки
+    (split_by_worker), каждый процесс ведет свои поездки в LogReplayer и пишет оценки в свои файлы.
+    Очереди к процессам ограничены queue_size частями, поэтому чтение не убегает вперед обработки.
+    :param log_paths: путь или список путей к журналам (.csv или бинарный формат)
+    :param output_directory: каталог для оценок (создается) или None
+    :param workers_number: число процессов, по умолчанию os.cpu_count(); 1 - без дополнительных процессов
+    :returns: dict с отчетом: число наблюдений, длительность, пропускная способность (наблюдений в секунду)
+        и ускорение относительно реального времени
+    """
+    if isinstance(log_paths, str):
+        log_paths = [log_paths]
+    if workers_number is None:
+        workers_number = os.cpu_count() or 1
+    if output_directory is not None:
+        os.makedirs(output_directory, exist_ok=True)
+        for path in glob.glob(os.path.join(output_directory, ESTIMATES_PART_PATTERN)):
+            os.remove(path)
+    chunks = (chunk for path in log_paths for chunk in read_log_chunks(path, chunk_size))
+
+    start_time = time.perf_counter()
+    if workers_number == 1:
+        replayer = LogReplayer(output_directory, filter_config, part_size=part_size,
+                               store_covariance=store_covariance)
+        for chunk in chunks:
+            replayer.process_chunk(chunk)
+        workers_stats = [replayer.close()]
+    else:
+        # multiprocessing нужен только в многопроцессном режиме и заметно замедляет импорт модуля
+        import multiprocessing
+        input_queues = [multiprocessing.Queue(maxsize=queue_size) for _ in range(workers_number)]
+        result_queue = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_replay_worker,
+                args=(index, input_queue, result_queue, output_directory, filter_config, part_size,
+                      store_covariance),
+                daemon=True)
+            for index, input_queue in enumerate(input_queues)]
+        for process in processes:
+            process.start()
+        try:
+            for chunk in chunks:
+                for input_queue, part in zip(input_queues, split_by_worker(chunk, workers_number)):
+                    if part is not None:
+                        _put(input_queue, part, processes, result_queue)
+            for input_queue in input_queues:
+                _put(input_queue, None, processes, result_queue)
+            workers_stats = [None] * workers_number
+            for _ in range(workers_number):
+                index, stats, error = result_queue.get()
+                if error is not None:
+                    raise RuntimeError(f'Replay worker {index} failed:\n{error}')
+                workers_stats[index] = stats
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+    duration = time.perf_counter() - start_time
+
+    report = {name: sum(stats[name] for stats in workers_stats) for name in (
+        'observations_number', 'dropped_number', 'drives_number', 'log_duration', 'parts_number')}
+    report.update({
+        'workers_number': workers_number,
+        'duration': duration,
+        'throughput': report['observations_number'] / duration,
+        'realtime_factor': report['log_duration'] / duration,
+        # Доля времени, которую процессы были заняты фильтрацией, а не ожиданием данных
+        'workers_utilization': sum(stats['busy_time'] for stats in workers_stats) / (workers_number * duration),
+    })
+    return report
+
+
+def load_estimates(output_directory):
+    """Собирает оценки из файлов, записанных replay, упорядочивая их по поездке и времени.
+    :returns: dict столбцов drive, time, sensor, mean, variance (и covariance, если сохранялась)
+    """
+    parts = [load_arrays(path, mmap=False)
+             for path in sorted(glob.glob(os.path.join(output_directory, ESTIMATES_PART_PATTERN)))]
+    assert parts, f'No estimates in {output_directory}'
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    order = np.lexsort((columns['time'], columns['drive']))
+    return {name: column[order] for name, column in columns.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Воспроизведение журналов наблюдений фильтром Калмана')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    make_parser = subparsers.add_parser('make-log', help='смоделировать журнал парка автомобилей')
+    make_parser.add_argument('path', help='файл журнала: .csv или бинарный')
+    make_parser.add_argument('--vehicles', type=int, default=100, help='число поездок')
+    make_parser.add_argument('--duration', type=float, default=60., help='длительность поездки в секундах')
+    run_parser = subparsers.add_parser('run', help='воспроизвести журналы')
+    run_parser.add_argument('logs', nargs='+', help='файлы журналов')
+    run_parser.add_argument('--output', default=None, help='каталог для оценок')
+    run_parser.add_argument('--workers', type=int, nargs='+', default=[None],
+                            help='число процессов; несколько значений - сравнение масштабирования')
+    run_parser.add_argument('--chunk-size', type=int, default=65536, help='строк журнала в одной части')
+    run_parser.add_argument('--store-covariance', action='store_true', help='сохранять полные ковариации')
+    args = parser.parse_args(argv)
+
+    if args.command == 'make-log':
+        from .scenario import make_scenario
+        from .fleet_service import make_fleet_log
+        columns = get_log_columns(make_fleet_log(args.vehicles, make_scenario(duration=args.duration)))
+        write_log(args.path, columns)
+        print(f'{args.path}: {columns["time"].shape[0]} observations')
+        return 0
+
+    print('{:>8} {:>14} {:>10} {:>16} {:>10} {:>12}'.format(
+        'workers', 'observations', 'time[s]', 'throughput[1/s]', 'realtime', 'utilization'))
+    for workers_number in args.workers:
+        report = replay(args.logs, args.output, workers_number, chunk_size=args.chunk_size,
+                        store_covariance=args.store_covariance)
+        print('{:>8} {:>14} {:>10.3f} {:>16.0f} {:>9.0f}x {:>12.2f}'.format(
+            report['workers_number'], report['observations_number'], report['duration'],
+            report['throughput'], report['realtime_factor'], report['workers_utilization']))
+        if report['dropped_number']:
+            print(f'{report["dropped_number"]} observations dropped (out of order or unknown sensor)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import platform
+import numpy as np
+from .timestamp import Timestamp
+from .scenario import MOVEMENT_MODELS, SENSORS, make_scenario, simulate_scenario, get_kalman_observations
+from .scenario_cache import get_cache_key, save_arrays
+
+
+# Фильтры, которые можно запустить на смоделированном сценарии
+FILTER_TYPES = ('ekf', 'imm', 'none')
+
+# Описание запуска по умолчанию. Поля scenario совпадают с scenario.DEFAULT_SCENARIO;
+# filter.noise - std шума модели эволюции (см. tuning.get_noise_covariance_density),
+# filter.sensors_noise_stds - предполагаемый фильтром шум сенсоров (по умолчанию равен реальному).
+DEFAULT_RUN_CONFIG = {
+    'scenario': make_scenario(),
+    'filter': {
+        'type': 'ekf',
+        'noise': {'xy_noise_std': 0.3, 'yaw_noise_std': 0.3, 'v_noise_std': 1., 'omega_noise_std': 1.},
+        'sensors_noise_stds': None,
+        'max_dt': None,
+        # Для imm: вероятность смены режима (прямая / поворот) за шаг
+        'switch_probability': 0.05,
+    },
+    'seed': 0,
+    # Тип сохраняемых массивов состояний и оценок: float32 вдвое компактнее, вычисления всегда в float64
+    'output_dtype': 'float64',
+}
+
+# Имена классов моделей движения, допустимые в описании наравне с короткими именами
+_MOVEMENT_MODELS_BY_CLASS = {model_class.__name__: name for name, model_class in MOVEMENT_MODELS.items()}
+
+
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for name, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict) and name != 'sensors':
+            merged[name] = _merge(merged[name], value)
+        else:
+            merged[name] = copy.deepcopy(value)
+    return merged
+
+
+def make_run_config(config=None):
+    """Полное описание запуска: config, дополненный значениями из DEFAULT_RUN_CONFIG.
+    Набор сенсоров (scenario.sensors) заменяется целиком, остальные вложенные dict объединяются по полям.
+    Модель движения можно задать коротким именем (circle) или именем класса (CircleMovementModel).
+    """
+    config = _merge(DEFAULT_RUN_CONFIG, config or {})
+    scenario = config['scenario']
+    scenario['movement_model'] = _MOVEMENT_MODELS_BY_CLASS.get(scenario['movement_model'], scenario['movement_model'])
+    assert scenario['movement_model'] in MOVEMENT_MODELS, f'Unknown movement model {scenario["movement_model"]}'
+    for name, sensor_config in scenario['sensors'].items():
+        assert name in SENSORS, f'Unknown sensor {name}'
+        assert {'noise_std', 'period'} <= set(sensor_config) <= {'noise_std', 'period', 'bias', 'scale_drift'}, \
+            f'Sensor {name}: expected noise_std, period and optional bias, scale_drift'
+    assert config['filter']['type'] in FILTER_TYPES, f'Unknown filter type {config["filter"]["type"]}'
+    assert config['output_dtype'] in ('float64', 'float32')
+    return config
+
+
+def run_ekf(scenario, simulation, filter_config):
+    from .kalman_batch import filter_arrays
+    from .tuning import get_noise_covariance_density, get_initial_estimate
+    observations = get_kalman_observations(scenario, simulation['observations'], filter_config['sensors_noise_stds'])
+    initial_mean, initial_covariance = get_initial_estimate(scenario, simulation['observations'])
+    means, covariances = filter_arrays(
+        simulation['times'], observations, initial_mean, initial_covariance,
+        noise_covariance_density=get_noise_covariance_density(**filter_config['noise']),
+        max_dt=filter_config['max_dt'])
+    return {'means': means, 'covariances': covariances}
+
+
+def run_imm(scenario, simulation, filter_config):
+    from .imm_filter import ImmFilter, get_straight_and_turn_modes
+    from .tuning import get_noise_covariance_density, get_initial_estimate
+    density = get_noise_covariance_density(**filter_config['noise'])
+    switch_probability = filter_config['switch_probability']
+    initial_mean, initial_covariance = get_initial_estimate(scenario, simulation['observations'])
+    imm_filter = ImmFilter(
+        get_straight_and_turn_modes(density, density),
+        [[1 - switch_probability, switch_probability], [switch_probability, 1 - switch_probability]],
+        initial_mean, initial_covariance)
+    observations = [
+        (values, C, Q) for values, C, Q in get_kalman_observations(
+            scenario, simulation['observations'], filter_config['sensors_noise_stds']).values()]
+    times = simulation['times']
+    state_size = initial_mean.shape[0]
+    means = np.empty((times.shape[0], state_size), dtype=np.float64)
+    covariances = np.empty((times.shape[0], state_size, state_size), dtype=np.float64)
+    mode_probabilities = np.empty((times.shape[0], imm_filter.modes_number), dtype=np.float64)
+    for t in range(times.shape[0]):
+        if t > 0:
+            imm_filter.move(Timestamp.nanoseconds(int(round((times[t] - times[t - 1]) * Timestamp.NANO_SEC_COEFF))))
+        for values, C, Q in observations:
+            if not np.any(np.isnan(values[t])):
+                imm_filter.process_observation(values[t], C, Q)
+        means[t] = imm_filter.state
+        covariances[t] = imm_filter.covariance_matrix
+        mode_probabilities[t] = imm_filter.mode_probabilities
+    return {'means': means, 'covariances': covariances, 'mode_probabilities': mode_probabilities}
+
+
+FILTERS = {
+    'ekf': run_ekf,
+    'imm': run_imm,
+}
+
+
+def run(config=None, output_directory=None):
+    """Моделирует сценарий, запускает на нем фильтр и считает метрики без ноутбуков и графики.
+    В output_directory записываются run.sdc (save_arrays: times, states, observations/<сенсор>,
+    estimates/<массив>) и summary.json (полное описание запуска, его хеш, время этапов и метрики).
+    Результат определяется описанием запуска: одинаковый config (включая seed) дает одинаковые массивы.
+    :param config: dict с описанием запуска, см. DEFAULT_RUN_CONFIG и make_run_config
+    :param output_directory: каталог для результатов (создается) или None, чтобы ничего не записывать
+    :returns: dict summary
+    """
+    config = make_run_config(config)
+    scenario = config['scenario']
+    filter_config = config['filter']
+    timing = {}
+
+    start_time = time.perf_counter()
+    simulation = simulate_scenario(scenario, random_state=config['seed'])
+    timing['simulate'] = time.perf_counter() - start_time
+
+    estimates = {}
+    metrics = {}
+    if filter_config['type'] != 'none':
+        from .metrics import StreamingMetrics
+        filter_start_time = time.perf_counter()
+        estimates = FILTERS[filter_config['type']](scenario, simulation, filter_config)
+        timing['filter'] = time.perf_counter() - filter_start_time
+        streaming_metrics = StreamingMetrics(state_size=simulation['states'].shape[1])
+        streaming_metrics.update_state(simulation['states'], estimates['means'], estimates['covariances'])
+        metrics = streaming_metrics.summary()
+
+    steps_number = simulation['times'].shape[0]
+    compute_time = time.perf_counter() - start_time
+    timing.update({
+        'steps_number': steps_number,
+        'steps_per_second': steps_number / compute_time,
+        'realtime_factor': scenario['duration'] / compute_time,
+    })
+    summary = {
+        'config': config,
+        'config_key': get_cache_key(config),
+        'timing': timing,
+        'metrics': metrics,
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__},
+    }
+
+    if output_directory is not None:
+        write_start_time = time.perf_counter()
+        os.makedirs(output_directory, exist_ok=True)
+        dtype = np.dtype(config['output_dtype'])
+        save_arrays(os.path.join(output_directory, 'run.sdc'), {
+            'times': simulation['times'],
+            'states': simulation['states'].astype(dtype, copy=False),
+            'observations': {
+                name: values.astype(dtype, copy=False) for name, values in simulation['observations'].items()},
+            'estimates': {name: values.astype(dtype, copy=False) for name, values in estimates.items()},
+        })
+        timing['write'] = time.perf_counter() - write_start_time
+        with open(os.path.join(output_directory, 'summary.json'), 'w') as output:
+            json.dump(summary, output, indent=2, sort_keys=True, default=float)
+    return summary
+
+
+def format_summary(summary):
+    lines = []
+    timing = summary['timing']
+    for name in ('simulate', 'filter', 'write'):
+        if name in timing:
+            lines.append(f'{name + "_time":<20} {timing[name]:.4f} s')
+    lines.append(f'{"steps_per_second":<20} {timing["steps_per_second"]:.0f}')
+    lines.append(f'{"realtime_factor":<20} {timing["realtime_factor"]:.0f}x')
+    for name, value in summary['metrics'].items():
+        if isinstance(value, float):
+            lines.append(f'{name:<20} {value:.6g}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Моделирование сценария и запуск фильтра без ноутбука: python -m sdc.run config.json -o DIR')
+    parser.add_argument('config', nargs='?', default=None,
+                        help='описание запуска в json; недостающие поля берутся из DEFAULT_RUN_CONFIG')
+    parser.add_argument('-o', '--output', default=None, help='каталог для run.sdc и summary.json')
+    parser.add_argument('--seed', type=int, default=None, help='заменяет seed из описания')
+    parser.add_argument('--duration', type=float, default=None, help='заменяет длительность сценария в секундах')
+    parser.add_argument('--filter', choices=FILTER_TYPES, default=None, help='заменяет тип фильтра')
+    parser.add_argument('--output-dtype', choices=['float64', 'float32'], default=None)
+    parser.add_argument('--print-config', action='store_true', help='вывести полное описание запуска и выйти')
+    args = parser.parse_args(argv)
+
+    config = {}
+    if args.config is not None:
+        with open(args.config) as input_file:
+            config = json.load(input_file)
+    if args.seed is not None:
+        config['seed'] = args.seed
+    if args.duration is not None:
+        config.setdefault('scenario', {})['duration'] = args.duration
+    if args.filter is not None:
+        config.setdefault('filter', {})['type'] = args.filter
+    if args.output_dtype is not None:
+        config['output_dtype'] = args.output_dtype
+    if args.print_config:
+        print(json.dumps(make_run_config(config), indent=2, sort_keys=True, default=float))
+        return 0
+
+    summary = run(config, args.output)
+    print(format_summary(summary))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import numpy as np
+from .car import Car
+from .timestamp import Timestamp
+from .linear_movement_model import LinearMovementModel
+from .circle_movement_model import CircleMovementModel
+from .cycloid_movement_model import CycloidMovementModel
+from .gps_sensor import GpsSensor
+from .can_sensor import CanSensor
+from .imu_sensor import ImuSensor
+from .sensor_drift import make_drift_process
+
+
+# Модели движения, доступные в описании сценария
+MOVEMENT_MODELS = {
+    'linear': LinearMovementModel,
+    'circle': CircleMovementModel,
+    'cycloid': CycloidMovementModel,
+}
+
+# Сенсоры, доступные в описании сценария: класс сенсора и индексы наблюдаемых компонент состояния
+SENSORS = {
+    'gps': (GpsSensor, [Car.POS_X_INDEX, Car.POS_Y_INDEX]),
+    'can': (CanSensor, [Car.VEL_INDEX]),
+    'imu': (ImuSensor, [Car.OMEGA_INDEX]),
+}
+
+DEFAULT_SCENARIO = {
+    'movement_model': 'circle',
+    'movement_model_params': {},
+    'initial_position': [5., 5.],
+    'initial_velocity': 2.,
+    'initial_yaw': np.pi / 2.,
+    'initial_omega': 0.2,
+    'duration': 30.,
+    'dt': 0.1,
+    'sensors': {
+        'gps': {'noise_std': 1., 'period': 1.},
+        'can': {'noise_std': 0.2, 'period': 0.1},
+        'imu': {'noise_std': 0.2, 'period': 0.1},
+    },
+}
+
+
+def make_scenario(**kwargs):
+    """Сценарий по умолчанию с замененными полями"""
+    scenario = dict(DEFAULT_SCENARIO)
+    scenario.update(kwargs)
+    return scenario
+
+
+def make_car(scenario, random_state=None):
+    """Создает Car с моделью движения и сенсорами из описания сценария.
+    Генераторы шума сенсоров получают независимые seed, порожденные из random_state через SeedSequence.
+    Описание сенсора может содержать bias и scale_drift - параметры sensor_drift.DriftProcess (без size).
+    :param random_state: int, np.random.SeedSequence или None
+    """
+    movement_model = MOVEMENT_MODELS[scenario['movement_model']](**scenario.get('movement_model_params', {}))
+    car = Car(
+        initial_position=list(scenario['initial_position']),
+        initial_velocity=scenario['initial_velocity'],
+        initial_yaw=scenario['initial_yaw'],
+        initial_omega=scenario['initial_omega'],
+        movement_model=movement_model)
+    sensors = scenario['sensors']
+    if not isinstance(random_state, np.random.SeedSequence):
+        random_state = np.random.SeedSequence(random_state)
+    # generate_state, в отличие от spawn, не меняет SeedSequence: повторный вызов с тем же
+    # random_state дает ту же реализацию
+    seeds = random_state.generate_state(len(sensors))
+    for (name, config), seed in zip(sorted(sensors.items()), seeds):
+        sensor_class, indices = SENSORS[name]
+        # Seed процессов дрейфа порождаются из seed сенсора и не меняют поток его белого шума
+        bias_seed, scale_drift_seed = np.random.SeedSequence(int(seed)).generate_state(2)
+        car.add_sensor(sensor_class(
+            noise_variances=np.full(len(indices), config['noise_std']**2),
+            random_state=int(seed),
+            bias=make_drift_process(config.get('bias'), len(indices), int(bias_seed)),
+            scale_drift=make_drift_process(config.get('scale_drift'), len(indices), int(scale_drift_seed))))
+    return car
+
+
+def get_sensors_steps(scenario):
+    """Период каждого сенсора в шагах моделирования"""
+    return {
+        name: max(1, int(round(config['period'] / scenario['dt'])))
+        for name, config in scenario['sensors'].items()}
+
+
+def simulate_scenario(scenario, random_state=None):
+    """Моделирует движение автомобиля и показания его сенсоров.
+    Наблюдения снимаются в момент 0 и после каждого шага dt, сенсор с периодом period
+    выдает показание каждые round(period / dt) шагов, в остальные моменты в массиве стоит NaN.
+    :returns: dict с полями times (T,), states (T, 5) и observations - dict {имя сенсора: (T, m)}
+    """
+    car = make_car(scenario, random_state)
+    steps_number = int(round(scenario['duration'] / scenario['dt']))
+    dt = Timestamp.nanoseconds(int(round(scenario['dt'] * Timestamp.NANO_SEC_COEFF)))
+    sensors_steps = get_sensors_steps(scenario)
+    sensors = {str(sensor).lower(): sensor for sensor in car.sensors}
+
+    times = np.empty(steps_number + 1, dtype=np.float64)
+    states = np.empty((steps_number + 1, car._state_size), dtype=np.float64)
+    observations = {
+        name: np.full((steps_number + 1, sensor.observation_size), np.nan)
+        for name, sensor in sensors.items()}
+    for step in range(steps_number + 1):
+        if step > 0:
+            car.move(dt)
+        times[step] = car.time.to_seconds()
+        states[step] = car._state
+        for name, sensor in sensors.items():
+            if step % sensors_steps[name] == 0:
+                observations[name][step] = sensor.observe()
+    return {'times': times, 'states': states, 'observations': observations}
+
+
+def get_kalman_observations(scenario, observations, noise_stds=None):
+    """Наблюдения в формате kalman_batch.filter_arrays.
+    :param observations: dict {имя сенсора: (T, m)}, как в simulate_scenario
+    :param noise_stds: dict {имя сенсора: std} или None. Предполагаемый фильтром уровень шума сенсоров,
+        по умолчанию совпадает с реальным из сценария
+    """
+    observations_by_sensor = {}
+    for name, values in observations.items():
+        _, indices = SENSORS[name]
+        noise_std = scenario['sensors'][name]['noise_std']
+        if noise_stds is not None and name in noise_stds:
+            noise_std = noise_stds[name]
+        C = np.zeros((len(indices), Car.OMEGA_INDEX + 1), dtype=np.float64)
+        C[np.arange(len(indices)), indices] = 1
+        Q = np.eye(len(indices)) * noise_std**2
+        observations_by_sensor[name] = (values, C, Q)
+    return observations_by_sensor
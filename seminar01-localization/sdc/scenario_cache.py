@@ -0,0 +1,192 @@
+import os
+import json
+import struct
+import hashlib
+import tempfile
+import numpy as np
+from .scenario import simulate_scenario
+
+
+_MAGIC = b'SDCSCN01'
+_ALIGNMENT = 64
+
+
+def get_cache_key(*parts):
+    """Хеш описания содержимого: параметров модели движения, шумов сенсоров, seed и т.п.
+    Части должны сериализоваться в json; np.random.SeedSequence заменяется на (entropy, spawn_key)."""
+    def default(value):
+        if isinstance(value, np.random.SeedSequence):
+            return {'entropy': str(value.entropy), 'spawn_key': list(value.spawn_key)}
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f'Cannot hash value of type {type(value)}')
+    description = json.dumps(parts, sort_keys=True, default=default)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def _flatten(arrays, prefix=''):
+    """{'a': {'b': x}} -> {'a/b': x}"""
+    flat = {}
+    for name, value in arrays.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + name + '/'))
+        else:
+            flat[prefix + name] = np.ascontiguousarray(value)
+    return flat
+
+
+def _unflatten(flat):
+    arrays = {}
+    for name, value in flat.items():
+        *parents, leaf = name.split('/')
+        node = arrays
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    return arrays
+
+
+def save_arrays(path, arrays):
+    """Записывает (вложенный) dict массивов в один файл: заголовок с описанием массивов и
+    выровненные сырые данные, которые затем можно отобразить в память без копирования."""
+    flat = _flatten(arrays)
+    header = {}
+    offset = 0
+    for name, value in flat.items():
+        header[name] = {'dtype': value.dtype.str, 'shape': list(value.shape), 'offset': offset}
+        offset += -(-value.nbytes // _ALIGNMENT) * _ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_offset = -(-(len(_MAGIC) + 8 + len(header_bytes)) // _ALIGNMENT) * _ALIGNMENT
+    with open(path, 'wb') as output:
+        output.write(_MAGIC)
+        output.write(struct.pack('<Q', len(header_bytes)))
+        output.write(header_bytes)
+        for name, value in flat.items():
+            output.seek(data_offset + header[name]['offset'])
+            output.write(value.tobytes())
+        output.truncate(data_offset + offset)
+
+
+def load_arrays(path, mmap=True):
+    """Читает файл, записанный save_arrays.
+    :param mmap: True - массивы отображаются в память только для чтения, False - читаются целиком
+    """
+    with open(path, 'rb') as input_file:
+        assert input_file.read(len(_MAGIC)) == _MAGIC, f'{path} is not a scenario file'
+        header_size, = struct.unpack('<Q', input_file.read(8))
+        header = json.loads(input_file.read(header_size).decode('utf-8'))
+    data_offset = -(-(len(_MAGIC) + 8 + header_size) // _ALIGNMENT) * _ALIGNMENT
+    flat = {}
+    for name, description in header.items():
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        offset = data_offset + description['offset']
+        if mmap and int(np.prod(shape)) > 0:
+            flat[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            flat[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+    return _unflatten(flat)
+
+
+class ScenarioCache:
+    """Кеш смоделированных сценариев на диске с адресацией по содержимому.
+    Ключ - хеш описания (параметры модели движения, шумы сенсоров, seed), значение - файл
+    с массивами истинных состояний и наблюдений. Файлы читаются через отображение в память.
+    Общий размер файлов ограничен max_size байт: при превышении удаляются файлы, к которым
+    дольше всего не обращались (время обращения хранится во времени модификации файла).
+    """
+    SUFFIX = '.scn'
+
+    def __init__(self, directory, max_size=1 << 30, mmap=True):
+        """
+        :param directory: каталог кеша, создается при необходимости
+        :param max_size: максимальный суммарный размер файлов в байтах
+        :param mmap: загружать массивы через отображение в память
+        """
+        self._directory = directory
+        self._max_size = max_size
+        self._mmap = mmap
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _get_path(self, key):
+        return os.path.join(self._directory, key + self.SUFFIX)
+
+    def _get_entries(self):
+        """Список (время обращения, размер, путь) всех файлов кеша"""
+        entries = []
+        for file_name in os.listdir(self._directory):
+            if not file_name.endswith(self.SUFFIX):
+                continue
+            path = os.path.join(self._directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        return entries
+
+    @property
+    def size(self):
+        """Суммарный размер файлов кеша в байтах"""
+        return sum(size for _, size, _ in self._get_entries())
+
+    def __contains__(self, key):
+        return os.path.exists(self._get_path(key))
+
+    def get(self, key):
+        """Массивы по ключу или None, если их нет в кеше"""
+        path = self._get_path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return load_arrays(path, mmap=self._mmap)
+
+    def put(self, key, arrays):
+        """Сохраняет массивы по ключу и вытесняет давно не использованные файлы"""
+        file_descriptor, temporary_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+        os.close(file_descriptor)
+        try:
+            save_arrays(temporary_path, arrays)
+            # Замена атомарна, поэтому параллельные процессы не увидят недописанный файл
+            os.replace(temporary_path, self._get_path(key))
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        self.evict(keep=self._get_path(key))
+
+    def evict(self, keep=None):
+        """Удаляет файлы в порядке давности обращения, пока суммарный размер больше max_size"""
+        entries = sorted(self._get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self._max_size:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def get_or_create(self, key, create):
+        """Массивы по ключу; при промахе они создаются вызовом create() и сохраняются"""
+        arrays = self.get(key)
+        if arrays is None:
+            self.put(key, create())
+            arrays = self.get(key)
+        return arrays
+
+    def get_scenario(self, scenario, random_state=None):
+        """Результат scenario.simulate_scenario из кеша или после моделирования"""
+        assert random_state is not None, 'Only reproducible scenarios can be cached'
+        key = get_cache_key('simulate_scenario', scenario, random_state)
+        return self.get_or_create(key, lambda: simulate_scenario(scenario, random_state))
@@ -0,0 +1,216 @@
+import numpy as np
+
+
+def check_timestamp():
+    from .timestamp import Timestamp
+    t = Timestamp(1, 19)
+    assert t.sec == 1
+    assert t.nsec == 19
+    t.sec = 2
+    t.nsec = 10000
+    assert t.sec == 2
+    assert t.nsec == 10000
+    assert abs(t.to_seconds() - 2.00001) < 1e-9
+
+    t1 = Timestamp(1, 1000000)
+    t2 = Timestamp(2, 100000000)
+    assert abs(t1.to_seconds() - 1.001) < 1e-9
+    assert abs(t2.to_seconds() - 2.1) < 1e-9
+    assert abs((t2 - t1).to_seconds() - 1.099) < 1e-9
+    assert abs((t2 + t1).to_seconds() - 3.101) < 1e-9
+    t2 += t1
+    assert abs(t2.to_seconds() - 3.101) < 1e-9
+
+
+def check_sensors():
+    from .can_sensor import CanSensor
+    from .gps_sensor import GpsSensor
+    from .imu_sensor import ImuSensor
+    from .sensor_landmark import LandmarkSensor
+    from .kalman_can_sensor import KalmanCanSensor
+    from .kalman_gps_sensor import KalmanGpsSensor
+    from .kalman_imu_sensor import KalmanImuSensor
+
+    sensor = CanSensor(noise_variances=[15])
+    assert sensor.observation_size == 1
+    assert np.all(sensor.get_noise_covariance() == np.diag([15]))
+
+    sensor = GpsSensor(noise_variances=[15, 15])
+    assert sensor.observation_size == 2
+    assert np.all(sensor.get_noise_covariance() == np.diag([15, 15]))
+
+    sensor = ImuSensor(noise_variances=[1])
+    assert sensor.observation_size == 1
+    assert np.all(sensor.get_noise_covariance() == np.diag([1]))
+
+    sensor = LandmarkSensor(x=5, y=5, noise_variances=[2, 2])
+    assert sensor.observation_size == 2
+    assert np.all(sensor.get_noise_covariance() == np.diag([2, 2]))
+
+    sensor = KalmanCanSensor(noise_variances=[5])
+    assert sensor.observation_size == 1
+    assert np.all(sensor.get_noise_covariance() == np.diag([5]))
+
+    sensor = KalmanGpsSensor(noise_variances=[5, 5])
+    assert sensor.observation_size == 2
+    assert np.all(sensor.get_noise_covariance() == np.diag([5, 5]))
+
+    sensor = KalmanImuSensor(noise_variances=[5])
+    assert sensor.observation_size == 1
+    assert np.all(sensor.get_noise_covariance() == np.diag([5]))
+
+
+def check_metrics():
+    from .metrics import WelfordAccumulator
+    values = np.random.RandomState(0).normal(size=(100, 3))
+    accumulator = WelfordAccumulator((3,))
+    for value in values[:30]:
+        accumulator.update(value)
+    accumulator.update_batch(values[30:])
+    assert np.allclose(accumulator.mean, values.mean(axis=0))
+    assert np.allclose(accumulator.variance, values.var(axis=0))
+
+
+def check_trajectory_lod():
+    from .trajectory_lod import TrajectoryLod, douglas_peucker
+    # Путь туда и обратно: точка разворота проецируется за конец отрезка 0 -> 3, но должна сохраниться
+    x = np.concatenate([np.linspace(0, 10, 100), np.linspace(10, 3, 100)])
+    assert 99 in douglas_peucker(np.stack([x, np.zeros_like(x)], axis=1), 0.05)
+
+    t = np.linspace(0, 10, 5000)
+    lod = TrajectoryLod(tolerance=0.01, max_points=64, chunk_size=256)
+    lod.extend(t, np.sin(t))
+    assert len(lod) == 5000 and lod.points.shape[0] <= 64 + 256
+    assert np.allclose(lod.bounding_box, (0, 10, np.sin(t).min(), 1), atol=1e-6)
+    assert np.allclose(np.interp(t, *lod.get_data()), np.sin(t), atol=2 * lod.tolerance)
+
+
+def check_landmarks_likelihood():
+    from .sensor_landmark import get_landmark_position_in_local_frame, get_landmarks_position_in_local_frame
+    from .grid_localization import get_landmarks_log_likelihood
+    from .likelihood import get_landmarks_log_likelihood_fused, log_sum_exp, normalize_log_weights
+    gen = np.random.RandomState(0)
+    landmarks_xy = gen.uniform(-50, 50, size=(7, 2))
+    observations = gen.normal(size=(7, 2))
+    noise_covariance = np.array([[0.5, 0.1], [0.1, 0.3]])
+    poses = gen.uniform(-60, 60, size=(3, 40))
+    expected = []
+    for x, y, yaw in poses.T:
+        local = get_landmarks_position_in_local_frame(x, y, yaw, landmarks_xy)
+        assert np.allclose(local[0], get_landmark_position_in_local_frame(x, y, yaw, *landmarks_xy[0]))
+        residuals = observations - local
+        expected.append(-0.5 * (
+            np.einsum('li,ij,lj->', residuals, np.linalg.inv(noise_covariance), residuals) +
+            len(landmarks_xy) * np.log(np.linalg.det(2 * np.pi * noise_covariance))))
+    fused = get_landmarks_log_likelihood_fused(*poses, observations, landmarks_xy, noise_covariance,
+                                               max_chunk_elements=50)
+    assert np.allclose(fused, expected, rtol=0, atol=1e-8)
+    assert np.allclose(get_landmarks_log_likelihood(*poses, observations, landmarks_xy, noise_covariance),
+                       expected, rtol=0, atol=1e-8)
+
+    # Вдали от начала координат точность не теряется
+    offset = np.array([5e6, 5e6])
+    far = get_landmarks_log_likelihood_fused(
+        poses[0] + offset[0], poses[1] + offset[1], poses[2], observations, landmarks_xy + offset, noise_covariance)
+    assert np.allclose(far, expected, rtol=0, atol=1e-4)
+    far = get_landmarks_log_likelihood(
+        poses[0] + offset[0], poses[1] + offset[1], poses[2], observations, landmarks_xy + offset, noise_covariance)
+    assert np.allclose(far, expected, rtol=0, atol=1e-4)
+
+    log_weights = 1000. * np.array(expected)
+    weights, log_normalizer = normalize_log_weights(log_weights)
+    assert np.isclose(np.sum(weights), 1.) and np.isfinite(log_normalizer)
+    assert np.isclose(log_sum_exp([-1000., -1000.]), -1000. + np.log(2.))
+
+
+def check_precision():
+    """Потери точности фильтра частиц, вычисляющего в float32, относительно float64
+    (см. precision.FLOAT32_TOLERANCES)"""
+    from .timestamp import Timestamp
+    from .precision import FLOAT32_TOLERANCES
+    from .particle_filter import ParticleFilter, get_uniform_particles
+
+    # Без шума модели движения оба фильтра получают одинаковые случайные числа ресемплинга
+    gen = np.random.RandomState(0)
+    landmarks_xy = gen.uniform(-50, 50, size=(10, 2))
+    observations = [gen.normal(size=(10, 2)) for _ in range(5)]
+    particles = get_uniform_particles(2000, 100., (1., 3.), (0., 0.2), random_state=0)
+    particles[:, :2] += 300.
+    states = []
+    for dtype in (np.float64, np.float32):
+        particle_filter = ParticleFilter(particles, resample_threshold=1.1, random_state=0, dtype=dtype)
+        assert particle_filter.particles.dtype == dtype
+        for step_observations in observations:
+            particle_filter.move(Timestamp.milliseconds(100))
+            particle_filter.process_landmarks_observations(step_observations, landmarks_xy, np.eye(2))
+        states.append(particle_filter.state)
+    assert np.max(np.abs(states[0] - states[1])) < FLOAT32_TOLERANCES['particle_state']
+
+
+def check_sensor_drift():
+    """Векторная генерация дрейфа совпадает с пошаговой, а сенсоры без дрейфа дают прежние наблюдения"""
+    from .timestamp import Timestamp
+    from .sensor_drift import DriftProcess
+    from .scenario import make_scenario, simulate_scenario
+
+    times = np.concatenate([[0., 0.], np.cumsum(np.random.RandomState(0).exponential(0.5, 500)), [1e4]])
+    for correlation_time in (None, 2.):
+        sampled = DriftProcess([0.01, 0.04], correlation_time, size=2, random_state=0).sample(times)
+        process = DriftProcess([0.01, 0.04], correlation_time, size=2, random_state=0)
+        advanced = [process.advance(Timestamp.nanoseconds(int(round(t * Timestamp.NANO_SEC_COEFF)))) for t in times]
+        assert np.allclose(sampled, advanced, rtol=0, atol=1e-10)
+
+    sensors = dict(make_scenario()['sensors'])
+    sensors['imu'] = dict(sensors['imu'], bias={'density': 1e-4, 'correlation_time': 100.})
+    scenario = make_scenario(sensors=sensors)
+    plain = simulate_scenario(make_scenario(), random_state=0)['observations']
+    drifted = simulate_scenario(scenario, random_state=0)['observations']
+    for name in ('gps', 'can'):
+        assert np.array_equal(plain[name], drifted[name], equal_nan=True)
+    assert not np.array_equal(plain['imu'], drifted['imu'], equal_nan=True)
+
+
+
+def check_grid_motion():
+    """Предсказание GridLocalization переносит узкий пик на дробное число ячеек, не размазывая его по сетке"""
+    from .timestamp import Timestamp
+    from .grid_localization import GridLocalization
+    localization = GridLocalization(
+        region_side=100., cell_size=2., yaw_bins_number=64, position_noise_density=0., yaw_noise_density=0.)
+    x, y, yaw = localization.grid
+    probabilities = np.zeros(localization.shape)
+    probabilities[20, 25, 8] = 1.
+    localization.reset(probabilities)
+    # 1.3 ячейки вдоль yaw = 45 градусов и пол-ячейки по yaw
+    localization.move(Timestamp(1, 0), 2.6, 0.5 * 2 * np.pi / 64)
+    moved = localization.probabilities
+    assert moved.min() >= 0 and np.isclose(moved.sum(), 1.)
+    expected = (x[20] + 2.6 * np.cos(yaw[8]), y[25] + 2.6 * np.sin(yaw[8]), yaw[8] + 0.5 * 2 * np.pi / 64)
+    for axis, (centers, value) in enumerate(zip((x, y, yaw), expected)):
+        marginal = moved.sum(axis=tuple(i for i in range(3) if i != axis))
+        assert np.isclose(np.dot(marginal, centers), value)
+        # Вся масса - в соседних с ожидаемым положением ячейках
+        assert np.isclose(marginal[np.abs(centers - value) < centers[1] - centers[0]].sum(), 1.)
+
+
+# Проверки, которые раньше выполнялись при каждом импорте модулей
+CHECKS = [
+    check_timestamp,
+    check_sensors,
+    check_metrics,
+    check_trajectory_lod,
+    check_landmarks_likelihood,
+    check_precision,
+    check_sensor_drift,
+    check_grid_motion,
+]
+
+
+def run_checks():
+    for check in CHECKS:
+        check()
+
+
+if __name__ == '__main__':
+    run_checks()
+    print(f'{len(CHECKS)} checks passed')
@@ -0,0 +1,156 @@
+import math
+import numpy as np
+from .timestamp import Timestamp
+
+
+# Наибольший рост exp((t - t_начала части) / tau) внутри одной части при векторной генерации
+# в DriftProcess.sample: ограничивает exp(50) ~ 5e21, что далеко от переполнения float64
+_MAX_SEGMENT_DECAY = 50.
+
+
+class DriftProcess:
+    """Медленно меняющаяся ошибка датчика: смещение (bias) или ошибка масштаба.
+    Гауссовский марковский процесс первого порядка
+
+        db = -b / tau * dt + sqrt(q) * dW,
+
+    а при correlation_time=None - случайное блуждание db = sqrt(q) * dW. Переход за любой интервал dt точный:
+
+        b(t + dt) = a * b(t) + N(0, v),  a = exp(-dt / tau),  v = q * tau * (1 - a^2) / 2  (v = q * dt для блуждания),
+
+    поэтому процесс продвигается сразу к моменту наблюдения, и редкие наблюдения не требуют моделирования
+    промежуточных тактов. Плотность q совпадает с элементом noise_covariance_density фильтра, оценивающего
+    смещение как поле состояния (vel_bias, omega_bias в StateLayout).
+
+    Процесс отсчитывает время от нуля, как Car. Последовательные advance и sample расходуют случайные числа
+    одинаково (size чисел на каждый интервал ненулевой длины), поэтому дают одну и ту же реализацию.
+    """
+    def __init__(self, density, correlation_time=None, initial_std=None, size=1, random_state=None):
+        """
+        :param density: интенсивность q, (единицы значения)^2 / с; скаляр или (size,)
+        :param correlation_time: время корреляции tau в секундах или None (случайное блуждание)
+        :param initial_std: std начального значения; по умолчанию стационарное sqrt(q * tau / 2)
+            для процесса с конечным tau и 0 для блуждания
+        :param size: число компонент (по размеру наблюдения датчика)
+        """
+        self._density = np.broadcast_to(np.asarray(density, dtype=np.float64), (size,)).copy()
+        assert np.all(self._density >= 0)
+        assert correlation_time is None or correlation_time > 0
+        self._correlation_time = None if correlation_time is None else float(correlation_time)
+        self._size = size
+        self._gen = np.random.RandomState(random_state)
+        if initial_std is None:
+            initial_std = 0. if correlation_time is None else np.sqrt(self._density * self._correlation_time / 2.)
+        self._value = np.broadcast_to(np.asarray(initial_std, dtype=np.float64), (size,)) * \
+            self._gen.standard_normal(size)
+        self._time_ns = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def value(self):
+        return np.array(self._value)
+
+    @property
+    def time(self):
+        return Timestamp.nanoseconds(self._time_ns)
+
+    @property
+    def stationary_std(self):
+        """Стационарное std процесса или None для случайного блуждания"""
+        if self._correlation_time is None:
+            return None
+        return np.sqrt(self._density * self._correlation_time / 2.)
+
+    def advance(self, time):
+        """Продвигает процесс к моменту time (Timestamp, не раньше текущего) и возвращает значение"""
+        assert isinstance(time, Timestamp)
+        time_ns = time.to_nanoseconds()
+        assert time_ns >= self._time_ns, 'DriftProcess cannot go back in time'
+        if time_ns > self._time_ns:
+            dt_sec = (time_ns - self._time_ns) / Timestamp.NANO_SEC_COEFF
+            if self._correlation_time is None:
+                self._value = self._value + np.sqrt(self._density * dt_sec) * self._gen.standard_normal(self._size)
+            else:
+                decay = math.exp(-dt_sec / self._correlation_time)
+                std = np.sqrt(self._density * self._correlation_time * (1. - decay**2) / 2.)
+                self._value = decay * self._value + std * self._gen.standard_normal(self._size)
+            self._time_ns = time_ns
+        return np.array(self._value)
+
+    def sample(self, times):
+        """Значения процесса во все моменты times за один векторный проход; процесс продвигается
+        к последнему моменту. Для блуждания - кумулятивная сумма приращений, для процесса с конечным tau -
+        та же рекурсия, развернутая в кумулятивную сумму с множителями exp(t / tau) по частям ограниченной длины.
+        :param times: неубывающие моменты в секундах (T,), не раньше текущего момента процесса
+        :returns: np.ndarray размера (T, size)
+        """
+        times_ns = np.round(np.asarray(times, dtype=np.float64) * Timestamp.NANO_SEC_COEFF).astype(np.int64)
+        times_number = times_ns.shape[0]
+        values = np.empty((times_number, self._size), dtype=np.float64)
+        if times_number == 0:
+            return values
+        intervals = np.diff(times_ns, prepend=self._time_ns)
+        assert np.all(intervals >= 0), 'Times must be non-decreasing and not earlier than the process time'
+        dt_sec = intervals / Timestamp.NANO_SEC_COEFF
+        moving = intervals > 0
+        normals = np.zeros((times_number, self._size), dtype=np.float64)
+        normals[moving] = self._gen.standard_normal((int(np.sum(moving)), self._size))
+
+        if self._correlation_time is None:
+            increments = np.sqrt(self._density[None, :] * dt_sec[:, None]) * normals
+            np.cumsum(increments, axis=0, out=values)
+            values += self._value
+        else:
+            tau = self._correlation_time
+            decays = np.exp(-dt_sec / tau)
+            stds = np.sqrt(self._density[None, :] * tau * (1. - decays[:, None]**2) / 2.)
+            innovations = stds * normals
+            # Прошедшее время в единицах tau
+            elapsed = np.cumsum(dt_sec) / tau
+            previous = self._value
+            begin = 0
+            while begin < times_number:
+                # x_k = exp(-(L_k - L_b)) * (x_b + sum_{b<j<=k} exp(L_j - L_b) * e_j), L - elapsed
+                end = int(np.searchsorted(elapsed, elapsed[begin] + _MAX_SEGMENT_DECAY, side='right'))
+                first = decays[begin] * previous + innovations[begin]
+                growth = np.exp(elapsed[begin:end] - elapsed[begin])[:, None]
+                segment = innovations[begin:end] * growth
+                segment[0] = first
+                np.cumsum(segment, axis=0, out=values[begin:end])
+                values[begin:end] /= growth
+                previous = values[end - 1]
+                begin = end
+        self._value = np.array(values[-1])
+        self._time_ns = int(times_ns[-1])
+        return values
+
+
+def make_drift_process(config, size, random_state=None):
+    """DriftProcess из описания {'density': ..., 'correlation_time': ..., 'initial_std': ...}
+    (поля как у конструктора, кроме size); None - без процесса"""
+    if config is None:
+        return None
+    return DriftProcess(size=size, random_state=random_state, **config)
+
+
+def apply_drift(times, values, bias=None, scale_drift=None):
+    """Искажает массив наблюдений смещением и ошибкой масштаба: (1 + s(t)) * z + b(t).
+    Процессы генерируются векторно и только в моменты наблюдений (строки без NaN), поэтому стоимость
+    не зависит от числа пропущенных тактов.
+    :param times: моменты времени (T,) в секундах
+    :param values: наблюдения (T, m) с NaN в моменты без наблюдения, например из simulate_scenario
+    :param bias: DriftProcess размера m или None
+    :param scale_drift: DriftProcess размера m или None
+    :returns: новый массив (T, m)
+    """
+    values = np.array(values, dtype=np.float64)
+    rows = ~np.isnan(values[:, 0])
+    observed_times = np.asarray(times, dtype=np.float64)[rows]
+    if scale_drift is not None:
+        values[rows] *= 1. + scale_drift.sample(observed_times)
+    if bias is not None:
+        values[rows] += bias.sample(observed_times)
+    return values
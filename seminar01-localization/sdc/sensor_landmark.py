@@ -37,7 +37,7 @@ def get_landmark_position_in_local_frame(x, y, yaw, landmark_x, landmark_y):
 
 def get_landmarks_position_in_local_frame(x, y, yaw, landmarks_xy):
     T_global2local = get_global_to_local_tranform_matrix(x=x, y=y, yaw=yaw)
-    return np.dot(landmarks_xy, T_global2local[:2, :2].T) + T_global2local[:2, 0][None, :]
+    return np.dot(landmarks_xy, T_global2local[:2, :2].T) + T_global2local[:2, 2][None, :]
 
 
 class LandmarkSensor(CarSensorBase):
@@ -60,10 +60,11 @@ class LandmarkSensor(CarSensorBase):
     def _observe_clear(self):
         """Возвращает истинное положение объекта в системе координат машины (локальной системе
         координат)"""
+        state = self._car._state_view
         return get_landmark_position_in_local_frame(
-            x=self._car._position_x,
-            y=self._car._position_y,
-            yaw=self._car._yaw,
+            x=state.position_x,
+            y=state.position_y,
+            yaw=state.yaw,
             landmark_x=self._x,
             landmark_y=self._y)
 
@@ -79,14 +80,9 @@ class LandmarksSensor(CarSensorBase):
         return 2 * self._landmarks_number
 
     def _observe_clear(self):
+        state = self._car._state_view
         return get_landmarks_position_in_local_frame(
-            x=self._car._position_x,
-            y=self._car._position_y,
-            yaw=self._car._yaw,
+            x=state.position_x,
+            y=state.position_y,
+            yaw=state.yaw,
             landmarks_xy=self._landmarks_global_positions)
-
-
-if __name__ != '__main__':
-    sensor = LandmarkSensor(x=5, y=5, noise_variances=[2, 2])
-    assert sensor.observation_size == 2
-    assert np.all(sensor.get_noise_covariance() == np.diag([2, 2]))
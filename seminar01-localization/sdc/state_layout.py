@@ -0,0 +1,167 @@
+import math
+import numpy as np
+
+
+# Поля состояния, смысл которых известен генератору ядер
+KNOWN_FIELDS = {
+    'pos_x': 'x-координата в глобальной системе координат, м',
+    'pos_y': 'y-координата в глобальной системе координат, м',
+    'yaw': 'угол поворота относительно оси oX, рад',
+    'vel': 'линейная скорость, м/с',
+    'omega': 'угловая скорость, рад/с',
+    'acc': 'линейное ускорение, м/с^2 (постоянно на шаге предсказания)',
+    'vel_bias': 'смещение показаний одометрии (CAN), м/с',
+    'omega_bias': 'смещение показаний гироскопа (IMU), рад/с',
+}
+# Поля, без которых модель движения не определена
+REQUIRED_FIELDS = ('pos_x', 'pos_y', 'yaw', 'vel', 'omega')
+
+
+class StateLayout:
+    """Декларативное описание вектора состояния: какие поля в нем есть и в каком порядке.
+    По раскладке строятся специализированные ядра предсказания, матрицы Якоби и матрицы наблюдений
+    (make_move_kernel, make_jacobian_kernel, get_observation_matrix), поэтому для добавления ускорения
+    или смещений датчиков не нужно переписывать модели движения и калмановские сенсоры.
+
+    Пример:
+
+        layout = StateLayout(['pos_x', 'pos_y', 'yaw', 'vel', 'omega', 'acc', 'omega_bias'])
+        kalman_car = KalmanCar(initial_position=[0, 0], state_layout=layout, ...)
+    """
+    def __init__(self, fields):
+        """
+        :param fields: имена полей из KNOWN_FIELDS в порядке их следования в векторе состояния
+        """
+        fields = tuple(fields)
+        assert len(set(fields)) == len(fields), 'Duplicate state fields'
+        for field in fields:
+            assert field in KNOWN_FIELDS, f'Unknown state field {field}'
+        for field in REQUIRED_FIELDS:
+            assert field in fields, f'State field {field} is required'
+        self._fields = fields
+        self._indices = {field: index for index, field in enumerate(fields)}
+        self._observation_matrices = {}
+
+    def __repr__(self):
+        return f'{type(self).__name__}({list(self._fields)})'
+
+    def __eq__(self, other):
+        return isinstance(other, StateLayout) and self._fields == other._fields
+
+    def __hash__(self):
+        return hash(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __contains__(self, field):
+        return field in self._indices
+
+    @property
+    def fields(self):
+        return self._fields
+
+    @property
+    def size(self):
+        return len(self._fields)
+
+    def index(self, field):
+        return self._indices[field]
+
+    def get(self, field):
+        """Номер поля или None, если поля нет в раскладке"""
+        return self._indices.get(field)
+
+    def get_observation_matrix(self, fields):
+        """Матрица наблюдений C для прямого наблюдения полей fields. Если в раскладке есть смещение
+        <поле>_bias, оно добавляется к наблюдению поля. Матрица строится один раз и доступна только для чтения.
+        :param fields: последовательность имен полей
+        :returns: np.ndarray размера (len(fields), size)
+        """
+        fields = tuple(fields)
+        observation_matrix = self._observation_matrices.get(fields)
+        if observation_matrix is None:
+            observation_matrix = np.zeros((len(fields), self.size), dtype=np.float64)
+            for row, field in enumerate(fields):
+                observation_matrix[row, self.index(field)] = 1
+                bias_index = self.get(f'{field}_bias')
+                if bias_index is not None:
+                    observation_matrix[row, bias_index] = 1
+            observation_matrix.setflags(write=False)
+            self._observation_matrices[fields] = observation_matrix
+        return observation_matrix
+
+
+# Раскладка состояния Car: (pos_x, pos_y, yaw, vel, omega)
+DEFAULT_STATE_LAYOUT = StateLayout(REQUIRED_FIELDS)
+
+
+def make_move_kernel(layout):
+    """Строит функцию предсказания move(state, dt_sec, out=None) для одного вектора состояния раскладки layout.
+    Номера полей и вариант модели (с ускорением или без) фиксируются при построении, вычисления идут
+    на числах float без промежуточных массивов. Поля, которые модель не меняет (смещения), переносятся как есть.
+    Если out не задан, результат записывается в новый массив.
+    """
+    pos_x_index, pos_y_index, yaw_index, vel_index, omega_index = [layout.index(field) for field in REQUIRED_FIELDS]
+    acc_index = layout.get('acc')
+
+    def move(state, dt_sec, out=None):
+        values = state.tolist()
+        yaw = values[yaw_index]
+        vel = values[vel_index]
+        values[pos_x_index] += vel * math.cos(yaw) * dt_sec
+        values[pos_y_index] += vel * math.sin(yaw) * dt_sec
+        values[yaw_index] = yaw + values[omega_index] * dt_sec
+        if out is None:
+            return np.array(values, dtype=np.float64)
+        out[:] = values
+        return out
+
+    def move_with_acceleration(state, dt_sec, out=None):
+        values = state.tolist()
+        yaw = values[yaw_index]
+        vel = values[vel_index]
+        values[pos_x_index] += vel * math.cos(yaw) * dt_sec
+        values[pos_y_index] += vel * math.sin(yaw) * dt_sec
+        values[yaw_index] = yaw + values[omega_index] * dt_sec
+        values[vel_index] = vel + values[acc_index] * dt_sec
+        if out is None:
+            return np.array(values, dtype=np.float64)
+        out[:] = values
+        return out
+
+    return move if acc_index is None else move_with_acceleration
+
+
+def make_jacobian_kernel(layout):
+    """Строит функцию jacobian(state, dt_sec, out=None), возвращающую матрицу Якоби функции make_move_kernel(layout)
+    по состоянию. Постоянная часть матрицы (единичная диагональ) заполняется один раз; при повторной передаче
+    того же out переписываются только элементы, зависящие от состояния и шага.
+    :param out: матрица, ранее возвращенная этой функцией, или None для новой матрицы
+    """
+    size = layout.size
+    pos_x_index, pos_y_index, yaw_index, vel_index, omega_index = [layout.index(field) for field in REQUIRED_FIELDS]
+    acc_index = layout.get('acc')
+    rows = [pos_x_index, pos_y_index, pos_x_index, pos_y_index, yaw_index]
+    columns = [vel_index, vel_index, yaw_index, yaw_index, omega_index]
+    if acc_index is not None:
+        rows.append(vel_index)
+        columns.append(acc_index)
+    # Номера изменяемых элементов в развернутой матрице
+    positions = np.ravel_multi_index((rows, columns), (size, size))
+    template = np.eye(size, dtype=np.float64)
+
+    def jacobian(state, dt_sec, out=None):
+        if out is None:
+            out = template.copy()
+        values = state.tolist()
+        vel = values[vel_index]
+        cos_dt = math.cos(values[yaw_index]) * dt_sec
+        sin_dt = math.sin(values[yaw_index]) * dt_sec
+        if acc_index is None:
+            out.flat[positions] = (cos_dt, sin_dt, -vel * sin_dt, vel * cos_dt, dt_sec)
+        else:
+            out.flat[positions] = (cos_dt, sin_dt, -vel * sin_dt, vel * cos_dt, dt_sec, dt_sec)
+        return out
+
+    return jacobian
@@ -0,0 +1,156 @@
+import numpy as np
+
+
+def douglas_peucker(points, tolerance):
+    """Упрощение ломаной алгоритмом Дугласа-Пекера.
+    Все выброшенные точки лежат не дальше tolerance от упрощенной ломаной, первая и последняя точки
+    сохраняются всегда.
+    :param points: np.ndarray размера (N, 2)
+    :param tolerance: допустимое отклонение
+    :returns: отсортированные индексы сохраненных точек
+    """
+    points = np.asarray(points, dtype=np.float64)
+    points_number = points.shape[0]
+    if points_number <= 2:
+        return np.arange(points_number)
+    keep = np.zeros(points_number, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, points_number - 1)]
+    while stack:
+        begin, end = stack.pop()
+        if end - begin < 2:
+            continue
+        start = points[begin]
+        direction = points[end] - start
+        offsets = points[begin + 1:end] - start
+        squared_length = np.dot(direction, direction)
+        # Расстояние до отрезка, а не до прямой: точки, проецирующиеся за концы (например, разворот
+        # на пути туда и обратно), иначе выбрасывались бы при любом удалении от ломаной
+        if squared_length > 0:
+            projections = np.clip(np.dot(offsets, direction) / squared_length, 0., 1.)
+            offsets = offsets - projections[:, None] * direction[None, :]
+        distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            middle = begin + 1 + farthest
+            keep[middle] = True
+            stack.append((begin, middle))
+            stack.append((middle, end))
+    return np.flatnonzero(keep)
+
+
+class TrajectoryLod:
+    """Прореженное представление растущей траектории с ограниченной ошибкой.
+    Точки накапливаются в буфере фиксированного размера; заполненный буфер упрощается алгоритмом
+    Дугласа-Пекера и добавляется к сохраненным точкам. Если сохраненных точек становится больше max_points,
+    допуск удваивается и они упрощаются заново (следующий уровень детализации), поэтому размер представления
+    ограничен, а стоимость добавления точки не зависит от длины траектории.
+    Ограничивающий прямоугольник обновляется при добавлении и не требует прохода по точкам.
+
+    Сохраненные точки вместе с их номерами в исходной траектории (indices) годятся и для компактного хранения:
+    отклонение исходной траектории от ломаной по ним не больше 2 * tolerance.
+    """
+    def __init__(self, tolerance=0.05, max_points=4096, chunk_size=1024):
+        """
+        :param tolerance: начальный допуск упрощения (в единицах координат)
+        :param max_points: максимальное число сохраненных точек
+        :param chunk_size: размер буфера, упрощаемого за один раз
+        """
+        assert chunk_size >= 2 and max_points >= 2
+        self._tolerance = tolerance
+        self._max_points = max_points
+        self._pending = np.empty((chunk_size, 2), dtype=np.float64)
+        self._pending_indices = np.empty(chunk_size, dtype=np.int64)
+        self._pending_size = 0
+        self._points = np.empty((max_points + chunk_size, 2), dtype=np.float64)
+        self._indices = np.empty(max_points + chunk_size, dtype=np.int64)
+        self._size = 0
+        self._count = 0
+        self._bounding_box = np.array([np.inf, -np.inf, np.inf, -np.inf])
+
+    def __len__(self):
+        """Число добавленных точек исходной траектории"""
+        return self._count
+
+    @property
+    def tolerance(self):
+        """Текущий допуск упрощения"""
+        return self._tolerance
+
+    @property
+    def bounding_box(self):
+        """(min_x, max_x, min_y, max_y) всех добавленных точек"""
+        return tuple(self._bounding_box)
+
+    def append(self, x, y):
+        self.extend([x], [y])
+
+    def extend(self, xs, ys):
+        """Добавляет точки (xs, ys) в конец траектории"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        assert xs.shape == ys.shape and xs.ndim == 1
+        if xs.shape[0] == 0:
+            return
+        self._bounding_box = np.array([
+            min(self._bounding_box[0], xs.min()), max(self._bounding_box[1], xs.max()),
+            min(self._bounding_box[2], ys.min()), max(self._bounding_box[3], ys.max())])
+        position = 0
+        chunk_size = self._pending.shape[0]
+        while position < xs.shape[0]:
+            size = min(chunk_size - self._pending_size, xs.shape[0] - position)
+            begin, end = self._pending_size, self._pending_size + size
+            self._pending[begin:end, 0] = xs[position:position + size]
+            self._pending[begin:end, 1] = ys[position:position + size]
+            self._pending_indices[begin:end] = np.arange(self._count, self._count + size)
+            self._pending_size = end
+            self._count += size
+            position += size
+            if self._pending_size == chunk_size:
+                self._flush()
+
+    def _flush(self):
+        """Упрощает буфер и переносит его в сохраненные точки. Последняя точка буфера остается в нем,
+        чтобы соседние куски упрощались с общей точкой стыка."""
+        kept = douglas_peucker(self._pending[:self._pending_size], self._tolerance)[:-1]
+        size = kept.shape[0]
+        self._points[self._size:self._size + size] = self._pending[kept]
+        self._indices[self._size:self._size + size] = self._pending_indices[kept]
+        self._size += size
+        self._pending[0] = self._pending[self._pending_size - 1]
+        self._pending_indices[0] = self._pending_indices[self._pending_size - 1]
+        self._pending_size = 1
+        while self._size > self._max_points:
+            self._coarsen()
+
+    def _coarsen(self):
+        """Переход на следующий уровень детализации: удвоение допуска и повторное упрощение"""
+        self._tolerance *= 2
+        points = np.concatenate([self._points[:self._size], self._pending[:1]])
+        kept = douglas_peucker(points, self._tolerance)[:-1]
+        size = kept.shape[0]
+        self._points[:size] = self._points[kept]
+        self._indices[:size] = self._indices[kept]
+        self._size = size
+
+    @property
+    def points(self):
+        """Точки прореженной траектории (K, 2), включая еще не упрощенный хвост"""
+        return np.concatenate([self._points[:self._size], self._pending[:self._pending_size]])
+
+    @property
+    def indices(self):
+        """Номера точек прореженной траектории в исходной траектории (K,)"""
+        return np.concatenate([self._indices[:self._size], self._pending_indices[:self._pending_size]])
+
+    def get_data(self):
+        """(xs, ys) для отрисовки"""
+        points = self.points
+        return points[:, 0], points[:, 1]
+
+
+def decimate(xs, ys, tolerance):
+    """Упрощение готовой траектории для хранения.
+    :returns: индексы сохраненных точек
+    """
+    return douglas_peucker(np.stack([np.asarray(xs), np.asarray(ys)], axis=1), tolerance)
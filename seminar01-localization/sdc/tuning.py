@@ -0,0 +1,203 @@
+import os
+import json
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+from .car import Car
+from .kalman_batch import filter_arrays
+from .metrics import WelfordAccumulator, get_state_errors, get_mahalanobis_squared
+from .scenario import DEFAULT_SCENARIO, simulate_scenario, get_kalman_observations
+from .scenario_cache import ScenarioCache
+
+
+# Настраиваемые параметры: std шума модели эволюции (как kalman_*_real_noise_std в ноутбуке с EKF)
+NOISE_PARAMETERS = ('xy_noise_std', 'v_noise_std', 'omega_noise_std')
+
+
+def get_noise_covariance_density(xy_noise_std, v_noise_std, omega_noise_std, yaw_noise_std=0.):
+    """Диагональная плотность ковариации шума модели эволюции KalmanMovementModel"""
+    density = np.zeros((5, 5), dtype=np.float64)
+    density[Car.POS_X_INDEX, Car.POS_X_INDEX] = xy_noise_std**2
+    density[Car.POS_Y_INDEX, Car.POS_Y_INDEX] = xy_noise_std**2
+    density[Car.YAW_INDEX, Car.YAW_INDEX] = yaw_noise_std**2
+    density[Car.VEL_INDEX, Car.VEL_INDEX] = v_noise_std**2
+    density[Car.OMEGA_INDEX, Car.OMEGA_INDEX] = omega_noise_std**2
+    return density
+
+
+def get_initial_estimate(scenario, observations):
+    """Начальное состояние фильтра из первых показаний сенсоров. Ненаблюдаемые компоненты
+    (и yaw, который не измеряет ни один сенсор) получают нулевое среднее и большую дисперсию."""
+    mean = np.zeros(5, dtype=np.float64)
+    covariance = np.diag([100., 100., np.pi**2, 100., 100.])
+    for name, (values, C, Q) in get_kalman_observations(scenario, observations).items():
+        indices = np.argmax(C, axis=1)
+        mean[indices] = np.nan_to_num(values[0])
+        if not np.any(np.isnan(values[0])):
+            covariance[indices, indices] = np.diag(Q)
+    return mean, covariance
+
+
+def evaluate_filter(scenario, simulation, params, max_dt=None):
+    """Запускает фильтр Калмана с параметрами params на смоделированном сценарии.
+    :returns: (position_errors_squared (T,), nees (T,))
+    """
+    observations = get_kalman_observations(scenario, simulation['observations'])
+    initial_mean, initial_covariance = get_initial_estimate(scenario, simulation['observations'])
+    means, covariances = filter_arrays(
+        simulation['times'],
+        observations,
+        initial_mean,
+        initial_covariance,
+        noise_covariance_density=get_noise_covariance_density(**params),
+        max_dt=max_dt)
+    errors = get_state_errors(simulation['states'], means)
+    position_errors_squared = np.sum(errors[:, [Car.POS_X_INDEX, Car.POS_Y_INDEX]]**2, axis=1)
+    return position_errors_squared, get_mahalanobis_squared(errors, covariances)
+
+
+def get_config_key(scenario, params, seeds_entropy, seeds_number, max_dt):
+    """Хеш конфигурации для кеша результатов"""
+    description = json.dumps(
+        {'scenario': scenario, 'params': params, 'entropy': str(seeds_entropy),
+         'seeds_number': seeds_number, 'max_dt': max_dt},
+        sort_keys=True, default=float)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def _evaluate_config(task):
+    """Оценка одной конфигурации по всем seed. Выполняется в процессе пула."""
+    key, scenario, params, seeds, max_dt, scenario_cache_directory = task
+    scenario_cache = None
+    if scenario_cache_directory is not None:
+        scenario_cache = ScenarioCache(scenario_cache_directory)
+    squared_errors = WelfordAccumulator()
+    nees = WelfordAccumulator()
+    for seed in seeds:
+        if scenario_cache is not None:
+            simulation = scenario_cache.get_scenario(scenario, seed)
+        else:
+            simulation = simulate_scenario(scenario, seed)
+        position_errors_squared, seed_nees = evaluate_filter(scenario, simulation, params, max_dt)
+        squared_errors.update_batch(position_errors_squared)
+        nees.update_batch(seed_nees)
+    return {
+        'key': key,
+        'params': params,
+        'position_rmse': float(np.sqrt(squared_errors.mean)),
+        'nees': float(nees.mean),
+        'nees_std': float(nees.std),
+        'seeds_number': len(seeds),
+    }
+
+
+def get_parameters_grid(**values):
+    """Декартово произведение значений параметров.
+    Пример: get_parameters_grid(xy_noise_std=[0.1, 1.], v_noise_std=[0.1], omega_noise_std=[0.1, 0.5])
+    :returns: список dict
+    """
+    names = sorted(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def load_results(cache_path):
+    """Читает результаты, сохраненные в кеше (по одной json-записи на строку)"""
+    results = {}
+    if cache_path is None or not os.path.exists(cache_path):
+        return results
+    with open(cache_path) as cache_file:
+        for line in cache_file:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # Последняя строка могла остаться недописанной при прерывании
+                continue
+            results[result['key']] = result
+    return results
+
+
+def sweep(
+        params_grid,
+        scenario=None,
+        seeds_number=8,
+        random_state=0,
+        workers_number=None,
+        cache_path=None,
+        max_dt=None,
+        scenario_cache_directory=None):
+    """Перебор параметров шума фильтра Калмана по сетке.
+    Каждая конфигурация оценивается на seeds_number реализациях сценария. Seed реализаций порождаются
+    из random_state через SeedSequence и одинаковы для всех конфигураций, поэтому конфигурации
+    сравниваются на одних и тех же данных. Конфигурации распределяются по пулу процессов, каждый готовый
+    результат сразу дописывается в cache_path, поэтому прерванный перебор продолжается с того же места.
+
+    :param params_grid: список dict с ключами NOISE_PARAMETERS (см. get_parameters_grid)
+    :param scenario: описание сценария (см. scenario.DEFAULT_SCENARIO)
+    :param seeds_number: число реализаций сценария на конфигурацию
+    :param random_state: seed для SeedSequence
+    :param workers_number: число процессов; None - по числу ядер, 1 - в текущем процессе
+    :param cache_path: путь к файлу с результатами или None
+    :param max_dt: максимальный шаг интегрирования фильтра, см. filter_arrays
+    :param scenario_cache_directory: каталог ScenarioCache для смоделированных реализаций или None
+    :returns: список dict с полями params, position_rmse, nees, nees_std, seeds_number в порядке params_grid
+    """
+    if scenario is None:
+        scenario = DEFAULT_SCENARIO
+    seed_sequence = np.random.SeedSequence(random_state)
+    seeds = seed_sequence.spawn(seeds_number)
+
+    cached = load_results(cache_path)
+    keys = [get_config_key(scenario, params, seed_sequence.entropy, seeds_number, max_dt) for params in params_grid]
+    tasks = [
+        (key, scenario, params, seeds, max_dt, scenario_cache_directory)
+        for key, params in zip(keys, params_grid) if key not in cached]
+
+    results = dict(cached)
+    cache_file = open(cache_path, 'a') if cache_path is not None else None
+    pool = None
+    try:
+        if workers_number == 1:
+            completed = map(_evaluate_config, tasks)
+        else:
+            pool = multiprocessing.Pool(workers_number)
+            completed = pool.imap_unordered(_evaluate_config, tasks)
+        for result in completed:
+            results[result['key']] = result
+            if cache_file is not None:
+                cache_file.write(json.dumps(result) + '\n')
+                cache_file.flush()
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        # При ошибке или прерывании рабочие процессы не должны пережить sweep
+        if pool is not None:
+            pool.terminate()
+        if cache_file is not None:
+            cache_file.close()
+    return [results[key] for key in keys]
+
+
+def format_report(results, state_size=5):
+    """Таблица результатов, отсортированная по RMSE положения.
+    Для состоятельного фильтра средний NEES близок к размеру состояния."""
+    lines = ['{:>12} {:>12} {:>15} {:>13} {:>10} {:>10}'.format(
+        'xy_noise', 'v_noise', 'omega_noise', 'position_rmse', 'nees', 'nees/n')]
+    for result in sorted(results, key=lambda result: result['position_rmse']):
+        params = result['params']
+        lines.append('{:>12.4g} {:>12.4g} {:>15.4g} {:>13.4f} {:>10.3f} {:>10.3f}'.format(
+            params['xy_noise_std'], params['v_noise_std'], params['omega_noise_std'],
+            result['position_rmse'], result['nees'], result['nees'] / state_size))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    grid = get_parameters_grid(
+        xy_noise_std=[0.01, 0.1, 1.],
+        v_noise_std=[0.01, 0.1, 1.],
+        omega_noise_std=[0.01, 0.1, 1.])
+    print(format_report(sweep(grid, seeds_number=8, cache_path='tuning_results.jsonl')))